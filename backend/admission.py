@@ -0,0 +1,190 @@
+"""
+Admission control and backpressure for the prediction endpoints
+
+At most ADMISSION_MAX_CONCURRENT prediction requests run at once (each
+holds its upload in memory and occupies the CPU), and at most
+ADMISSION_MAX_QUEUE more wait for a slot. Everything beyond that is
+rejected immediately with 429 and a Retry-After estimated from an EWMA of
+recent service times. check() applies the same rule before the request body
+is read, so turning a request away is cheap. The slot itself is taken only
+after the upload has been received and held around preprocessing and
+inference, so a slow uploader never occupies one.
+
+Waiters are admitted by priority, then arrival: clinical users (Admin,
+Embryologist) first, other authenticated users next, anonymous traffic last.
+When the queue is full, a higher-priority arrival displaces the newest
+lower-priority waiter, which gets the 429 instead. A waiter that is not
+admitted within ADMISSION_QUEUE_TIMEOUT_S is also turned away with 429.
+"""
+
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+
+from fastapi import HTTPException
+
+from metrics import Histogram
+
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", str(max(2, (os.cpu_count() or 1) * 2))))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "32"))
+ADMISSION_QUEUE_TIMEOUT_S = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_S", "30"))
+SERVICE_TIME_ALPHA = 0.2
+INITIAL_SERVICE_TIME_S = 0.5
+
+PRIORITY_CLINICAL = 0
+PRIORITY_AUTHENTICATED = 1
+PRIORITY_ANONYMOUS = 2
+PRIORITY_NAMES = {PRIORITY_CLINICAL: "clinical", PRIORITY_AUTHENTICATED: "authenticated", PRIORITY_ANONYMOUS: "anonymous"}
+CLINICAL_ROLES = ("Admin", "Embryologist")
+
+QUEUE_WAIT_BUCKETS_MS = (1, 5, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+def priority_for(user) -> int:
+    # Deactivated accounts get no priority
+    if user is None or not user.is_active:
+        return PRIORITY_ANONYMOUS
+    return PRIORITY_CLINICAL if user.role in CLINICAL_ROLES else PRIORITY_AUTHENTICATED
+
+
+class _Waiter:
+    def __init__(self, priority: int, sequence: int, future: asyncio.Future):
+        self.priority = priority
+        self.sequence = sequence
+        self.future = future
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.sequence) < (other.priority, other.sequence)
+
+
+class AdmissionController:
+    def __init__(self, max_concurrent: int = ADMISSION_MAX_CONCURRENT, max_queue: int = ADMISSION_MAX_QUEUE,
+                 queue_timeout_s: float = ADMISSION_QUEUE_TIMEOUT_S):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout_s = queue_timeout_s
+        self.active = 0
+        self.service_time_s = INITIAL_SERVICE_TIME_S
+        self.queue_wait_ms = Histogram(QUEUE_WAIT_BUCKETS_MS)
+        self.admitted: Dict[str, int] = {name: 0 for name in PRIORITY_NAMES.values()}
+        self.rejected: Dict[str, int] = {"queue_full": 0, "displaced": 0, "timeout": 0}
+        self._waiters: List[_Waiter] = []
+        self._sequence = itertools.count()
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely free: the work ahead divided across the slots"""
+        ahead = self.active + len(self._waiters)
+        return max(1, math.ceil(self.service_time_s * ahead / self.max_concurrent))
+
+    def _reject(self, reason: str) -> HTTPException:
+        self.rejected[reason] += 1
+        return HTTPException(
+            status_code=429,
+            detail=f"Prediction service is busy ({reason.replace('_', ' ')}); retry later",
+            headers={"Retry-After": str(self.retry_after())}
+        )
+
+    def _grant_next(self):
+        """Hand free slots to the best waiters (their coroutines count themselves in)"""
+        while self._waiters and self.active < self.max_concurrent:
+            waiter = heapq.heappop(self._waiters)
+            if not waiter.future.done():
+                self.active += 1
+                waiter.future.set_result(True)
+
+    def _displaceable(self, priority: int) -> Optional[_Waiter]:
+        """
+        When the queue is full, the waiter a new arrival would displace (the
+        newest of the lowest priority); raises 429 if it outranks no one
+        """
+        victim = max(self._waiters) if self._waiters else None
+        if victim is None or victim.priority <= priority:
+            raise self._reject("queue_full")
+        return victim
+
+    def check(self, priority: int):
+        """Cheap early 429 for an arrival that could not even queue right now"""
+        if self.active < self.max_concurrent or len(self._waiters) < self.max_queue:
+            return
+        self._displaceable(priority)
+
+    async def acquire(self, priority: int):
+        started = time.perf_counter()
+        if self.active < self.max_concurrent and not self._waiters:
+            self.active += 1
+        else:
+            if len(self._waiters) >= self.max_queue:
+                # Full: only a higher-priority arrival gets in, by displacing the newest lowest-priority waiter
+                victim = self._displaceable(priority)
+                self._waiters.remove(victim)
+                heapq.heapify(self._waiters)
+                victim.future.set_exception(self._reject("displaced"))
+
+            waiter = _Waiter(priority, next(self._sequence), asyncio.get_running_loop().create_future())
+            heapq.heappush(self._waiters, waiter)
+            try:
+                # asyncio.wait, unlike wait_for, never swallows a cancellation that lands as the slot is granted
+                done, _ = await asyncio.wait({waiter.future}, timeout=self.queue_timeout_s)
+                if not done:
+                    self._discard(waiter)
+                    raise self._reject("timeout")
+                # Raises the 429 if the waiter was displaced meanwhile
+                waiter.future.result()
+            except HTTPException:
+                raise
+            except BaseException:
+                if waiter.future.done() and not waiter.future.cancelled() and waiter.future.exception() is None:
+                    # Cancelled after being granted: give the slot back
+                    self.release()
+                else:
+                    self._discard(waiter)
+                raise
+        self.admitted[PRIORITY_NAMES[priority]] += 1
+        self.queue_wait_ms.observe((time.perf_counter() - started) * 1000)
+
+    def _discard(self, waiter: _Waiter):
+        if waiter in self._waiters:
+            self._waiters.remove(waiter)
+            heapq.heapify(self._waiters)
+        if not waiter.future.done():
+            waiter.future.cancel()
+
+    def release(self, service_time_s: Optional[float] = None):
+        if service_time_s is not None:
+            self.service_time_s += SERVICE_TIME_ALPHA * (service_time_s - self.service_time_s)
+        self.active -= 1
+        self._grant_next()
+
+    @asynccontextmanager
+    async def slot(self, priority: int):
+        await self.acquire(priority)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - started)
+
+    def stats(self) -> Dict:
+        queued = {name: 0 for name in PRIORITY_NAMES.values()}
+        for waiter in self._waiters:
+            queued[PRIORITY_NAMES[waiter.priority]] += 1
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "queue_depth": len(self._waiters),
+            "queued": queued,
+            "admitted": dict(self.admitted),
+            "rejected": dict(self.rejected),
+            "service_time_ewma_ms": round(self.service_time_s * 1000, 3),
+            "retry_after_s": self.retry_after(),
+            "queue_wait_ms": self.queue_wait_ms.snapshot(),
+        }
+
+
+admission = AdmissionController()
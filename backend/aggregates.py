@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Incrementally maintained prediction aggregates for the dashboards
+
+The overview charts (stage distribution, quality trends, viability chart,
+summary cards) need counts, means and distributions across predictions.
+Instead of scanning predictions or the audit log on every load, running
+totals are kept per group in prediction_aggregates:
+
+    scope "cycle"          key = cycle pk
+    scope "day"            key = UTC date, YYYY-MM-DD
+    scope "model_version"  key = model version
+
+Each group holds the prediction count, the "good" count, the sum and sum of
+squares of the viability score (so mean and standard deviation come out in
+O(1)), the confidence sum, a confidence-level histogram and the override
+count. The rows are upserted in the same transaction as the prediction or
+override that changes them, so they never disagree with committed data.
+
+An override is counted against its cycle, the day it was made and the model
+version of the embryo's latest prediction at that time.
+
+Rebuild the tables from predictions and the audit trail (from the backend folder):
+    python aggregates.py --rebuild
+"""
+
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+import argparse
+import math
+import os
+import sys
+
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.orm import Session
+
+from models import AuditLog, Cycle, Embryo, Patient, Prediction, PredictionAggregate
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SCOPES = ("cycle", "day", "model_version")
+CONFIDENCE_LEVEL_COLUMNS = {
+    "high": "confidence_high",
+    "medium": "confidence_medium",
+    "low": "confidence_low",
+}
+COUNTER_COLUMNS = (
+    "prediction_count", "good_count", "viability_sum", "viability_sum_sq", "confidence_sum",
+    *CONFIDENCE_LEVEL_COLUMNS.values(), "override_count",
+)
+
+Group = Tuple[str, str]
+
+
+def day_key(moment: datetime) -> str:
+    return moment.strftime("%Y-%m-%d")
+
+
+def prediction_values(prediction: Prediction) -> Dict[str, Any]:
+    """The Prediction fields the aggregates are computed from"""
+    return {
+        "cycle_id": prediction.cycle_id,
+        "created_at": prediction.created_at,
+        "model_version": prediction.model_version,
+        "prediction": prediction.prediction,
+        "viability_score": prediction.viability_score,
+        "confidence": prediction.confidence,
+        "confidence_level": prediction.confidence_level,
+    }
+
+
+def _add_prediction_deltas(totals: Dict[Group, Dict[str, float]], row: Mapping[str, Any]):
+    created_at = row.get("created_at") or datetime.utcnow()
+    viability = float(row["viability_score"])
+    level_column = CONFIDENCE_LEVEL_COLUMNS.get(row["confidence_level"])
+    for group in (("cycle", str(row["cycle_id"])), ("day", day_key(created_at)),
+                  ("model_version", row["model_version"])):
+        deltas = totals[group]
+        deltas["prediction_count"] += 1
+        deltas["good_count"] += row["prediction"] == "good"
+        deltas["viability_sum"] += viability
+        deltas["viability_sum_sq"] += viability * viability
+        deltas["confidence_sum"] += float(row["confidence"])
+        if level_column:
+            deltas[level_column] += 1
+
+
+def _new_totals() -> Dict[Group, Dict[str, float]]:
+    return defaultdict(lambda: dict.fromkeys(COUNTER_COLUMNS, 0))
+
+
+def _upsert(db: Session, group: Group, deltas: Dict[str, float]):
+    """Add deltas to a group's counters in place, creating the row if needed"""
+    table = PredictionAggregate.__table__
+    scope, key = group
+    now = datetime.utcnow()
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        statement = dialect_insert(table).values(scope=scope, key=key, updated_at=now, **deltas)
+        statement = statement.on_conflict_do_update(
+            index_elements=["scope", "key"],
+            set_={**{column: table.c[column] + statement.excluded[column] for column in deltas},
+                  "updated_at": now}
+        )
+        db.execute(statement)
+        return
+    updated = db.execute(
+        update(table)
+        .where(table.c.scope == scope, table.c.key == key)
+        .values(updated_at=now, **{column: table.c[column] + value for column, value in deltas.items()})
+    ).rowcount
+    if not updated:
+        db.execute(insert(table).values(scope=scope, key=key, updated_at=now, **deltas))
+
+
+def add_predictions(db: Session, rows: Iterable[Mapping[str, Any]]):
+    """Count new predictions (mappings with the prediction_values fields); caller commits"""
+    totals = _new_totals()
+    for row in rows:
+        _add_prediction_deltas(totals, row)
+    for group, deltas in totals.items():
+        _upsert(db, group, deltas)
+
+
+def override_groups(db: Session, patient_audit_code: Optional[str], cycle_id: Optional[str],
+                    embryo_id: Optional[str], at: datetime) -> List[Group]:
+    """The groups an override made at `at` counts against"""
+    groups = [("day", day_key(at))]
+    cycle = (
+        db.query(Cycle)
+        .join(Patient, Patient.id == Cycle.patient_id)
+        .filter(Patient.audit_code == patient_audit_code, Cycle.cycle_id == cycle_id)
+        .first()
+    )
+    if cycle is None:
+        return groups
+    groups.append(("cycle", str(cycle.id)))
+    model_version = db.execute(
+        select(Prediction.model_version)
+        .join(Embryo, Embryo.id == Prediction.embryo_id)
+        .where(Embryo.cycle_id == cycle.id, Embryo.embryo_id == embryo_id, Prediction.created_at <= at)
+        .order_by(Prediction.created_at.desc(), Prediction.id.desc())
+        .limit(1)
+    ).scalar()
+    if model_version is not None:
+        groups.append(("model_version", model_version))
+    return groups
+
+
+def add_override(db: Session, patient_audit_code: str, cycle_id: str, embryo_id: str,
+                 at: Optional[datetime] = None):
+    """Count an AI override; caller commits"""
+    for group in override_groups(db, patient_audit_code, cycle_id, embryo_id, at or datetime.utcnow()):
+        _upsert(db, group, {"override_count": 1})
+
+
+def group_stats(row: PredictionAggregate) -> Dict[str, Any]:
+    n = row.prediction_count
+    mean = row.viability_sum / n if n else 0.0
+    variance = max(row.viability_sum_sq / n - mean * mean, 0.0) if n else 0.0
+    return {
+        "scope": row.scope,
+        "key": row.key,
+        "prediction_count": n,
+        "good_count": row.good_count,
+        "good_rate": row.good_count / n if n else 0.0,
+        "mean_viability": mean,
+        "std_viability": math.sqrt(variance),
+        "mean_confidence": row.confidence_sum / n if n else 0.0,
+        "confidence_levels": {level: getattr(row, column) for level, column in CONFIDENCE_LEVEL_COLUMNS.items()},
+        "override_count": row.override_count,
+        "override_rate": row.override_count / n if n else 0.0,
+        "updated_at": row.updated_at,
+    }
+
+
+def get_group(db: Session, scope: str, key: str) -> Optional[PredictionAggregate]:
+    return db.query(PredictionAggregate).filter(PredictionAggregate.scope == scope, PredictionAggregate.key == key).first()
+
+
+def list_groups(db: Session, scope: str, start: Optional[str] = None, end: Optional[str] = None,
+                limit: int = 366) -> List[PredictionAggregate]:
+    """Groups of a scope in key order; day keys sort chronologically, so start/end bound a date range"""
+    query = db.query(PredictionAggregate).filter(PredictionAggregate.scope == scope)
+    if start is not None:
+        query = query.filter(PredictionAggregate.key >= start)
+    if end is not None:
+        query = query.filter(PredictionAggregate.key <= end)
+    return query.order_by(PredictionAggregate.key).limit(limit).all()
+
+
+def rebuild(db: Session, chunk_size: int = 10000) -> Dict[str, int]:
+    """Recompute every group from predictions and AI_OVERRIDE audit entries in one transaction"""
+    totals = _new_totals()
+    table = Prediction.__table__
+    columns = [table.c.id, *(table.c[name] for name in (
+        "cycle_id", "created_at", "model_version", "prediction", "viability_score", "confidence", "confidence_level"))]
+    predictions = 0
+    last_id = 0
+    while True:
+        rows = db.execute(select(*columns).where(table.c.id > last_id).order_by(table.c.id).limit(chunk_size)).mappings().all()
+        if not rows:
+            break
+        for row in rows:
+            _add_prediction_deltas(totals, row)
+        predictions += len(rows)
+        last_id = rows[-1]["id"]
+
+    overrides = db.query(AuditLog.patient_audit_code, AuditLog.cycle_id, AuditLog.embryo_id, AuditLog.timestamp) \
+        .filter(AuditLog.action == "AI_OVERRIDE").all()
+    for patient_code, cycle_code, embryo_code, timestamp in overrides:
+        for group in override_groups(db, patient_code, cycle_code, embryo_code, timestamp or datetime.utcnow()):
+            totals[group]["override_count"] += 1
+
+    now = datetime.utcnow()
+    try:
+        db.execute(delete(PredictionAggregate.__table__))
+        if totals:
+            db.execute(insert(PredictionAggregate.__table__), [
+                {"scope": scope, "key": key, "updated_at": now, **deltas} for (scope, key), deltas in totals.items()
+            ])
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+    return {"predictions": predictions, "overrides": len(overrides), "groups": len(totals)}
+
+
+def main_cli(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Maintain the prediction aggregate tables")
+    parser.add_argument("--rebuild", action="store_true", help="Recompute all aggregates from scratch")
+    args = parser.parse_args(argv)
+    if not args.rebuild:
+        parser.print_help()
+        return 1
+
+    os.chdir(BACKEND_DIR)
+    from database import SessionLocal, engine
+    from models import Base
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        counts = rebuild(db)
+    finally:
+        db.close()
+    print(f"Rebuilt {counts['groups']} aggregate groups from {counts['predictions']} predictions "
+          f"and {counts['overrides']} overrides")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
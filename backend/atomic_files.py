@@ -0,0 +1,30 @@
+"""
+Atomic file writes
+
+The content goes to a temporary file in the target's directory, which is
+then renamed over the target, so readers see either the old file or the
+complete new one, never a partial write. Used by the image store, the
+feature cache and shards, and the audit archive.
+"""
+
+from typing import BinaryIO, Callable, Optional
+import os
+import tempfile
+
+
+def atomic_write(path: str, write: Callable[[BinaryIO], None], fsync: bool = False, mode: Optional[int] = None):
+    """Create or replace `path` with what write(f) writes; fsync before the rename, and chmod to mode, if given"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        if mode is not None:
+            os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
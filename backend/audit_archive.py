@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Hot/cold archival of the audit trail
+
+audit_logs is append-only and grows with every request. To keep the hot
+table and its indexes small, entries older than AUDIT_HOT_DAYS are moved
+out, one calendar month at a time. Each batch is written to a compressed,
+read-only segment under AUDIT_ARCHIVE_DIR:
+
+    audit-<YYYY-MM>-<first id>-<last id>.jsonl.gz    one JSON object per row, all columns
+
+Each segment is recorded in the audit_archive_segments manifest with its
+id and time range, row count and SHA-256. A segment is written and
+read back first. The manifest row is inserted and the archived rows are
+deleted in one transaction after that, so a crash at any point loses
+nothing. A crash can leave an orphan file, which the next run overwrites.
+
+Only entries already counted in the hourly rollups (id <= the rollup
+high-water mark) are archived. AI_OVERRIDE entries stay hot, because
+rankings and aggregates read them live, and so does the newest entry.
+
+Reads span both tiers. The manifest picks the segments that overlap the
+requested time range, and the same filters are applied to their rows.
+Segments are immutable, so recently read ones are kept decoded in memory.
+
+The app archives every AUDIT_ARCHIVE_INTERVAL_S seconds (0 disables it). To
+run it by hand (from the backend folder):
+    python audit_archive.py --older-than-days 90
+"""
+
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import operator
+import os
+import sys
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.orm import Session
+
+from atomic_files import atomic_write
+from models import AuditArchiveSegment, AuditLog
+from periodic import run_periodically
+
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+AUDIT_ARCHIVE_DIR = os.getenv("AUDIT_ARCHIVE_DIR", os.path.join(BACKEND_DIR, "audit_archive"))
+AUDIT_HOT_DAYS = float(os.getenv("AUDIT_HOT_DAYS", "90"))
+AUDIT_ARCHIVE_INTERVAL_S = float(os.getenv("AUDIT_ARCHIVE_INTERVAL_S", "86400"))
+AUDIT_ARCHIVE_SEGMENT_ROWS = int(os.getenv("AUDIT_ARCHIVE_SEGMENT_ROWS", "100000"))
+ARCHIVE_EXCLUDED_ACTIONS = ("AI_OVERRIDE",)
+DELETE_BATCH_SIZE = 500
+
+ENTRY_COLUMNS = [column.name for column in AuditLog.__table__.columns]
+
+# (column, operator, value) filters, applied to the hot table in SQL and to archived rows in Python
+AuditFilter = Tuple[str, str, Any]
+FILTER_OPERATORS = {
+    "==": operator.eq,
+    ">=": operator.ge,
+    "<=": operator.le,
+    ">": operator.gt,
+    "<": operator.lt,
+}
+
+
+def naive_utc(value: Any) -> Any:
+    """A timezone-aware datetime as naive UTC, the way audit timestamps are stored and archived"""
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def normalize_filters(filters: Sequence[AuditFilter]) -> List[AuditFilter]:
+    return [(column, op, naive_utc(value)) for column, op, value in filters]
+
+
+def sql_conditions(filters: Sequence[AuditFilter]) -> list:
+    return [FILTER_OPERATORS[op](getattr(AuditLog, column), value) for column, op, value in filters]
+
+
+def matches(entry: Dict[str, Any], filters: Sequence[AuditFilter]) -> bool:
+    # NULL never matches, as in SQL
+    for column, op, value in filters:
+        actual = entry.get(column)
+        if actual is None or not FILTER_OPERATORS[op](actual, value):
+            return False
+    return True
+
+
+def audit_entry(log: AuditLog) -> Dict[str, Any]:
+    return {name: getattr(log, name) for name in ENTRY_COLUMNS}
+
+
+def _encode(entry: Dict[str, Any]) -> str:
+    return json.dumps({**entry, "timestamp": entry["timestamp"].isoformat() if entry["timestamp"] else None},
+                      separators=(",", ":"), sort_keys=True)
+
+
+def _decode(line: bytes) -> Dict[str, Any]:
+    entry = json.loads(line)
+    if entry.get("timestamp"):
+        entry["timestamp"] = datetime.fromisoformat(entry["timestamp"])
+    return entry
+
+
+def segment_path(filename: str) -> str:
+    return os.path.join(AUDIT_ARCHIVE_DIR, filename)
+
+
+@lru_cache(maxsize=8)
+def read_segment(filename: str, sha256: str) -> Tuple[Dict[str, Any], ...]:
+    """All rows of a segment, checked against the manifest hash (cached; treat as read-only)"""
+    with open(segment_path(filename), "rb") as f:
+        data = f.read()
+    if hashlib.sha256(data).hexdigest() != sha256:
+        raise RuntimeError(f"Audit archive segment {filename} does not match its manifest hash")
+    return tuple(_decode(line) for line in gzip.decompress(data).splitlines() if line)
+
+
+def _time_bounds(filters: Sequence[AuditFilter]) -> Tuple[Optional[datetime], Optional[datetime]]:
+    start = end = None
+    for column, op, value in filters:
+        if column == "timestamp" and op in (">=", ">"):
+            start = value if start is None else max(start, value)
+        elif column == "timestamp" and op in ("<=", "<"):
+            end = value if end is None else min(end, value)
+        elif column == "timestamp" and op == "==":
+            start = end = value
+    return start, end
+
+
+def archived_entries(db: Session, filters: Sequence[AuditFilter]) -> List[Dict[str, Any]]:
+    """Archived rows matching the filters; only segments overlapping the filtered time range are read"""
+    filters = normalize_filters(filters)
+    start, end = _time_bounds(filters)
+    query = db.query(AuditArchiveSegment)
+    if start is not None:
+        query = query.filter(AuditArchiveSegment.end_time >= start)
+    if end is not None:
+        query = query.filter(AuditArchiveSegment.start_time <= end)
+    entries = []
+    for segment in query.order_by(AuditArchiveSegment.first_id).all():
+        entries.extend(dict(entry) for entry in read_segment(segment.filename, segment.sha256) if matches(entry, filters))
+    return entries
+
+
+def _write_segment(filename: str, entries: List[Dict[str, Any]]) -> Tuple[str, int]:
+    """Write, fsync, verify and make the segment read-only; returns (sha256, size)"""
+    os.makedirs(AUDIT_ARCHIVE_DIR, exist_ok=True)
+    payload = gzip.compress("".join(_encode(entry) + "\n" for entry in entries).encode("utf-8"), compresslevel=9)
+    atomic_write(segment_path(filename), lambda f: f.write(payload), fsync=True, mode=0o444)
+    sha256 = hashlib.sha256(payload).hexdigest()
+    written = read_segment.__wrapped__(filename, sha256)
+    if len(written) != len(entries) or written[-1]["id"] != entries[-1]["id"]:
+        raise RuntimeError(f"Audit archive segment {filename} failed verification")
+    return sha256, len(payload)
+
+
+def archive_audit_logs(db: Session, older_than: datetime,
+                       segment_rows: int = AUDIT_ARCHIVE_SEGMENT_ROWS) -> Dict[str, int]:
+    """Move rolled-up entries older than `older_than` into archive segments"""
+    from audit_rollups import high_water_id, roll_up
+    roll_up(db)
+    # The newest entry always stays hot: SQLite reuses the ids of deleted rows
+    # at the end of a table, and the hash chain needs ids to keep rising
+    newest = db.execute(select(func.max(AuditLog.id))).scalar() or 0
+    mark = min(high_water_id(db), newest - 1)
+    candidates = [AuditLog.timestamp < older_than, AuditLog.id <= mark,
+                  AuditLog.action.not_in(ARCHIVE_EXCLUDED_ACTIONS)]
+    segments = rows = 0
+    while True:
+        first = db.execute(select(func.min(AuditLog.timestamp)).where(*candidates)).scalar()
+        if first is None:
+            break
+        month = first.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        next_month = (month + timedelta(days=32)).replace(day=1)
+        logs = (
+            db.query(AuditLog)
+            .filter(*candidates, AuditLog.timestamp >= month, AuditLog.timestamp < next_month)
+            .order_by(AuditLog.id)
+            .limit(segment_rows)
+            .all()
+        )
+        entries = [audit_entry(log) for log in logs]
+        ids = [entry["id"] for entry in entries]
+        filename = f"audit-{month:%Y-%m}-{ids[0]:010d}-{ids[-1]:010d}.jsonl.gz"
+        sha256, size = _write_segment(filename, entries)
+        try:
+            db.add(AuditArchiveSegment(
+                filename=filename, first_id=ids[0], last_id=ids[-1],
+                start_time=min(entry["timestamp"] for entry in entries),
+                end_time=max(entry["timestamp"] for entry in entries),
+                row_count=len(entries), sha256=sha256, size_bytes=size
+            ))
+            for i in range(0, len(ids), DELETE_BATCH_SIZE):
+                db.execute(delete(AuditLog.__table__).where(AuditLog.__table__.c.id.in_(ids[i:i + DELETE_BATCH_SIZE])))
+            db.commit()
+        except BaseException:
+            db.rollback()
+            raise
+        db.expire_all()
+        segments += 1
+        rows += len(entries)
+        logger.info(f"Archived {len(entries)} audit entries to {filename}")
+    return {"segments": segments, "rows": rows}
+
+
+async def archive_forever(session_factory, interval_s: float = AUDIT_ARCHIVE_INTERVAL_S,
+                          hot_days: float = AUDIT_HOT_DAYS):
+    """Background loop for the app lifespan: archive, then sleep"""
+    await run_periodically("Audit archival", session_factory,
+                           lambda db: archive_audit_logs(db, datetime.utcnow() - timedelta(days=hot_days)), interval_s)
+
+
+def main_cli(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Move old audit entries into compressed archive segments")
+    parser.add_argument("--older-than-days", type=float, default=AUDIT_HOT_DAYS,
+                        help="Archive entries older than this many days")
+    parser.add_argument("--segment-rows", type=int, default=AUDIT_ARCHIVE_SEGMENT_ROWS)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    os.chdir(BACKEND_DIR)
+    from database import SessionLocal, engine
+    from migrations import run_migrations
+    from models import Base
+
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine, SessionLocal)
+    db = SessionLocal()
+    try:
+        result = archive_audit_logs(db, datetime.utcnow() - timedelta(days=args.older_than_days), args.segment_rows)
+    finally:
+        db.close()
+    print(f"Archived {result['rows']} audit entries into {result['segments']} segments under {AUDIT_ARCHIVE_DIR}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
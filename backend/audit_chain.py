@@ -0,0 +1,349 @@
+"""
+Tamper-evident hash chain over the audit trail
+
+Every audit_logs row carries prev_hash and row_hash:
+
+    row_hash = SHA-256(prev_hash + "\\n" + canonical JSON of the row's HASHED_COLUMNS)
+
+The chain follows id order. prev_hash of the first chained row is
+GENESIS_HASH. Editing a row changes its hash. Deleting or reordering rows
+breaks the next link. The head (last id and hash) lives in
+audit_chain_state.
+
+Entries are appended under a lock on the state row. That is SELECT ... FOR
+UPDATE on PostgreSQL and the database write lock on SQLite, taken by a no-op
+UPDATE first. So concurrent writers, including other workers, extend the
+chain one at a time within their own transactions. append_entries serves the
+ORM write path in audit_logger.py. insert_entries serves batched inserts:
+one lock, hashes computed in order, one executemany.
+
+Verification streams rows in id order in fixed-size chunks, from the hot
+table merged with any archive segments (see audit_archive.py), so memory
+stays bounded. After a successful check, a checkpoint (last id, head hash,
+row count) is stored with an HMAC-SHA256 signature keyed by AUDIT_CHAIN_KEY.
+An incremental check starts at the newest checkpoint whose signature is
+valid and only reads the rows after it. A full check walks the whole chain
+and also confirms every checkpoint it passes. The app writes a checkpoint
+every AUDIT_CHECKPOINT_INTERVAL_S seconds (0 disables it).
+
+Without AUDIT_CHAIN_KEY no checkpoints are written, and verification ignores
+the stored ones: it walks the whole chain and reports itself as unsigned.
+"""
+
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+import hashlib
+import heapq
+import hmac
+import json
+import logging
+import os
+import time
+
+from sqlalchemy import bindparam, func, insert, select, update
+from sqlalchemy.orm import Session
+
+from models import AuditArchiveSegment, AuditChainCheckpoint, AuditChainState, AuditLog
+from periodic import run_periodically
+
+logger = logging.getLogger(__name__)
+
+AUDIT_CHECKPOINT_INTERVAL_S = float(os.getenv("AUDIT_CHECKPOINT_INTERVAL_S", "3600"))
+VERIFY_CHUNK_SIZE = 10000
+CHAIN_NAME = "audit_logs"
+GENESIS_HASH = "0" * 64
+
+# Fixed, so columns added to AuditLog later do not change the hash of existing rows
+HASHED_COLUMNS = (
+    "user_id", "action", "timestamp", "patient_audit_code", "cycle_id", "embryo_id", "details",
+    "event_type", "model_version", "confidence_score", "viability_score",
+    "original_prediction", "overridden_prediction",
+)
+
+
+class ChainKeyNotConfigured(RuntimeError):
+    pass
+
+
+def _chain_key() -> Optional[bytes]:
+    key = os.getenv("AUDIT_CHAIN_KEY")
+    return key.encode("utf-8") if key else None
+
+
+def chain_key_configured() -> bool:
+    return _chain_key() is not None
+
+
+def row_hash(prev_hash: str, values: Dict[str, Any]) -> str:
+    canonical = {column: values.get(column) for column in HASHED_COLUMNS}
+    if isinstance(canonical["timestamp"], datetime):
+        canonical["timestamp"] = canonical["timestamp"].isoformat()
+    payload = json.dumps(canonical, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(f"{prev_hash}\n{payload}".encode("utf-8")).hexdigest()
+
+
+def checkpoint_signature(last_id: int, head_hash: str, chained_rows: int, created_at: datetime) -> str:
+    key = _chain_key()
+    if key is None:
+        raise ChainKeyNotConfigured("AUDIT_CHAIN_KEY is not set")
+    message = f"{last_id}:{head_hash}:{chained_rows}:{created_at.isoformat()}".encode("utf-8")
+    return hmac.new(key, message, hashlib.sha256).hexdigest()
+
+
+def _lock_head(db: Session) -> Optional[AuditChainState]:
+    # The no-op UPDATE takes SQLite's write lock before the head is read
+    db.execute(update(AuditChainState).where(AuditChainState.name == CHAIN_NAME).values(name=CHAIN_NAME))
+    return (
+        db.query(AuditChainState)
+        .filter(AuditChainState.name == CHAIN_NAME)
+        .with_for_update()
+        .populate_existing()
+        .one_or_none()
+    )
+
+
+def _advance(db: Session, state: Optional[AuditChainState], first_id: int, last_id: int, head_hash: str):
+    if state is None:
+        db.add(AuditChainState(name=CHAIN_NAME, genesis_id=first_id, last_id=last_id, head_hash=head_hash))
+    else:
+        state.last_id = last_id
+        state.head_hash = head_hash
+    db.flush()
+
+
+def append_entries(db: Session, logs: List[AuditLog]):
+    """Chain and add new AuditLog objects in order (caller commits)"""
+    state = _lock_head(db)
+    prev = state.head_hash if state is not None else GENESIS_HASH
+    for log in logs:
+        if log.timestamp is None:
+            log.timestamp = datetime.utcnow()
+        log.prev_hash = prev
+        log.row_hash = prev = row_hash(prev, {column: getattr(log, column) for column in HASHED_COLUMNS})
+    db.add_all(logs)
+    db.flush()
+    _advance(db, state, logs[0].id, logs[-1].id, prev)
+
+
+def insert_entries(db: Session, rows: List[Dict[str, Any]]):
+    """Chain and bulk-insert audit rows given as column dicts, in order (caller commits)"""
+    if not rows:
+        return
+    state = _lock_head(db)
+    prev = state.head_hash if state is not None else GENESIS_HASH
+    for row in rows:
+        row.setdefault("timestamp", datetime.utcnow())
+        row["prev_hash"] = prev
+        row["row_hash"] = prev = row_hash(prev, row)
+    db.execute(insert(AuditLog), rows)
+    # Ids are allocated in order while the head is locked
+    last_id = db.execute(select(func.max(AuditLog.id))).scalar()
+    _advance(db, state, last_id - len(rows) + 1, last_id, prev)
+
+
+def _hot_rows(db: Session, after_id: int, upto_id: int, chunk_size: int) -> Iterator[Dict[str, Any]]:
+    table = AuditLog.__table__
+    columns = [table.c.id, table.c.prev_hash, table.c.row_hash, *(table.c[name] for name in HASHED_COLUMNS)]
+    names = [column.name for column in columns]
+    last_id = after_id
+    while True:
+        rows = db.execute(
+            select(*columns).where(table.c.id > last_id, table.c.id <= upto_id).order_by(table.c.id).limit(chunk_size)
+        ).all()
+        if not rows:
+            return
+        # Plain dicts: RowMapping lookups dominate the hashing loop otherwise
+        yield from (dict(zip(names, row)) for row in rows)
+        last_id = rows[-1][0]
+
+
+def _archived_rows(db: Session, after_id: int, upto_id: int) -> Iterator[Dict[str, Any]]:
+    """Archived rows in id order; a segment is only opened once its ids are next"""
+    from audit_archive import read_segment
+    segments = (
+        db.query(AuditArchiveSegment)
+        .filter(AuditArchiveSegment.last_id > after_id, AuditArchiveSegment.first_id <= upto_id)
+        .order_by(AuditArchiveSegment.first_id)
+        .all()
+    )
+    heap: list = []
+    position = 0
+    while position < len(segments) or heap:
+        # Open every segment that may hold the next smallest id
+        while position < len(segments) and (not heap or segments[position].first_id <= heap[0][0]):
+            segment = segments[position]
+            rows = iter([row for row in read_segment.__wrapped__(segment.filename, segment.sha256)
+                         if after_id < row["id"] <= upto_id])
+            first = next(rows, None)
+            if first is not None:
+                heapq.heappush(heap, (first["id"], position, first, rows))
+            position += 1
+        if not heap:
+            return
+        _, number, row, rows = heapq.heappop(heap)
+        yield row
+        following = next(rows, None)
+        if following is not None:
+            heapq.heappush(heap, (following["id"], number, following, rows))
+
+
+def iter_chain(db: Session, after_id: int, upto_id: int, chunk_size: int = VERIFY_CHUNK_SIZE) -> Iterator[Dict[str, Any]]:
+    """Rows with after_id < id <= upto_id in id order, from the hot table and the archive"""
+    return heapq.merge(_hot_rows(db, after_id, upto_id, chunk_size), _archived_rows(db, after_id, upto_id),
+                       key=lambda row: row["id"])
+
+
+def latest_valid_checkpoint(db: Session) -> Optional[AuditChainCheckpoint]:
+    if not chain_key_configured():
+        return None
+    for checkpoint in db.query(AuditChainCheckpoint).order_by(AuditChainCheckpoint.last_id.desc()).limit(10):
+        if hmac.compare_digest(checkpoint.signature, checkpoint_signature(
+                checkpoint.last_id, checkpoint.head_hash, checkpoint.chained_rows, checkpoint.created_at)):
+            return checkpoint
+        logger.error(f"Audit chain checkpoint {checkpoint.id} has an invalid signature")
+    return None
+
+
+def verify_chain(db: Session, full: bool = False, chunk_size: int = VERIFY_CHUNK_SIZE) -> Dict[str, Any]:
+    """
+    Check the chain up to the current head: from the newest valid checkpoint,
+    or from genesis when full is set (or no checkpoint exists). Without a
+    chain key checkpoints cannot be trusted, so the check is unsigned and
+    always starts from genesis.
+    """
+    started = time.perf_counter()
+    state = db.get(AuditChainState, CHAIN_NAME)
+    signed = chain_key_configured()
+    result = {"ok": True, "full": full, "signed": signed, "checked_rows": 0, "chained_rows": 0, "from_id": None, "to_id": None,
+              "checkpoint_id": None, "head_hash": None, "failure": None}
+    if state is None:
+        return {**result, "seconds": 0.0, "rows_per_second": 0.0}
+
+    checkpoint = None if full else latest_valid_checkpoint(db)
+    if checkpoint is not None:
+        prev, after_id, chained = checkpoint.head_hash, checkpoint.last_id, checkpoint.chained_rows
+        result["checkpoint_id"] = checkpoint.id
+    else:
+        prev, after_id, chained = GENESIS_HASH, state.genesis_id - 1, 0
+    passed_checkpoints = {}
+    if full and signed:
+        for cp in db.query(AuditChainCheckpoint).filter(AuditChainCheckpoint.last_id <= state.last_id):
+            passed_checkpoints[cp.last_id] = cp
+    result["from_id"] = after_id + 1
+
+    def fail(row_id: Optional[int], reason: str):
+        result["ok"] = False
+        result["failure"] = {"id": row_id, "reason": reason}
+
+    last_id = after_id
+    for row in iter_chain(db, after_id, state.last_id, chunk_size):
+        result["checked_rows"] += 1
+        if row.get("row_hash") is None:
+            fail(row["id"], "entry is not chained")
+            break
+        if row.get("prev_hash") != prev:
+            fail(row["id"], "link to the previous entry is broken (an entry was removed, reordered or altered)")
+            break
+        if row_hash(prev, row) != row["row_hash"]:
+            fail(row["id"], "entry content does not match its hash")
+            break
+        prev = row["row_hash"]
+        chained += 1
+        last_id = row["id"]
+        cp = passed_checkpoints.pop(last_id, None)
+        if cp is not None and (cp.head_hash != prev or cp.chained_rows != chained or not hmac.compare_digest(
+                cp.signature, checkpoint_signature(cp.last_id, cp.head_hash, cp.chained_rows, cp.created_at))):
+            fail(last_id, f"checkpoint {cp.id} does not match the chain")
+            break
+
+    if result["ok"]:
+        if passed_checkpoints:
+            fail(min(passed_checkpoints), "checkpointed entry is missing")
+        elif last_id != state.last_id or prev != state.head_hash:
+            fail(last_id + 1, "entries are missing before the chain head")
+    seconds = time.perf_counter() - started
+    result.update(chained_rows=chained, to_id=last_id, head_hash=prev, seconds=seconds,
+                  rows_per_second=result["checked_rows"] / seconds if seconds > 0 else 0.0)
+    return result
+
+
+def create_checkpoint(db: Session, verification: Dict[str, Any]) -> AuditChainCheckpoint:
+    """Sign the head a successful verify_chain reached (caller commits)"""
+    if not verification["ok"]:
+        raise ValueError("Cannot checkpoint a chain that failed verification")
+    if not chain_key_configured():
+        raise ChainKeyNotConfigured("Cannot sign a checkpoint without AUDIT_CHAIN_KEY")
+    created_at = datetime.utcnow()
+    checkpoint = AuditChainCheckpoint(
+        last_id=verification["to_id"], head_hash=verification["head_hash"],
+        chained_rows=verification["chained_rows"], created_at=created_at,
+        signature=checkpoint_signature(verification["to_id"], verification["head_hash"],
+                                       verification["chained_rows"], created_at)
+    )
+    db.add(checkpoint)
+    db.flush()
+    return checkpoint
+
+
+def backfill_audit_chain(db: Session, batch_size: int = 1000) -> int:
+    """
+    Migration: chain rows written before the chain existed, in batches. The
+    chain starts after the newest archived row (archive segments are
+    immutable); rows before that stay unchained.
+    """
+    table = AuditLog.__table__
+    state = db.get(AuditChainState, CHAIN_NAME)
+    if state is None:
+        archived_upto = db.execute(select(func.max(AuditArchiveSegment.last_id))).scalar() or 0
+        first_id = db.execute(select(func.min(table.c.id)).where(table.c.id > archived_upto)).scalar()
+        state = AuditChainState(name=CHAIN_NAME, genesis_id=first_id or archived_upto + 1,
+                                last_id=(first_id or archived_upto + 1) - 1, head_hash=GENESIS_HASH)
+        db.add(state)
+        db.commit()
+    chained = 0
+    while True:
+        state = _lock_head(db)
+        rows = db.execute(
+            select(table.c.id, table.c.row_hash, *(table.c[name] for name in HASHED_COLUMNS))
+            .where(table.c.id > state.last_id).order_by(table.c.id).limit(batch_size)
+        ).mappings().all()
+        pending = []
+        prev = state.head_hash
+        for row in rows:
+            # Rows written by the chained write path mean the backfill is done
+            if row["row_hash"] is not None:
+                break
+            digest = row_hash(prev, row)
+            pending.append({"row_id": row["id"], "new_prev_hash": prev, "new_row_hash": digest})
+            prev = digest
+        if not pending:
+            db.rollback()
+            return chained
+        db.execute(
+            update(table).where(table.c.id == bindparam("row_id"))
+            .values(prev_hash=bindparam("new_prev_hash"), row_hash=bindparam("new_row_hash")),
+            pending
+        )
+        state.last_id = pending[-1]["row_id"]
+        state.head_hash = prev
+        db.commit()
+        chained += len(pending)
+        if len(pending) < len(rows) or len(rows) < batch_size:
+            return chained
+
+
+async def checkpoint_forever(session_factory, interval_s: float = AUDIT_CHECKPOINT_INTERVAL_S):
+    """Background loop for the app lifespan: verify incrementally, then checkpoint the new head"""
+    if not chain_key_configured():
+        logger.error("AUDIT_CHAIN_KEY is not set; audit chain checkpoints are disabled")
+        return
+
+    def job(db: Session):
+        verification = verify_chain(db)
+        if not verification["ok"]:
+            logger.error(f"Audit chain verification failed: {verification['failure']}")
+        elif verification["checked_rows"]:
+            create_checkpoint(db, verification)
+            db.commit()
+
+    await run_periodically("Audit chain checkpoint", session_factory, job, interval_s, run_first=False)
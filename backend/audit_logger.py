@@ -1,11 +1,39 @@
 from sqlalchemy.orm import Session
-from typing import Optional
+from typing import Any, Dict, Optional
 from models import AuditLog, User
+from audit_chain import append_entries
 from schemas import AuditLogCreate, AIPredictionLog, AIOverrideLog
 from datetime import datetime
 
-def log_user_action(db: Session, user: Optional[User], log_data: AuditLogCreate):
-    """Log a user action to the audit trail. `user` may be None for anonymous events."""
+def _text(value: Any) -> Optional[str]:
+    return str(value) if value is not None else None
+
+def _number(value: Any) -> Optional[float]:
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def audit_fields(action: str, details: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    The indexed AuditLog columns derived from an entry's details. event_type
+    falls back to the lower-cased action, which is what the AI, login and
+    logout events already record.
+    """
+    if not isinstance(details, dict):
+        details = {}
+    risk_indicators = details.get("risk_indicators")
+    return {
+        "event_type": _text(details.get("event_type")) or action.lower(),
+        "model_version": _text(details.get("model_version")),
+        "confidence_score": _number(details.get("confidence_score")),
+        "viability_score": _number(risk_indicators.get("viability_score")) if isinstance(risk_indicators, dict) else None,
+        "original_prediction": _text(details.get("original_prediction")),
+        "overridden_prediction": _text(details.get("overridden_prediction")),
+    }
+
+def add_user_action(db: Session, user: Optional[User], log_data: AuditLogCreate) -> AuditLog:
+    """Add an audit entry to the caller's transaction (caller commits)"""
     user_id = user.id if user else None
     audit_log = AuditLog(
         user_id=user_id,
@@ -13,15 +41,22 @@ def log_user_action(db: Session, user: Optional[User], log_data: AuditLogCreate)
         patient_audit_code=log_data.patient_audit_code,
         cycle_id=log_data.cycle_id,
         embryo_id=log_data.embryo_id,
-        details=log_data.details
+        details=log_data.details,
+        **audit_fields(log_data.action, log_data.details)
     )
-    db.add(audit_log)
+    # Hash-chained to the previous entry (see audit_chain.py)
+    append_entries(db, [audit_log])
+    return audit_log
+
+def log_user_action(db: Session, user: Optional[User], log_data: AuditLogCreate):
+    """Log a user action to the audit trail. `user` may be None for anonymous events."""
+    audit_log = add_user_action(db, user, log_data)
     db.commit()
     db.refresh(audit_log)
     return audit_log
 
-def log_ai_prediction(db: Session, user: Optional[User], ai_log: AIPredictionLog):
-    """Log AI prediction event"""
+def add_ai_prediction(db: Session, user: Optional[User], ai_log: AIPredictionLog) -> AuditLog:
+    """Add the AI prediction audit entry to the caller's transaction (caller commits)"""
     details = {
         "model_version": ai_log.model_version,
         "confidence_score": ai_log.confidence_score,
@@ -29,6 +64,9 @@ def log_ai_prediction(db: Session, user: Optional[User], ai_log: AIPredictionLog
         "abnormal_flags": ai_log.abnormal_flags,
         "event_type": "ai_prediction"
     }
+    if ai_log.models_consulted is not None:
+        details["ensemble_mode"] = ai_log.ensemble_mode
+        details["models_consulted"] = ai_log.models_consulted
     log_data = AuditLogCreate(
         action="AI_PREDICTION",
         patient_audit_code=ai_log.patient_audit_code,
@@ -36,7 +74,14 @@ def log_ai_prediction(db: Session, user: Optional[User], ai_log: AIPredictionLog
         embryo_id=ai_log.embryo_id,
         details=details
     )
-    return log_user_action(db, user, log_data)
+    return add_user_action(db, user, log_data)
+
+def log_ai_prediction(db: Session, user: Optional[User], ai_log: AIPredictionLog):
+    """Log AI prediction event"""
+    audit_log = add_ai_prediction(db, user, ai_log)
+    db.commit()
+    db.refresh(audit_log)
+    return audit_log
 
 def log_ai_override(db: Session, user: Optional[User], override_log: AIOverrideLog):
     """Log AI override event"""
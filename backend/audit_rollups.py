@@ -0,0 +1,244 @@
+"""
+Hourly rollups of the audit trail for /audit-logs/stats
+
+Questions like "predictions per day", "override rate by embryologist" or
+"exports by user" are answered from audit_rollups, which holds one count per
+(UTC hour, action, user, model version). A background task started with the
+app (every AUDIT_ROLLUP_INTERVAL_S seconds, 0 disables it) folds new
+audit_logs rows into it incrementally. It reads in id order from the
+high-water mark in audit_rollup_state and advances the mark in the same
+transaction. Rows newer than AUDIT_ROLLUP_LAG_S seconds are left for the
+next pass, so an entry whose transaction commits late is not skipped.
+
+Queries combine three sources. Whole hours inside the range come from the
+rollups. The partial hours at either end of the range come from the raw
+table, or from the archive segments for entries already archived (see
+audit_archive.py). Rows above the high-water mark (the current, not yet
+rolled up tail) also come from the raw table. Only those slices touch
+audit_logs.
+
+Claiming the high-water mark is a conditional update, so with several
+workers each row is still counted once.
+"""
+
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import logging
+import os
+
+from sqlalchemy import and_, func, or_, select, update
+from sqlalchemy.orm import Session
+
+from models import AuditLog, AuditRollup, AuditRollupState, User
+from periodic import run_periodically
+
+logger = logging.getLogger(__name__)
+
+AUDIT_ROLLUP_INTERVAL_S = float(os.getenv("AUDIT_ROLLUP_INTERVAL_S", "60"))
+AUDIT_ROLLUP_LAG_S = float(os.getenv("AUDIT_ROLLUP_LAG_S", "5"))
+AUDIT_ROLLUP_CHUNK = 5000
+STATE_NAME = "audit_logs"
+
+GROUP_BY_DIMENSIONS = ("action", "user", "day", "hour", "model_version")
+
+
+def floor_hour(moment: datetime) -> datetime:
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def ceil_hour(moment: datetime) -> datetime:
+    floored = floor_hour(moment)
+    return floored if floored == moment else floored + timedelta(hours=1)
+
+
+def entry_model_version(action: str, details: Optional[Dict[str, Any]]) -> str:
+    if action != "AI_PREDICTION" or not isinstance(details, dict):
+        return ""
+    return str(details.get("model_version") or "")
+
+
+def high_water_id(db: Session) -> int:
+    state = db.get(AuditRollupState, STATE_NAME)
+    return state.high_water_id if state is not None else 0
+
+
+def _claim(db: Session, old: int, new: int) -> bool:
+    """Move the high-water mark from old to new unless another worker got there first"""
+    if db.get(AuditRollupState, STATE_NAME) is None:
+        db.add(AuditRollupState(name=STATE_NAME, high_water_id=0))
+        db.flush()
+    claimed = db.execute(
+        update(AuditRollupState)
+        .where(AuditRollupState.name == STATE_NAME, AuditRollupState.high_water_id == old)
+        .values(high_water_id=new, updated_at=datetime.utcnow())
+    ).rowcount
+    return claimed == 1
+
+
+def _add_counts(db: Session, counts: Counter):
+    hours = {hour for hour, _, _, _ in counts}
+    existing = {
+        (row.hour, row.action, row.user_id, row.model_version): row
+        for row in db.query(AuditRollup).filter(AuditRollup.hour.in_(hours))
+    }
+    for key, count in counts.items():
+        row = existing.get(key)
+        if row is not None:
+            row.count += count
+        else:
+            hour, action, user_id, model_version = key
+            db.add(AuditRollup(hour=hour, action=action, user_id=user_id, model_version=model_version, count=count))
+
+
+def roll_up(db: Session, chunk_size: int = AUDIT_ROLLUP_CHUNK, lag_s: float = AUDIT_ROLLUP_LAG_S) -> int:
+    """Fold audit rows above the high-water mark into the rollups; returns rows rolled up"""
+    cutoff = datetime.utcnow() - timedelta(seconds=lag_s)
+    total = 0
+    while True:
+        start = high_water_id(db)
+        rows = db.execute(
+            select(AuditLog.id, AuditLog.timestamp, AuditLog.action, AuditLog.user_id, AuditLog.details)
+            .where(AuditLog.id > start)
+            .order_by(AuditLog.id)
+            .limit(chunk_size)
+        ).all()
+        counts: Counter = Counter()
+        last_id = start
+        for row_id, timestamp, action, user_id, details in rows:
+            if timestamp is not None and timestamp > cutoff:
+                break
+            counts[(floor_hour(timestamp or cutoff), action, user_id, entry_model_version(action, details))] += 1
+            last_id = row_id
+        if last_id == start:
+            db.rollback()
+            return total
+        try:
+            if not _claim(db, start, last_id):
+                db.rollback()
+                return total
+            _add_counts(db, counts)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        total += sum(counts.values())
+        if len(rows) < chunk_size or last_id != rows[-1][0]:
+            return total
+
+
+def _grouping(group_by: Iterable[str], hour: datetime, action: str, user_id: int, model_version: str) -> Tuple:
+    parts = []
+    for dimension in group_by:
+        if dimension == "action":
+            parts.append(action)
+        elif dimension == "user":
+            parts.append(user_id)
+        elif dimension == "day":
+            parts.append(hour.strftime("%Y-%m-%d"))
+        elif dimension == "hour":
+            parts.append(hour)
+        elif dimension == "model_version":
+            parts.append(model_version or None)
+    return tuple(parts)
+
+
+def audit_stats(db: Session, start: Optional[datetime], end: Optional[datetime],
+                group_by: List[str]) -> Dict[str, Any]:
+    """
+    Audit entry counts with start <= timestamp <= end, grouped by the given
+    dimensions (see GROUP_BY_DIMENSIONS)
+    """
+    from audit_archive import archived_entries, naive_utc
+    start, end = naive_utc(start), naive_utc(end)
+    mark = high_water_id(db)
+    counts: Counter = Counter()
+
+    # Whole hours inside the range, below the mark: from the rollups
+    lower = ceil_hour(start) if start else None
+    upper = floor_hour(end) if end else None
+    use_rollups = lower is None or upper is None or lower < upper
+    if use_rollups:
+        columns = [AuditRollup.hour, AuditRollup.action, AuditRollup.user_id, AuditRollup.model_version]
+        wanted = [column for column, dimension in zip(
+            columns, ("hour", "action", "user", "model_version"))
+            if dimension in group_by or (dimension == "hour" and "day" in group_by)]
+        query = select(*wanted, func.sum(AuditRollup.count))
+        if lower is not None:
+            query = query.where(AuditRollup.hour >= lower)
+        if upper is not None:
+            query = query.where(AuditRollup.hour < upper)
+        if wanted:
+            query = query.group_by(*wanted)
+        for row in db.execute(query):
+            values = dict(zip((column.key for column in wanted), row[:-1]))
+            key = _grouping(group_by, values.get("hour"), values.get("action"), values.get("user_id"),
+                            values.get("model_version"))
+            counts[key] += int(row[-1] or 0)
+
+    # Rows above the mark anywhere in the range, and rows below it in the partial edge hours: raw table
+    raw_filter = [AuditLog.id > mark]
+    if not use_rollups:
+        raw_filter.append(AuditLog.id <= mark)
+    else:
+        if lower is not None and start is not None and start < lower:
+            raw_filter.append(and_(AuditLog.id <= mark, AuditLog.timestamp < lower))
+        if upper is not None:
+            raw_filter.append(and_(AuditLog.id <= mark, AuditLog.timestamp >= upper))
+    query = select(AuditLog.timestamp, AuditLog.action, AuditLog.user_id, AuditLog.details).where(or_(*raw_filter))
+    if start is not None:
+        query = query.where(AuditLog.timestamp >= start)
+    if end is not None:
+        query = query.where(AuditLog.timestamp <= end)
+    raw_rows = 0
+    for timestamp, action, user_id, details in db.execute(query):
+        raw_rows += 1
+        hour = floor_hour(timestamp) if timestamp else None
+        counts[_grouping(group_by, hour, action, user_id, entry_model_version(action, details))] += 1
+
+    # Archived entries are all below the mark; the edge hours need theirs too
+    edges = []
+    if not use_rollups:
+        edges.append([])
+    else:
+        if lower is not None and start is not None and start < lower:
+            edges.append([("timestamp", "<", lower)])
+        if upper is not None:
+            edges.append([("timestamp", ">=", upper)])
+    bounds = ([("timestamp", ">=", start)] if start is not None else []) + \
+             ([("timestamp", "<=", end)] if end is not None else [])
+    for edge in edges:
+        for entry in archived_entries(db, bounds + edge):
+            raw_rows += 1
+            counts[_grouping(group_by, floor_hour(entry["timestamp"]), entry["action"], entry["user_id"],
+                             entry_model_version(entry["action"], entry["details"]))] += 1
+
+    usernames = {}
+    if "user" in group_by:
+        user_ids = {key[group_by.index("user")] for key in counts}
+        usernames = dict(db.query(User.id, User.username).filter(User.id.in_(user_ids)).all())
+    groups = []
+    for key, count in counts.items():
+        group = dict(zip(group_by, key))
+        if "user" in group:
+            group["user_id"] = group.pop("user")
+            group["username"] = usernames.get(group["user_id"])
+        group["count"] = count
+        groups.append(group)
+    groups.sort(key=lambda g: tuple(str(g.get(d if d != "user" else "user_id")) for d in group_by))
+    return {
+        "total": sum(counts.values()),
+        "groups": groups,
+        "high_water_id": mark,
+        "raw_rows": raw_rows,
+    }
+
+
+async def roll_up_forever(session_factory, interval_s: float = AUDIT_ROLLUP_INTERVAL_S):
+    """Background loop for the app lifespan: roll up, then sleep"""
+    def job(db: Session):
+        rolled = roll_up(db)
+        if rolled:
+            logger.info(f"Rolled up {rolled} audit entries")
+
+    await run_periodically("Audit rollup", session_factory, job, interval_s)
@@ -77,9 +77,12 @@ def check_role(required_roles: list):
         return current_user
     return role_checker
 
+# Roles allowed to create clinical records (patients, cycles, embryos)
+CLINICAL_ROLES = ["Admin", "Embryologist"]
+
 # Role checkers
 require_admin = check_role(["Admin"])
-require_embryologist = check_role(["Admin", "Embryologist"])
+require_embryologist = check_role(CLINICAL_ROLES)
 require_auditor = check_role(["Admin", "Embryologist", "Auditor"])
 require_read_only = check_role(["Auditor"])  # For read-only operations
 
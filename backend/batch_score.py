@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Offline batch scoring of image folders and dataset archives
+
+Scores every image in a folder or a .tar/.tar.gz archive (e.g.
+embryo_dataset_F45.tar.gz) without the web layer. Archives are streamed
+member by member, never extracted to disk. Worker processes run the
+backend's preprocess_image_fast and extract_features_fast on batches of
+images. The parent scores each batch as one matrix per model with the model
+sets main.load_models registers, so the probabilities are the ones /predict
+returns in full or fast mode. The number of batches in flight is bounded,
+so memory stays flat however large the archive is.
+
+Results go to CSV or Parquet, one row per image, followed by throughput
+statistics. With --db they are also written to the predictions and audit
+tables in one transaction, attributed to --user. The embryo is the image's
+folder, and --patient-code/--cycle-id identify the study.
+
+Usage (from the backend folder):
+    python batch_score.py /data/embryo_dataset_F45.tar.gz --output scores_F45.csv
+    python batch_score.py ../public/images --mode fast --output scores.parquet --workers 4
+    python batch_score.py /data/embryo_dataset_F45 --db --user admin --patient-code STUDY-7 --cycle-id F45
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+import tarfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+BATCH_MODES = ("full", "fast")
+
+
+def iter_archive(path: str) -> Iterator[Tuple[str, bytes]]:
+    """(image id, bytes) for each image in a tar archive, read sequentially in stream mode"""
+    from extract_features import IMAGE_EXTENSIONS
+    with tarfile.open(path, "r|*") as archive:
+        for member in archive:
+            if not member.isfile() or not member.name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            handle = archive.extractfile(member)
+            if handle is not None:
+                parts = member.name.split("/")
+                yield "/".join(parts[-2:]), handle.read()
+
+
+def iter_folder(path: str) -> Iterator[Tuple[str, str]]:
+    """(image id, path) for each image under a folder; workers read the files themselves"""
+    from extract_features import find_images, image_id
+    for image_path in find_images(path):
+        yield image_id(image_path), image_path
+
+
+def iter_batches(items: Iterator, size: int) -> Iterator[List]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def featurize_batch(batch: List[Tuple[str, object]]) -> Tuple[List[str], List[str], np.ndarray, List[str], float]:
+    """
+    Worker: (ids of readable images, their sha256, feature matrix, ids that
+    failed, seconds). Items carry either the image bytes or a file path.
+    """
+    import main
+    started = time.perf_counter()
+    ids, hashes, rows, failed = [], [], [], []
+    for item_id, source in batch:
+        try:
+            if isinstance(source, str):
+                with open(source, "rb") as f:
+                    source = f.read()
+            features = main.extract_features_fast(main.preprocess_image_fast(source))
+        except Exception:
+            failed.append(item_id)
+            continue
+        ids.append(item_id)
+        hashes.append(hashlib.sha256(source).hexdigest())
+        rows.append([features.get(name, 0.0) for name in main.FEATURE_NAMES])
+    X = np.asarray(rows, dtype=np.float32).reshape(-1, len(main.FEATURE_NAMES))
+    return ids, hashes, X, failed, time.perf_counter() - started
+
+
+def score_rows(main, mode: str, X: np.ndarray, explain: bool) -> Dict[str, np.ndarray]:
+    """Per-image result columns for a feature matrix, as ensemble_predict computes them"""
+    from model_registry import get_model_set, predict_matrix
+    model_set = main.MODEL_VERSIONS[mode]
+    probability, per_model = predict_matrix(model_set, X.astype(np.float64), per_model=True)
+    confidence = np.maximum(probability, 1.0 - probability)
+    columns = {
+        "prediction": np.where(probability > 0.5, "good", "not_good"),
+        "viability_score": probability * 100,
+        "confidence": confidence,
+        "confidence_level": np.array([main.confidence_level_for(c) for c in confidence]),
+    }
+    for i, name in enumerate(get_model_set(model_set)):
+        columns[f"{name}_probability"] = per_model[:, i]
+    if explain:
+        from explainability import explain_batch
+        base, contributions = explain_batch(model_set, X)
+        columns["base_value"] = base
+        for i, name in enumerate(main.FEATURE_NAMES):
+            columns[f"contribution_{name}"] = contributions[:, i]
+    return columns
+
+
+def write_results(path: str, columns: Dict[str, list]):
+    import pandas as pd
+    df = pd.DataFrame(columns)
+    if path.endswith(".parquet"):
+        df.to_parquet(path, index=False)
+    else:
+        df.to_csv(path, index=False)
+
+
+def store_results(main, columns: Dict[str, list], username: str, patient_code: str, cycle_id: str, mode: str):
+    """Bulk-insert predictions, their hash-chained AI_PREDICTION audit entries and aggregate counts in one transaction"""
+    from sqlalchemy import insert
+    from database import SessionLocal
+    from models import Prediction, User
+    from aggregates import add_predictions
+    from audit_chain import insert_entries
+    from audit_logger import audit_fields
+    from prediction_store import MODEL_PROBABILITY_COLUMNS, get_or_create_embryo
+
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.username == username).first()
+        if user is None:
+            raise SystemExit(f"Unknown user '{username}'")
+        model_version = main.MODEL_VERSIONS[mode]
+        models_consulted = [name for name in MODEL_PROBABILITY_COLUMNS if f"{name}_probability" in columns] \
+            if mode == "full" else [main.FAST_MODEL_NAME]
+        now = datetime.utcnow()
+        embryos = {}
+        predictions, audit_logs = [], []
+        for i, embryo_code in enumerate(columns["embryo_id"]):
+            if embryo_code not in embryos:
+                embryos[embryo_code] = get_or_create_embryo(db, user, patient_code, cycle_id, embryo_code)
+                if embryos[embryo_code] is None:
+                    raise SystemExit(f"User '{username}' may not create clinical records (embryo {embryo_code})")
+            embryo = embryos[embryo_code]
+            prediction = columns["prediction"][i]
+            predictions.append({
+                "embryo_id": embryo.id,
+                "cycle_id": embryo.cycle_id,
+                "prediction": prediction,
+                "viability_score": float(columns["viability_score"][i]),
+                "confidence": float(columns["confidence"][i]),
+                "confidence_level": columns["confidence_level"][i],
+                "model_version": model_version,
+                "ensemble_mode": mode,
+                "created_at": now,
+                **{column: float(columns[f"{name}_probability"][i]) if f"{name}_probability" in columns else None
+                   for name, column in MODEL_PROBABILITY_COLUMNS.items()},
+            })
+            details = {
+                "model_version": model_version,
+                "confidence_score": float(columns["confidence"][i]),
+                "risk_indicators": {"viability_score": float(columns["viability_score"][i]),
+                                    "image_id": columns["image_id"][i]},
+                "abnormal_flags": [] if prediction == "good" else ["low_viability"],
+                "event_type": "ai_prediction",
+                "ensemble_mode": mode,
+                "models_consulted": models_consulted,
+                "source": "batch_score",
+            }
+            audit_logs.append({
+                "user_id": user.id,
+                "action": "AI_PREDICTION",
+                "timestamp": now,
+                "patient_audit_code": patient_code,
+                "cycle_id": cycle_id,
+                "embryo_id": embryo_code,
+                "details": details,
+                **audit_fields("AI_PREDICTION", details),
+            })
+        if predictions:
+            db.execute(insert(Prediction), predictions)
+            insert_entries(db, audit_logs)
+            add_predictions(db, predictions)
+        db.commit()
+        return len(predictions)
+    except BaseException:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def main_cli(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Score a folder or tar archive of embryo images offline")
+    parser.add_argument("source", help="Image folder, or .tar / .tar.gz archive")
+    parser.add_argument("--output", default="batch_scores.csv", help="Results file (.csv or .parquet)")
+    parser.add_argument("--mode", default="full", choices=BATCH_MODES, help="Model set to score with")
+    parser.add_argument("--explain", action="store_true", help="Add per-feature contribution columns")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--limit", type=int, default=None, help="Only the first N images")
+    parser.add_argument("--db", action="store_true",
+                        help="Also store predictions and audit entries (one transaction)")
+    parser.add_argument("--user", default=None, help="Username the --db audit entries are attributed to")
+    parser.add_argument("--patient-code", default=None, help="Patient/study audit code for --db")
+    parser.add_argument("--cycle-id", default=None, help="Cycle id for --db")
+    args = parser.parse_args(argv)
+    if args.db and not (args.user and args.patient_code and args.cycle_id):
+        parser.error("--db requires --user, --patient-code and --cycle-id")
+    source = os.path.abspath(args.source)
+    output = os.path.abspath(args.output)
+
+    from extract_features import init_worker
+    init_worker()
+    import main
+    from database import engine
+    from models import Base
+
+    Base.metadata.create_all(bind=engine)
+    main.load_models()
+    if args.mode == "fast" and main.fast_model is None:
+        print("No fast model available")
+        return 1
+
+    items = iter_archive(source) if os.path.isfile(source) else iter_folder(source)
+    if args.limit is not None:
+        items = (item for i, item in zip(range(args.limit), items))
+
+    results: Dict[int, Tuple] = {}
+    failed: List[str] = []
+    extract_seconds = score_seconds = 0.0
+    processed = 0
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker) as pool:
+        in_flight = {}
+
+        def collect(done):
+            nonlocal extract_seconds, score_seconds, processed
+            for future in done:
+                index = in_flight.pop(future)
+                ids, hashes, X, batch_failed, seconds = future.result()
+                extract_seconds += seconds
+                score_started = time.perf_counter()
+                columns = score_rows(main, args.mode, X, args.explain) if len(ids) else {}
+                score_seconds += time.perf_counter() - score_started
+                results[index] = (ids, hashes, columns)
+                failed.extend(batch_failed)
+                processed += len(ids) + len(batch_failed)
+            elapsed = time.perf_counter() - started
+            print(f"   scored {processed} images ({processed / elapsed if elapsed > 0 else 0.0:.1f} images/s)",
+                  file=sys.stderr)
+
+        for index, batch in enumerate(iter_batches(items, args.batch_size)):
+            in_flight[pool.submit(featurize_batch, batch)] = index
+            # Bounded read-ahead: archive bytes are only held for batches in flight
+            if len(in_flight) >= args.workers * 2:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+        if in_flight:
+            collect(wait(in_flight)[0])
+    elapsed = time.perf_counter() - started
+
+    ordered = [results[index] for index in sorted(results) if results[index][0]]
+    columns: Dict[str, list] = {"image_id": [], "embryo_id": [], "sha256": []}
+    for ids, hashes, batch_columns in ordered:
+        columns["image_id"].extend(ids)
+        columns["embryo_id"].extend(item_id.split("/")[0] if "/" in item_id else "" for item_id in ids)
+        columns["sha256"].extend(hashes)
+        for name, values in batch_columns.items():
+            columns.setdefault(name, []).extend(values.tolist())
+    for name in list(columns):
+        if name.endswith("_probability") or name in ("viability_score", "confidence", "base_value") \
+                or name.startswith("contribution_"):
+            columns[name] = np.round(columns[name], 6).tolist()
+
+    write_results(output, columns)
+    scored = len(columns["image_id"])
+    print(f"Scored {scored} images ({len(failed)} unreadable) with {main.MODEL_VERSIONS[args.mode]} in {elapsed:.2f}s: "
+          f"{scored / elapsed if elapsed > 0 else 0.0:.1f} images/s on {args.workers} workers "
+          f"({extract_seconds:.2f}s extracting across workers, {score_seconds:.2f}s in models) -> {output}")
+
+    if args.db:
+        db_started = time.perf_counter()
+        stored = store_results(main, columns, args.user, args.patient_code, args.cycle_id, args.mode)
+        print(f"Stored {stored} predictions and audit entries in {time.perf_counter() - db_started:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
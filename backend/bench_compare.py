@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Compare two bench_inference.py result files and flag slowdowns
+
+Usage (from the backend folder):
+    python bench_compare.py baseline.json candidate.json
+    python bench_compare.py baseline.json candidate.json --threshold 0.15 --metric p99_ms
+
+Exits with status 1 when any case regresses by more than the threshold.
+"""
+
+import argparse
+import json
+import sys
+from typing import Dict, List, Optional
+
+# Metrics where a larger value is worse
+LATENCY_METRICS = ("p50_ms", "p99_ms", "mean_ms", "alloc_peak_kib_per_call")
+
+
+def load_results(path: str) -> Dict:
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def compare(baseline: Dict, candidate: Dict, metric: str, threshold: float) -> List[Dict]:
+    """Return one row per case present in both runs with the relative change"""
+    rows = []
+    base_results = baseline.get("results", {})
+    cand_results = candidate.get("results", {})
+    for name in sorted(set(base_results) & set(cand_results)):
+        old = base_results[name].get(metric)
+        new = cand_results[name].get(metric)
+        if old is None or new is None or old == 0:
+            continue
+        if metric in LATENCY_METRICS:
+            change = (new - old) / old
+        else:
+            # Throughput: a drop in ops/sec is a slowdown
+            change = (old - new) / old
+        rows.append({
+            "case": name,
+            "baseline": old,
+            "candidate": new,
+            "slowdown": change,
+            "regressed": change > threshold,
+        })
+    return rows
+
+
+def main_cli(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Flag benchmark regressions between two runs")
+    parser.add_argument("baseline", help="Results JSON from the reference commit")
+    parser.add_argument("candidate", help="Results JSON from the commit under test")
+    parser.add_argument("--metric", default="p50_ms",
+                        choices=["p50_ms", "p99_ms", "mean_ms", "ops_per_sec", "alloc_peak_kib_per_call"])
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Relative slowdown that counts as a regression (default 0.10 = 10%%)")
+    args = parser.parse_args(argv)
+
+    baseline = load_results(args.baseline)
+    candidate = load_results(args.candidate)
+    rows = compare(baseline, candidate, args.metric, args.threshold)
+
+    print(f"Baseline:  {baseline.get('meta', {}).get('git_commit')}  Candidate: {candidate.get('meta', {}).get('git_commit')}")
+    print(f"Metric: {args.metric}  Threshold: {args.threshold:.0%}\n")
+    for row in rows:
+        marker = "REGRESSION" if row["regressed"] else ""
+        print(f"{row['case']:60s} {row['baseline']:12.3f} -> {row['candidate']:12.3f}  "
+              f"{row['slowdown']:+8.1%}  {marker}")
+
+    only_base = set(baseline.get("results", {})) - set(candidate.get("results", {}))
+    if only_base:
+        print(f"\nMissing from candidate: {', '.join(sorted(only_base))}")
+
+    regressions = [row for row in rows if row["regressed"]]
+    print(f"\n{len(regressions)} regression(s) out of {len(rows)} compared cases")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
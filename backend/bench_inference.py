@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for the inference hot path
+
+Covers preprocess_image_fast, extract_features_fast, ensemble_predict and the
+full /predict endpoint (through the ASGI test client) using synthetic embryo
+images at several resolutions and formats, plus any sample images supplied
+with --images.
+
+Usage (from the backend folder):
+    python bench_inference.py --output bench_results.json
+    python bench_inference.py --quick --images ../public/images
+    python bench_compare.py baseline.json bench_results.json
+"""
+
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+RESOLUTIONS = [128, 512, 1024, 2048]
+QUICK_RESOLUTIONS = [128, 1024]
+FORMATS = ["PNG", "JPEG", "TIFF", "BMP", "WEBP"]
+QUICK_FORMATS = ["PNG", "JPEG"]
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".webp")
+
+SAMPLE_PREDICTION_DATA = json.dumps({
+    "patient_audit_code": "BENCH-PATIENT",
+    "cycle_id": "BENCH-CYCLE",
+    "embryo_id": "BENCH-EMBRYO",
+})
+
+
+def make_synthetic_embryo(size: int, seed: int = 0) -> np.ndarray:
+    """Render an embryo-like RGB image: textured bright disc with a zona ring on a dark field"""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:size, 0:size].astype(np.float32)
+    cy, cx = size / 2.0, size / 2.0
+    radius = size * 0.35
+    dist = np.sqrt((yy - cy) ** 2 + (xx - cx) ** 2)
+
+    image = np.full((size, size), 40.0, dtype=np.float32)
+    image[dist < radius] = 150.0
+    ring = np.abs(dist - radius) < max(1.0, size * 0.02)
+    image[ring] = 210.0
+
+    # Blastomere-like blobs inside the disc
+    for _ in range(8):
+        by = cy + rng.uniform(-0.5, 0.5) * radius
+        bx = cx + rng.uniform(-0.5, 0.5) * radius
+        br = radius * rng.uniform(0.15, 0.3)
+        blob = (yy - by) ** 2 + (xx - bx) ** 2 < br ** 2
+        image[blob] += rng.uniform(-30, 30)
+
+    image += rng.normal(0, 12, size=image.shape).astype(np.float32)
+    gray = np.clip(image, 0, 255).astype(np.uint8)
+    return np.stack([gray, gray, gray], axis=2)
+
+
+def encode_image(array: np.ndarray, fmt: str) -> bytes:
+    """Encode an RGB array with Pillow in the given format"""
+    buffer = io.BytesIO()
+    save_kwargs = {"quality": 90} if fmt in ("JPEG", "WEBP") else {}
+    Image.fromarray(array).save(buffer, format=fmt, **save_kwargs)
+    return buffer.getvalue()
+
+
+def load_sample_images(directory: Optional[str]) -> List[Tuple[str, bytes]]:
+    """Read sample embryo images from a directory (non-recursive)"""
+    samples = []
+    if not directory:
+        return samples
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            with open(os.path.join(directory, name), "rb") as f:
+                samples.append((name, f.read()))
+    return samples
+
+
+def _percentile_ms(durations_ns: np.ndarray, q: float) -> float:
+    return float(np.percentile(durations_ns, q) / 1e6)
+
+
+def measure_allocations(fn: Callable[[], object], calls: int) -> Dict[str, float]:
+    """Peak traced bytes and net retained blocks per call, via tracemalloc"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        peaks = []
+        before = tracemalloc.take_snapshot()
+        for _ in range(calls):
+            tracemalloc.reset_peak()
+            start_current, _ = tracemalloc.get_traced_memory()
+            fn()
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - start_current)
+        after = tracemalloc.take_snapshot()
+        retained_blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename"))
+    finally:
+        tracemalloc.stop()
+    return {
+        "alloc_peak_kib_per_call": float(np.mean(peaks) / 1024.0),
+        "alloc_retained_blocks_per_call": float(retained_blocks / calls),
+    }
+
+
+def run_case(fn: Callable[[], object], min_time: float, min_iterations: int,
+             warmup: int, alloc_calls: int) -> Dict[str, float]:
+    """Time fn until both min_time seconds and min_iterations calls have elapsed"""
+    for _ in range(warmup):
+        fn()
+
+    durations = []
+    gc.disable()
+    try:
+        started = time.perf_counter()
+        while len(durations) < min_iterations or time.perf_counter() - started < min_time:
+            t0 = time.perf_counter_ns()
+            fn()
+            durations.append(time.perf_counter_ns() - t0)
+    finally:
+        gc.enable()
+
+    durations_ns = np.array(durations, dtype=np.float64)
+    result = {
+        "iterations": len(durations),
+        "ops_per_sec": float(1e9 / durations_ns.mean()),
+        "mean_ms": float(durations_ns.mean() / 1e6),
+        "p50_ms": _percentile_ms(durations_ns, 50),
+        "p99_ms": _percentile_ms(durations_ns, 99),
+        "min_ms": float(durations_ns.min() / 1e6),
+    }
+    result.update(measure_allocations(fn, alloc_calls))
+    return result
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+def build_cases(main, args) -> List[Tuple[str, Callable[[], object]]]:
+    """Assemble (name, callable) pairs for every benchmark case"""
+    resolutions = QUICK_RESOLUTIONS if args.quick else RESOLUTIONS
+    formats = QUICK_FORMATS if args.quick else FORMATS
+
+    encoded = {}
+    for size in resolutions:
+        array = make_synthetic_embryo(size, seed=size)
+        for fmt in formats:
+            encoded[f"synthetic-{size}px.{fmt.lower()}"] = encode_image(array, fmt)
+    for name, data in load_sample_images(args.images):
+        encoded[f"sample-{name}"] = data
+
+    cases = []
+    for label, data in encoded.items():
+        cases.append((f"preprocess_image_fast[{label}]", lambda data=data: main.preprocess_image_fast(data)))
+
+    # Feature extraction always sees the 128x128 working image
+    working_images = {label: main.preprocess_image_fast(data) for label, data in encoded.items()
+                      if label.startswith("sample-") or label.endswith(".png")}
+    for label, image in working_images.items():
+        cases.append((f"extract_features_fast[{label}]", lambda image=image: main.extract_features_fast(image)))
+
+    if main.models:
+        reference = next(iter(working_images.values()))
+        features = main.extract_features_fast(reference)
+        cases.append((f"ensemble_predict[{len(main.models)} models]", lambda: main.ensemble_predict(features)))
+        vector = np.array([features.get(name, 0.0) for name in main.FEATURE_NAMES], dtype=np.float32)
+        version = main.MODEL_VERSIONS["full"]
+        cases.append((f"explain_prediction[{version}]",
+                      lambda: main.explain_prediction(version, vector, main.FEATURE_NAMES)))
+
+        client = args.client
+        endpoint_inputs = [label for label in encoded
+                           if label.startswith("sample-") or label.endswith((".png", ".jpeg"))]
+        for label in endpoint_inputs:
+            data = encoded[label]
+
+            def call_predict(data=data, label=label):
+                response = client.post(
+                    "/predict",
+                    files={"file": (label, data, "application/octet-stream")},
+                    data={"prediction_data": SAMPLE_PREDICTION_DATA},
+                )
+                if response.status_code != 200:
+                    raise RuntimeError(f"/predict returned {response.status_code}: {response.text[:200]}")
+            cases.append((f"predict_endpoint[{label}]", call_predict))
+    return cases
+
+
+def main_cli(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the embryo inference hot path")
+    parser.add_argument("--output", default="bench_results.json", help="Where to write the JSON results")
+    parser.add_argument("--images", default=None, help="Directory of sample embryo images to include")
+    parser.add_argument("--quick", action="store_true", help="Fewer resolutions/formats and shorter runs")
+    parser.add_argument("--min-time", type=float, default=None, help="Minimum seconds per case")
+    parser.add_argument("--min-iterations", type=int, default=20, help="Minimum timed calls per case")
+    parser.add_argument("--filter", default=None, help="Only run cases whose name contains this string")
+    args = parser.parse_args(argv)
+    if args.min_time is None:
+        args.min_time = 0.3 if args.quick else 1.0
+    args.output = os.path.abspath(args.output)
+    if args.images:
+        args.images = os.path.abspath(args.images)
+
+    # Model paths in main.py are relative to the backend folder; keep the
+    # benchmark database and uploads out of the real audit trail and image store.
+    os.chdir(BACKEND_DIR)
+    scratch_dir = tempfile.mkdtemp(prefix="embrya-bench-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(scratch_dir, 'bench.db')}"
+    os.environ["IMAGE_STORE_DIR"] = os.path.join(scratch_dir, "image_store")
+    sys.path.insert(0, BACKEND_DIR)
+
+    import logging
+    logging.disable(logging.CRITICAL)
+    from fastapi.testclient import TestClient
+    import main
+
+    results = {}
+    with contextlib.redirect_stdout(io.StringIO()), TestClient(main.app) as client:
+        args.client = client
+        cases = build_cases(main, args)
+        if args.filter:
+            cases = [case for case in cases if args.filter in case[0]]
+        for name, fn in cases:
+            with contextlib.redirect_stdout(io.StringIO()):
+                results[name] = run_case(fn, args.min_time, args.min_iterations,
+                                         warmup=3, alloc_calls=5)
+            r = results[name]
+            print(f"{name:60s} {r['ops_per_sec']:10.1f} ops/s  p50 {r['p50_ms']:8.3f} ms  "
+                  f"p99 {r['p99_ms']:8.3f} ms  {r['alloc_peak_kib_per_call']:9.1f} KiB/call",
+                  file=sys.stderr)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "models_loaded": len(main.models),
+            "quick": args.quick,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(results)} benchmark results to {args.output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Benchmark for note listing and full-text search
+
+Builds a scratch SQLite database of --notes synthetic notes (the full-text
+index is created first, so the triggers keep it in sync during the load)
+and reports per-query latency for:
+
+    - filtered listings by patient, cycle and embryo (first page and a deep page)
+    - searches for rare, common and prefix terms, alone and with a cycle filter
+    - the page after the first, through the search cursor
+
+Usage (from the backend folder):
+    python bench_notes_search.py --notes 1000000 --output bench_notes_search.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import List, Optional
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+VOCABULARY = [
+    "blastocyst", "expansion", "inner", "cell", "mass", "trophectoderm", "fragmentation", "symmetry",
+    "compaction", "morula", "cleavage", "hatching", "grade", "good", "fair", "poor", "day", "transfer",
+    "vitrified", "biopsy", "multinucleation", "vacuole", "granularity", "zona", "thin", "thick",
+    "uneven", "even", "collapse", "reexpanded", "discussed", "patient", "embryologist", "review",
+]
+RARE_WORDS = ["smooth", "refractile", "necrotic", "dysmorphic"]
+
+
+def note_text(rng: random.Random) -> str:
+    words = [rng.choice(VOCABULARY) for _ in range(rng.randint(8, 30))]
+    if rng.random() < 0.001:
+        words.insert(rng.randrange(len(words)), rng.choice(RARE_WORDS))
+    return " ".join(words)
+
+
+def main_cli(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark note listing and full-text search")
+    parser.add_argument("--notes", type=int, default=1000000, help="Notes in the scratch database")
+    parser.add_argument("--patients", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=50, help="Runs per query")
+    parser.add_argument("--limit", type=int, default=20, help="Page size")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Optional JSON results file")
+    args = parser.parse_args(argv)
+    if args.output:
+        args.output = os.path.abspath(args.output)
+
+    scratch_dir = tempfile.mkdtemp(prefix="embrya-notes-bench-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(scratch_dir, 'bench.db')}"
+    os.chdir(BACKEND_DIR)
+    sys.path.insert(0, BACKEND_DIR)
+
+    from sqlalchemy import insert
+    from database import SessionLocal, engine
+    from models import Base, Note, User
+    from notes_search import ensure_search_index, list_notes, search_notes
+
+    Base.metadata.create_all(bind=engine)
+    ensure_search_index(engine)
+    db = SessionLocal()
+    user = User(username="bench", hashed_password="-", role="Embryologist")
+    db.add(user)
+    db.commit()
+
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    batch = []
+    for i in range(args.notes):
+        patient = rng.randrange(args.patients)
+        cycle = patient * 3 + rng.randrange(3)
+        batch.append({"user_id": user.id, "patient_audit_code": f"P{patient:06d}", "cycle_id": f"C{cycle:07d}",
+                      "embryo_id": f"C{cycle:07d}-E{rng.randrange(8)}", "note_text": note_text(rng)})
+        if len(batch) == 10000 or i == args.notes - 1:
+            db.execute(insert(Note), batch)
+            db.commit()
+            batch = []
+    load_seconds = time.perf_counter() - started
+    print(f"Loaded {args.notes} notes in {load_seconds:.1f} s ({args.notes / load_seconds:.0f} notes/s)",
+          file=sys.stderr)
+
+    results = {}
+
+    def measure(name: str, run):
+        timings = []
+        count = 0
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            count = len(run()[0])
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        results[name] = {
+            "rows": count,
+            "median_ms": round(statistics.median(timings), 3),
+            "p95_ms": round(timings[int(0.95 * (len(timings) - 1))], 3),
+            "max_ms": round(timings[-1], 3),
+        }
+        print(f"{name:32s} {count:4d} rows  median {results[name]['median_ms']:8.3f} ms  "
+              f"p95 {results[name]['p95_ms']:8.3f} ms", file=sys.stderr)
+
+    sample = db.query(Note).filter(Note.id == args.notes // 2).one()
+    deep_cursor = list_notes(db, {"patient_audit_code": sample.patient_audit_code}, 100)[1]
+    no_filters = {}
+    measure("list_patient", lambda: list_notes(db, {"patient_audit_code": sample.patient_audit_code}, args.limit))
+    measure("list_cycle", lambda: list_notes(db, {"cycle_id": sample.cycle_id}, args.limit))
+    measure("list_embryo", lambda: list_notes(db, {"embryo_id": sample.embryo_id}, args.limit))
+    measure("list_patient_deep_page", lambda: list_notes(
+        db, {"patient_audit_code": sample.patient_audit_code}, args.limit, deep_cursor))
+    measure("list_all", lambda: list_notes(db, no_filters, args.limit))
+    measure("search_rare", lambda: search_notes(db, "refractile", no_filters, args.limit))
+    measure("search_rare_and_common", lambda: search_notes(db, "necrotic blastocyst", no_filters, args.limit))
+    measure("search_prefix_rare", lambda: search_notes(db, "dysmorph*", no_filters, args.limit))
+    measure("search_common_in_cycle", lambda: search_notes(
+        db, "fragmentation", {"cycle_id": sample.cycle_id}, args.limit))
+    measure("search_common_in_patient", lambda: search_notes(
+        db, "hatching zona", {"patient_audit_code": sample.patient_audit_code}, args.limit))
+    first_page = search_notes(db, "smooth", no_filters, args.limit)
+    if first_page[1]:
+        measure("search_rare_second_page", lambda: search_notes(db, "smooth", no_filters, args.limit,
+                                                                 first_page[1]))
+    db.close()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "meta": {
+                    "timestamp": datetime.now(timezone.utc).isoformat(),
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "notes": args.notes,
+                    "limit": args.limit,
+                },
+                "results": results,
+            }, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Offline evaluation of the cascade (early-exit) ensemble mode
+
+Replays a labelled feature table through every loaded model one row at a
+time (as /predict does), then simulates cascade mode for one or more
+uncertainty bands. Reports latency savings against agreement with the full
+ensemble and accuracy against the labels.
+
+Usage (from the backend folder):
+    python cascade_eval.py processed_features_F45.csv
+    python cascade_eval.py processed_features_F45.csv --bands 0.2:0.8,0.3:0.7,0.4:0.6 --limit 2000
+    python cascade_eval.py processed_features_F45.csv --order model_3,model_1,model_2 --output cascade.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def score_rows(models: Dict, X: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Per-row, per-model probability of "good" and single-row latency (seconds).
+    Both arrays have shape (n_rows, n_models) in the order of `models`.
+    """
+    names = list(models)
+    probabilities = np.zeros((len(X), len(names)))
+    latencies = np.zeros((len(X), len(names)))
+    for i in range(len(X)):
+        row = X[i:i + 1]
+        for j, name in enumerate(names):
+            start = time.perf_counter()
+            proba = models[name].predict_proba(row)[0]
+            latencies[i, j] = time.perf_counter() - start
+            probabilities[i, j] = proba[1] if len(proba) > 1 else proba[0]
+    return probabilities, latencies
+
+
+def simulate_cascade(probabilities: np.ndarray, latencies: np.ndarray, order: List[int],
+                     low: float, high: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Return (probability, latency, models consulted) per row for a cascade band"""
+    n_rows = probabilities.shape[0]
+    cascade_probability = np.zeros(n_rows)
+    cascade_latency = np.zeros(n_rows)
+    consulted = np.zeros(n_rows, dtype=np.int64)
+    for i in range(n_rows):
+        total = 0.0
+        for k, j in enumerate(order, 1):
+            total += probabilities[i, j]
+            cascade_latency[i] += latencies[i, j]
+            running = total / k
+            consulted[i] = k
+            if running < low or running > high:
+                break
+        cascade_probability[i] = total / consulted[i]
+    return cascade_probability, cascade_latency, consulted
+
+
+def parse_bands(text: str) -> List[Tuple[float, float]]:
+    bands = []
+    for part in text.split(","):
+        low, high = part.split(":")
+        bands.append((float(low), float(high)))
+    return bands
+
+
+def main_cli(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Evaluate cascade ensemble latency vs agreement")
+    parser.add_argument("features", help="Labelled feature table (CSV or Parquet) from the training notebook")
+    parser.add_argument("--bands", default=None,
+                        help="Comma-separated low:high uncertainty bands (default: the configured band)")
+    parser.add_argument("--order", default=None, help="Comma-separated model order (default: ENSEMBLE_CASCADE_ORDER)")
+    parser.add_argument("--limit", type=int, default=1000, help="Rows to sample from the table")
+    parser.add_argument("--output", default=None, help="Write the report as JSON")
+    args = parser.parse_args(argv)
+    args.features = os.path.abspath(args.features)
+    if args.output:
+        args.output = os.path.abspath(args.output)
+
+    # Model paths in main.py are relative to the backend folder
+    os.chdir(BACKEND_DIR)
+    sys.path.insert(0, BACKEND_DIR)
+    import main
+    from training_data import load_labelled_features
+
+    main.load_models()
+    if not main.models:
+        print("No models loaded; nothing to evaluate")
+        return 1
+
+    if args.order:
+        main.CASCADE_ORDER = [name.strip() for name in args.order.split(",") if name.strip()]
+    names = list(main.models)
+    order = [names.index(name) for name in main.get_cascade_order()]
+    bands = parse_bands(args.bands) if args.bands else [(main.CASCADE_BAND_LOW, main.CASCADE_BAND_HIGH)]
+
+    X, y, _ = load_labelled_features(args.features, limit=args.limit)
+    print(f"Scoring {len(X)} rows with {len(names)} models ({', '.join(names)})...")
+    probabilities, latencies = score_rows(main.models, X)
+
+    full_probability = probabilities.mean(axis=1)
+    full_label = (full_probability > 0.5).astype(np.int64)
+    full_latency = latencies.sum(axis=1)
+    report = {
+        "rows": len(X),
+        "models": names,
+        "cascade_order": [names[j] for j in order],
+        "full": {
+            "mean_latency_ms": float(full_latency.mean() * 1000),
+            "p99_latency_ms": float(np.percentile(full_latency, 99) * 1000),
+            "accuracy": float((full_label == y).mean()),
+        },
+        "bands": [],
+    }
+
+    print(f"\nFull ensemble: {report['full']['mean_latency_ms']:.2f} ms/row, "
+          f"accuracy {report['full']['accuracy']:.4f}\n")
+    print(f"{'band':>11s} {'ms/row':>8s} {'saving':>8s} {'avg models':>10s} {'early exit':>10s} "
+          f"{'agreement':>10s} {'max |dp|':>9s} {'accuracy':>9s}")
+    for low, high in bands:
+        cascade_probability, cascade_latency, consulted = simulate_cascade(
+            probabilities, latencies, order, low, high)
+        cascade_label = (cascade_probability > 0.5).astype(np.int64)
+        result = {
+            "band": [low, high],
+            "mean_latency_ms": float(cascade_latency.mean() * 1000),
+            "p99_latency_ms": float(np.percentile(cascade_latency, 99) * 1000),
+            "latency_saving": float(1.0 - cascade_latency.sum() / full_latency.sum()),
+            "mean_models_consulted": float(consulted.mean()),
+            "early_exit_rate": float((consulted < len(order)).mean()),
+            "agreement_with_full": float((cascade_label == full_label).mean()),
+            "max_abs_probability_diff": float(np.abs(cascade_probability - full_probability).max()),
+            "accuracy": float((cascade_label == y).mean()),
+        }
+        report["bands"].append(result)
+        print(f"{low:5.2f}:{high:<5.2f} {result['mean_latency_ms']:8.2f} {result['latency_saving']:8.1%} "
+              f"{result['mean_models_consulted']:10.2f} {result['early_exit_rate']:10.1%} "
+              f"{result['agreement_with_full']:10.2%} {result['max_abs_probability_diff']:9.4f} "
+              f"{result['accuracy']:9.4f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved report to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -34,4 +34,6 @@ def get_db():
         db.close()
 
 def create_tables():
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    # The tables are declared on the models' own Base
+    from models import Base as ModelsBase
+    ModelsBase.metadata.create_all(bind=engine)
\ No newline at end of file
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Distill the 3-model ensemble into a compact "fast" model for triage views
+
+Trains a small forest (or gradient-boosted trees) to regress the ensemble's
+averaged probability of "good" on the notebook's processed features, saves it
+next to the existing models as embryo_model_fast.pkl, and writes
+results_model_fast.json comparing latency, size and accuracy/AUC against the
+teacher ensemble and results_model_*.json.
+
+Usage (from the backend folder):
+    python distill_model.py processed_features_F45.csv
+    python distill_model.py processed_features_F45.csv --student gbt --max-depth 4 --n-estimators 100
+
+Serve it with POST /predict?mode=fast
+"""
+
+import argparse
+import glob
+import io
+import json
+import os
+import sys
+import time
+from typing import Dict, List, Optional
+
+import joblib
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_DIR = os.path.join(BACKEND_DIR, '..', 'Complete_training_pipeline')
+
+
+def teacher_probabilities(models: Dict, X: np.ndarray) -> np.ndarray:
+    """Averaged probability of "good" across the ensemble, evaluated as one matrix per model"""
+    per_model = []
+    for model in models.values():
+        proba = model.predict_proba(X)
+        per_model.append(proba[:, 1] if proba.shape[1] > 1 else proba[:, 0])
+    return np.mean(per_model, axis=0)
+
+
+def build_student(kind: str, n_estimators: int, max_depth: int, seed: int):
+    if kind == 'gbt':
+        from sklearn.ensemble import GradientBoostingRegressor
+        return GradientBoostingRegressor(n_estimators=n_estimators, max_depth=max_depth,
+                                         learning_rate=0.1, subsample=0.8, random_state=seed)
+    from sklearn.ensemble import RandomForestRegressor
+    return RandomForestRegressor(n_estimators=n_estimators, max_depth=max_depth,
+                                 min_samples_leaf=2, random_state=seed, n_jobs=1)
+
+
+def single_row_latency_ms(predict, X: np.ndarray, rows: int = 200) -> Dict[str, float]:
+    """p50/p99 latency of one-row predictions, as served by /predict"""
+    durations = []
+    for i in range(min(rows, len(X))):
+        row = X[i:i + 1]
+        start = time.perf_counter()
+        predict(row)
+        durations.append((time.perf_counter() - start) * 1000)
+    return {"p50_ms": float(np.percentile(durations, 50)), "p99_ms": float(np.percentile(durations, 99))}
+
+
+def pickled_size_bytes(obj) -> int:
+    buffer = io.BytesIO()
+    joblib.dump(obj, buffer)
+    return buffer.tell()
+
+
+def total_nodes(model) -> int:
+    estimators = getattr(model, 'estimators_', [])
+    trees = np.ravel(estimators) if len(estimators) else []
+    return int(sum(tree.tree_.node_count for tree in trees))
+
+
+def classification_metrics(y_true: np.ndarray, probability: np.ndarray) -> Dict:
+    from sklearn.metrics import accuracy_score, confusion_matrix, f1_score, precision_score, recall_score, roc_auc_score
+    y_pred = (probability > 0.5).astype(int)
+    metrics = {
+        "accuracy": float(accuracy_score(y_true, y_pred)),
+        "precision": float(precision_score(y_true, y_pred, zero_division=0)),
+        "recall": float(recall_score(y_true, y_pred, zero_division=0)),
+        "f1_score": float(f1_score(y_true, y_pred, zero_division=0)),
+        "confusion_matrix": confusion_matrix(y_true, y_pred, labels=[0, 1]).tolist(),
+    }
+    metrics["auc_roc"] = float(roc_auc_score(y_true, probability)) if len(np.unique(y_true)) > 1 else None
+    return metrics
+
+
+def load_reference_results() -> Dict[str, Dict]:
+    """Accuracy/AUC recorded by the training notebook for each production model"""
+    reference = {}
+    for path in sorted(glob.glob(os.path.join(MODEL_DIR, 'results_model_[0-9]*.json'))):
+        with open(path) as f:
+            results = json.load(f)
+        name = os.path.splitext(os.path.basename(path))[0].replace('results_', '')
+        reference[name] = {key: results.get(key) for key in ("accuracy", "auc_roc", "f1_score", "test_size")}
+    return reference
+
+
+def main_cli(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Distill the ensemble into a compact fast model")
+    parser.add_argument("features", help="Labelled feature table (CSV or Parquet) from the training notebook")
+    parser.add_argument("--student", choices=["rf", "gbt"], default="rf")
+    parser.add_argument("--n-estimators", type=int, default=30)
+    parser.add_argument("--max-depth", type=int, default=6)
+    parser.add_argument("--test-size", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output-dir", default=MODEL_DIR, help="Where to save the model and report")
+    args = parser.parse_args(argv)
+    args.features = os.path.abspath(args.features)
+    args.output_dir = os.path.abspath(args.output_dir)
+
+    os.chdir(BACKEND_DIR)
+    sys.path.insert(0, BACKEND_DIR)
+    import main
+    from sklearn.model_selection import train_test_split
+    from training_data import load_labelled_features
+
+    main.load_models()
+    if not main.models:
+        print("No ensemble models loaded; cannot distill")
+        return 1
+
+    X, y, _ = load_labelled_features(args.features)
+    stratify = y if len(np.unique(y)) > 1 else None
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=args.test_size, random_state=args.seed, stratify=stratify)
+
+    print(f"Computing teacher soft targets for {len(X)} rows from {len(main.models)} models...")
+    soft_train = teacher_probabilities(main.models, X_train)
+    soft_test = teacher_probabilities(main.models, X_test)
+
+    print(f"Training {args.student} student (n_estimators={args.n_estimators}, max_depth={args.max_depth})...")
+    student = build_student(args.student, args.n_estimators, args.max_depth, args.seed)
+    started = time.perf_counter()
+    student.fit(X_train, soft_train)
+    train_seconds = time.perf_counter() - started
+    student_test = np.clip(student.predict(X_test), 0.0, 1.0)
+
+    teacher_size = sum(pickled_size_bytes(model) for model in main.models.values())
+    student_size = pickled_size_bytes(student)
+    teacher_latency = single_row_latency_ms(lambda row: teacher_probabilities(main.models, row), X_test)
+    student_latency = single_row_latency_ms(student.predict, X_test)
+
+    student_metrics = classification_metrics(y_test, student_test)
+    report = {
+        "focal_plane": "F45",
+        "model_type": f"distilled_{args.student}",
+        "dataset_size": int(len(X)),
+        "train_size": int(len(X_train)),
+        "test_size": int(len(X_test)),
+        **student_metrics,
+        "fidelity": {
+            "agreement_with_ensemble": float(((student_test > 0.5) == (soft_test > 0.5)).mean()),
+            "mean_abs_probability_diff": float(np.abs(student_test - soft_test).mean()),
+        },
+        "ensemble": classification_metrics(y_test, soft_test),
+        "latency": {"ensemble": teacher_latency, "fast": student_latency},
+        "size": {
+            "ensemble_bytes": int(teacher_size),
+            "fast_bytes": int(student_size),
+            "ensemble_nodes": int(sum(total_nodes(m) for m in main.models.values())),
+            "fast_nodes": total_nodes(student),
+        },
+        "reference_results": load_reference_results(),
+        "model_params": {
+            "student": args.student,
+            "n_estimators": args.n_estimators,
+            "max_depth": args.max_depth,
+            "random_state": args.seed,
+        },
+        "train_seconds": train_seconds,
+    }
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    model_path = os.path.join(args.output_dir, 'embryo_model_fast.pkl')
+    results_path = os.path.join(args.output_dir, 'results_model_fast.json')
+    joblib.dump(student, model_path)
+    with open(results_path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\n{'='*72}")
+    print(f"{'':24s} {'ensemble':>14s} {'fast':>14s}")
+    print(f"{'p50 latency (ms)':24s} {teacher_latency['p50_ms']:14.3f} {student_latency['p50_ms']:14.3f}")
+    print(f"{'p99 latency (ms)':24s} {teacher_latency['p99_ms']:14.3f} {student_latency['p99_ms']:14.3f}")
+    print(f"{'size (KiB)':24s} {teacher_size / 1024:14.1f} {student_size / 1024:14.1f}")
+    print(f"{'accuracy':24s} {report['ensemble']['accuracy']:14.4f} {student_metrics['accuracy']:14.4f}")
+    if student_metrics['auc_roc'] is not None:
+        print(f"{'AUC-ROC':24s} {report['ensemble']['auc_roc']:14.4f} {student_metrics['auc_roc']:14.4f}")
+    print(f"{'agreement with ensemble':24s} {'':14s} {report['fidelity']['agreement_with_ensemble']:14.2%}")
+    for name, ref in report['reference_results'].items():
+        print(f"{name + ' (notebook)':24s} accuracy {ref['accuracy']}  AUC {ref['auc_roc']}")
+    print(f"{'='*72}")
+    print(f"Saved {model_path}\nSaved {results_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
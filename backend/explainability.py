@@ -0,0 +1,212 @@
+"""
+Per-prediction feature contributions for the tree ensembles
+
+Uses tree-path attribution (Saabas): walking from a tree's root to the leaf a
+sample lands in, each split moves the node value (probability of "good") by
+value[child] - value[parent], and that change is credited to the split
+feature. For every tree the model output is then exactly
+
+    value[root] + sum of contributions along the path
+
+and averaging over trees and models gives the ensemble probability. A
+gradient-boosted regressor (distill_model.py --student gbt) instead adds its
+trees: its output is init + learning_rate * sum of tree outputs, so its trees
+are summed with that weight on top of the init value. Boosted classifiers
+pass the sum through a sigmoid, which is not additive, and are not explained.
+
+Contributions only depend on the leaf, so the cumulative per-node vectors
+are precomputed once when models load. At request time all trees of all
+models in a set are walked together as one flattened array (leaves point to
+themselves, so a fixed number of vectorized steps reaches every leaf) and
+the leaf contributions are gathered and averaged.
+"""
+
+from typing import Dict, List, Optional, Tuple
+import logging
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Rows per gather so batch explanations stay within a bounded amount of memory
+EXPLAIN_CHUNK_ROWS = 256
+
+
+class ForestTables:
+    """Flattened node arrays for every tree of every model in a set"""
+
+    def __init__(self, models: Dict[str, object], n_features: int):
+        self.model_names = list(models)
+        self.n_features = n_features
+        features, thresholds, lefts, rights, contributions, roots, root_values = [], [], [], [], [], [], []
+        tree_ranges = []
+        # Per model: output = offset + tree_weight * sum over its trees
+        self.tree_weight, self.offset = [], []
+        offset = 0
+        max_depth = 0
+        for name in self.model_names:
+            first_tree = len(roots)
+            for estimator in np.ravel(models[name].estimators_):
+                tree = estimator.tree_
+                value = node_values(models[name], tree)
+                n_nodes = tree.node_count
+                is_leaf = tree.children_left < 0
+                node_ids = np.arange(n_nodes)
+                # Leaves loop back to themselves so extra traversal steps are no-ops
+                lefts.append(np.where(is_leaf, node_ids, tree.children_left) + offset)
+                rights.append(np.where(is_leaf, node_ids, tree.children_right) + offset)
+                features.append(np.where(is_leaf, 0, tree.feature))
+                thresholds.append(tree.threshold)
+                contributions.append(path_contributions(tree, value, n_features))
+                roots.append(offset)
+                root_values.append(value[0])
+                max_depth = max(max_depth, tree.max_depth)
+                offset += n_nodes
+            tree_ranges.append((first_tree, len(roots)))
+            tree_weight, offset_value = tree_weighting(models[name], n_features)
+            self.tree_weight.append(tree_weight)
+            self.offset.append(offset_value)
+
+        self.feature = np.concatenate(features).astype(np.intp)
+        self.threshold = np.concatenate(thresholds)
+        self.left = np.concatenate(lefts).astype(np.intp)
+        self.right = np.concatenate(rights).astype(np.intp)
+        self.contribution = np.concatenate(contributions).astype(np.float32)
+        self.roots = np.asarray(roots, dtype=np.intp)
+        self.root_value = np.asarray(root_values, dtype=np.float64)
+        self.tree_ranges = tree_ranges
+        self.max_depth = max_depth
+
+    @property
+    def nbytes(self) -> int:
+        return int(sum(a.nbytes for a in (self.feature, self.threshold, self.left, self.right, self.contribution)))
+
+    def leaves(self, X: np.ndarray) -> np.ndarray:
+        """Leaf node index (into the flattened arrays) per row and tree: (n_rows, n_trees)"""
+        # Trees compare float32 features against their thresholds
+        X = np.asarray(X, dtype=np.float32)
+        rows = np.arange(len(X))[:, None]
+        nodes = np.broadcast_to(self.roots, (len(X), len(self.roots))).copy()
+        for _ in range(self.max_depth):
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        return nodes
+
+    def explain(self, X: np.ndarray, model_names: Optional[List[str]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Base value (n_rows,) and feature contributions (n_rows, n_features) of the
+        averaged model output (probability of "good") over `model_names`
+        (default: all models)
+        """
+        selected = [self.model_names.index(name) for name in (model_names or self.model_names)]
+        base = np.zeros(len(X))
+        contributions = np.zeros((len(X), self.n_features))
+        for start in range(0, len(X), EXPLAIN_CHUNK_ROWS):
+            chunk = slice(start, start + EXPLAIN_CHUNK_ROWS)
+            leaves = self.leaves(X[chunk])
+            for index in selected:
+                first, last = self.tree_ranges[index]
+                contributions[chunk] += self.tree_weight[index] * self.contribution[leaves[:, first:last]].sum(axis=1)
+        for index in selected:
+            first, last = self.tree_ranges[index]
+            base += self.offset[index] + self.tree_weight[index] * self.root_value[first:last].sum()
+        return base / len(selected), contributions / len(selected)
+
+
+def is_boosted(model) -> bool:
+    return hasattr(model, "learning_rate") and hasattr(model, "init_")
+
+
+def is_explainable(model) -> bool:
+    """Forests, and boosted regressors (boosted classifiers are not additive in probability)"""
+    return hasattr(model, "estimators_") and not (is_boosted(model) and hasattr(model, "predict_proba"))
+
+
+def tree_weighting(model, n_features: int) -> Tuple[float, float]:
+    """(weight per tree, offset) such that the model output is offset + weight * sum of its tree outputs"""
+    trees = np.ravel(model.estimators_)
+    if not is_boosted(model):
+        return 1.0 / len(trees), 0.0
+    # The init estimator's constant, read back through the public predict
+    x = np.zeros((1, n_features), dtype=np.float32)
+    trees_sum = sum(float(tree.predict(x)[0]) for tree in trees)
+    return float(model.learning_rate), float(model.predict(x)[0]) - model.learning_rate * trees_sum
+
+
+def node_values(model, tree) -> np.ndarray:
+    """Per-node probability of "good" (classifiers) or predicted value (regressors)"""
+    value = tree.value[:, 0, :]
+    if hasattr(model, "predict_proba"):
+        value = value / value.sum(axis=1, keepdims=True)
+        # Same column choice as the ensemble: class 1 when there are two classes
+        return value[:, 1] if value.shape[1] > 1 else value[:, 0]
+    return value[:, 0]
+
+
+def path_contributions(tree, value: np.ndarray, n_features: int) -> np.ndarray:
+    """Cumulative root-to-node contribution vector for every node: (n_nodes, n_features)"""
+    n_nodes = tree.node_count
+    parent = np.full(n_nodes, -1)
+    internal = np.flatnonzero(tree.children_left >= 0)
+    parent[tree.children_left[internal]] = internal
+    parent[tree.children_right[internal]] = internal
+
+    # Children always have larger ids than their parent, so filling level by
+    # level from the root only reads rows that are already complete
+    depth = np.zeros(n_nodes, dtype=np.int64)
+    for node in range(1, n_nodes):
+        depth[node] = depth[parent[node]] + 1
+
+    contributions = np.zeros((n_nodes, n_features))
+    for level in range(1, int(depth.max(initial=0)) + 1):
+        nodes = np.flatnonzero(depth == level)
+        parents = parent[nodes]
+        contributions[nodes] = contributions[parents]
+        contributions[nodes, tree.feature[parents]] += value[nodes] - value[parents]
+    return contributions
+
+
+_tables: Dict[str, ForestTables] = {}
+_tables_lock = threading.Lock()
+
+
+def prepare_explainer(name: str, models: Dict[str, object], n_features: int) -> Optional[ForestTables]:
+    """Precompute contribution tables for a model set; sets with other models are skipped"""
+    if not models or not all(is_explainable(model) for model in models.values()):
+        logger.info(f"Model set '{name}' has models without additive trees; explanations disabled for it")
+        return None
+    tables = ForestTables(models, n_features)
+    with _tables_lock:
+        _tables[name] = tables
+    logger.info(f"Prepared explainer for '{name}': {len(tables.roots)} trees, "
+                f"{len(tables.feature)} nodes, {tables.nbytes / 1e6:.1f} MB")
+    return tables
+
+
+def get_explainer(name: str) -> Optional[ForestTables]:
+    with _tables_lock:
+        return _tables.get(name)
+
+
+def explain_prediction(name: str, x: np.ndarray, feature_names: List[str],
+                       model_names: Optional[List[str]] = None) -> Optional[Dict]:
+    """Explanation of one prediction as returned by /predict?explain=true"""
+    tables = get_explainer(name)
+    if tables is None:
+        return None
+    base, contributions = tables.explain(np.atleast_2d(x), model_names)
+    return {
+        "method": "tree_path",
+        "base_value": float(base[0]),
+        "contributions": {feature: float(value) for feature, value in zip(feature_names, contributions[0])},
+        "models": model_names or tables.model_names,
+    }
+
+
+def explain_batch(name: str, X: np.ndarray, model_names: Optional[List[str]] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Base values and contributions for a feature matrix; raises KeyError if the set has no explainer"""
+    tables = get_explainer(name)
+    if tables is None:
+        raise KeyError(f"No explainer prepared for model set '{name}'")
+    return tables.explain(X, model_names)
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+Parallel, resumable feature extraction for training
+
+Replaces the notebook's serial extraction loop (and its every-1,000-images
+re-pickling of the cumulative lists). Images are split into fixed shards
+which worker processes extract with the backend's own preprocess_image_fast
+and extract_features_fast, so training and serving features cannot drift
+apart. Each finished shard is written once, atomically:
+
+    <output>/shard-<index>-<digest>.npy    float32 (n, 20) in FEATURE_NAMES order
+    <output>/shard-<index>-<digest>.json   image ids, labels, failures, timing
+
+The digest covers the shard's image list and the extractor version, and the
+.json is written last, so a rerun skips every completed shard and redoes only
+the missing or interrupted ones. The combined table is then written as
+processed_features_<plane>.csv/.parquet for the notebook and the offline
+tools (training_data.load_labelled_features).
+
+With --cache, shards are replaced by the content-addressed FeatureCache
+(feature_cache.py): images are hashed (reusing hashes of files whose size
+and mtime are unchanged), only hashes missing from the cache are extracted,
+and the table is assembled from the memory-mapped cache, so a retraining run
+costs time in proportion to the new images rather than the whole dataset.
+
+Usage (from the backend folder):
+    python extract_features.py /data/embryo_dataset_F45 --annotations /data/embryo_dataset_annotations \\
+        --output features_F45 --table processed_features_F45.parquet
+    python extract_features.py /data/embryo_dataset_F45 --workers 8 --shard-size 2000
+    python extract_features.py /data/embryo_dataset_F45 --annotations /data/embryo_dataset_annotations \
+        --cache feature_cache --table processed_features_F45.parquet
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from atomic_files import atomic_write
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".webp")
+SHARD_PREFIX = "shard-"
+HASH_READ_BYTES = 1024 * 1024
+HASH_MANIFEST = "file_hashes.json"
+
+# Set per worker process by init_worker
+_main = None
+
+
+def init_worker():
+    """Import the backend's extractor once per worker process"""
+    global _main
+    os.chdir(BACKEND_DIR)
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    import logging
+    logging.disable(logging.ERROR)
+    import main
+    _main = main
+
+
+def extract_shard(paths: List[str]) -> Tuple[np.ndarray, List[int], float]:
+    """(features for the readable images, indices of those images within the shard, seconds)"""
+    started = time.perf_counter()
+    rows, kept = [], []
+    for i, path in enumerate(paths):
+        try:
+            features = _main.extract_features_fast(_main.preprocess_image_fast(path))
+        except Exception:
+            continue
+        rows.append([features.get(name, 0.0) for name in _main.FEATURE_NAMES])
+        kept.append(i)
+    X = np.asarray(rows, dtype=np.float32).reshape(-1, len(_main.FEATURE_NAMES))
+    return X, kept, time.perf_counter() - started
+
+
+def hash_files(paths: List[str]) -> List[Optional[str]]:
+    """SHA-256 of each file's contents (None if unreadable)"""
+    hashes = []
+    for path in paths:
+        try:
+            hasher = hashlib.sha256()
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(HASH_READ_BYTES), b""):
+                    hasher.update(block)
+            hashes.append(hasher.hexdigest())
+        except OSError:
+            hashes.append(None)
+    return hashes
+
+
+def find_images(root: str) -> List[str]:
+    """Every image under `root`, sorted so shard membership is stable across runs"""
+    found = []
+    for directory, _, files in os.walk(root):
+        found.extend(os.path.join(directory, name) for name in files if name.lower().endswith(IMAGE_EXTENSIONS))
+    return sorted(found)
+
+
+def image_id(path: str) -> str:
+    """<embryo folder>/<file name>, as the notebook records it"""
+    return f"{os.path.basename(os.path.dirname(path))}/{os.path.basename(path)}"
+
+
+def shard_name(index: int, paths: List[str], extractor_version: str) -> str:
+    digest = hashlib.sha256(extractor_version.encode())
+    for path in paths:
+        digest.update(image_id(path).encode() + b"\0")
+    return f"{SHARD_PREFIX}{index:05d}-{digest.hexdigest()[:12]}"
+
+
+def write_shard(output_dir: str, name: str, X: np.ndarray, ids: List[str], labels: List[int],
+                failed: int, seconds: float, extractor_version: str):
+    # The .npy first: a shard only counts as done once its .json exists
+    atomic_write(os.path.join(output_dir, name + ".npy"), lambda f: np.save(f, X))
+    meta = {
+        "extractor_version": extractor_version,
+        "rows": len(ids),
+        "image_ids": ids,
+        "labels": labels,
+        "failed": failed,
+        "seconds": round(seconds, 3),
+    }
+    atomic_write(os.path.join(output_dir, name + ".json"), lambda f: f.write(json.dumps(meta).encode()))
+
+
+def completed_shards(output_dir: str) -> set:
+    return {name[:-len(".json")] for name in os.listdir(output_dir)
+            if name.startswith(SHARD_PREFIX) and name.endswith(".json")}
+
+
+def load_shards(output_dir: str, names: List[str], n_features: int) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+    """Concatenate shards into (X, labels, image_ids)"""
+    matrices, labels, ids = [], [], []
+    for name in names:
+        with open(os.path.join(output_dir, name + ".json")) as f:
+            meta = json.load(f)
+        matrices.append(np.load(os.path.join(output_dir, name + ".npy"), mmap_mode="r"))
+        labels.extend(meta["labels"])
+        ids.extend(meta["image_ids"])
+    X = np.concatenate(matrices) if matrices else np.empty((0, n_features), dtype=np.float32)
+    return X, np.asarray(labels, dtype=np.int64), ids
+
+
+def _report(label: str, processed: int, total: int, started: float):
+    elapsed = time.perf_counter() - started
+    rate = processed / elapsed if elapsed > 0 else 0.0
+    eta = (total - processed) / rate if rate > 0 else 0.0
+    print(f"  {label} | {processed}/{total} at {rate:.1f} images/s, ETA {eta:.0f}s")
+
+
+def batches(items: List, size: int) -> List[List]:
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+def content_hashes(pool: ProcessPoolExecutor, paths: List[str], manifest_path: str,
+                   batch_size: int) -> List[Optional[str]]:
+    """
+    Hash every image, reusing the stored hash of files whose size and mtime
+    have not changed since the last run (kept in `manifest_path`)
+    """
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+
+    hashes: List[Optional[str]] = [None] * len(paths)
+    stats = {}
+    stale = []
+    for i, path in enumerate(paths):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        stats[path] = [stat.st_size, stat.st_mtime_ns]
+        entry = manifest.get(path)
+        if entry is not None and entry[:2] == stats[path]:
+            hashes[i] = entry[2]
+        else:
+            stale.append(i)
+
+    if stale:
+        print(f"Hashing {len(stale)} new or changed files ({len(paths) - len(stale)} unchanged)")
+        started = time.perf_counter()
+        done = 0
+        futures = {pool.submit(hash_files, [paths[i] for i in batch]): batch for batch in batches(stale, batch_size)}
+        for future in as_completed(futures):
+            batch = futures[future]
+            for i, sha256 in zip(batch, future.result()):
+                hashes[i] = sha256
+            done += len(batch)
+            _report("hashed", done, len(stale), started)
+
+    updated = {path: stats[path] + [sha256] for path, sha256 in zip(paths, hashes) if sha256 is not None}
+    atomic_write(manifest_path, lambda f: f.write(json.dumps(updated).encode()))
+    return hashes
+
+
+def run_cached(pool: ProcessPoolExecutor, paths: List[str], cache_root: str,
+               extractor_version: str, batch_size: int):
+    """Extract only images whose content is not cached yet; returns (X, readable mask)"""
+    from feature_cache import FeatureCache
+
+    cache = FeatureCache(cache_root, extractor_version, len(_main.FEATURE_NAMES))
+    hashes = content_hashes(pool, paths, os.path.join(cache_root, HASH_MANIFEST), batch_size)
+    path_by_hash = {}
+    for path, sha256 in zip(paths, hashes):
+        if sha256 is not None:
+            path_by_hash.setdefault(sha256, path)
+    missing = cache.missing(list(path_by_hash))
+    print(f"{len(path_by_hash)} distinct images, {len(path_by_hash) - len(missing)} cached "
+          f"({cache.parts} parts), {len(missing)} to extract [{extractor_version}]")
+
+    started = time.perf_counter()
+    processed = failed = 0
+    if missing:
+        futures = {pool.submit(extract_shard, [path_by_hash[sha256] for sha256 in batch]): batch
+                   for batch in batches(missing, batch_size)}
+        for future in as_completed(futures):
+            batch = futures[future]
+            X, kept, seconds = future.result()
+            # Each finished batch is persisted at once, so an interrupted run resumes from here
+            cache.add([batch[i] for i in kept], X)
+            processed += len(batch)
+            failed += len(batch) - len(kept)
+            _report(f"{len(kept)}/{len(batch)} extracted in {seconds:.1f}s", processed, len(missing), started)
+        elapsed = time.perf_counter() - started
+        print(f"Extracted {processed} images in {elapsed:.1f}s "
+              f"({processed / elapsed if elapsed > 0 else 0.0:.1f} images/s, {failed} unreadable)")
+
+    started = time.perf_counter()
+    X, found = cache.matrix([sha256 or "00" * 32 for sha256 in hashes])
+    print(f"Assembled {int(found.sum())} rows from the cache in {time.perf_counter() - started:.2f}s")
+    return X, found
+
+
+def write_table(path: str, X: np.ndarray, labels: np.ndarray, ids: List[str], feature_names: List[str]):
+    import pandas as pd
+    df = pd.DataFrame(X, columns=feature_names)
+    df["label"] = labels
+    df["image_id"] = ids
+    if path.endswith(".parquet"):
+        df.to_parquet(path, index=False)
+    else:
+        df.to_csv(path, index=False)
+
+
+def main_cli(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Extract training features in parallel, resumable shards")
+    parser.add_argument("images", help="Folder of images (one subfolder per embryo, as in the dataset)")
+    parser.add_argument("--annotations", default=None,
+                        help="Folder of <embryo>_phases.csv files; images of unlabelled embryos are skipped")
+    parser.add_argument("--output", default="features", help="Shard folder (reused to resume)")
+    parser.add_argument("--cache", default=None,
+                        help="Content-hash feature cache folder; only new or changed images are extracted")
+    parser.add_argument("--table", default=None,
+                        help="Also write the combined table (.csv or .parquet), e.g. processed_features_F45.parquet")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--shard-size", type=int, default=2000)
+    parser.add_argument("--limit", type=int, default=None, help="Only the first N images (for trial runs)")
+    args = parser.parse_args(argv)
+    image_root = os.path.abspath(args.images)
+    output_dir = os.path.abspath(args.output)
+    table_path = os.path.abspath(args.table) if args.table else None
+    annotations_dir = os.path.abspath(args.annotations) if args.annotations else None
+    cache_root = os.path.abspath(args.cache) if args.cache else None
+
+    init_worker()
+    from training_data import load_phase_labels
+    extractor_version = _main.FEATURE_EXTRACTOR_VERSION
+
+    paths = find_images(image_root)
+    labels: Optional[Dict[str, int]] = None
+    skipped_no_label = 0
+    if annotations_dir:
+        labels = load_phase_labels(annotations_dir)
+        labelled = [p for p in paths if os.path.basename(os.path.dirname(p)) in labels]
+        skipped_no_label = len(paths) - len(labelled)
+        paths = labelled
+    if args.limit is not None:
+        paths = paths[:args.limit]
+
+    if cache_root:
+        print(f"{len(paths)} images ({skipped_no_label} without a label skipped), {args.workers} workers")
+        os.makedirs(cache_root, exist_ok=True)
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker) as pool:
+            X, found = run_cached(pool, paths, cache_root, extractor_version, args.shard_size)
+        if table_path:
+            kept_paths = [p for p, ok in zip(paths, found) if ok]
+            y = np.asarray([labels[os.path.basename(os.path.dirname(p))] if labels else -1 for p in kept_paths])
+            write_table(table_path, X[found], y, [image_id(p) for p in kept_paths], _main.FEATURE_NAMES)
+            print(f"Wrote {len(kept_paths)} rows to {table_path}")
+        return 0
+
+    shards = []
+    for index, start in enumerate(range(0, len(paths), args.shard_size)):
+        shard_paths = paths[start:start + args.shard_size]
+        shards.append((shard_name(index, shard_paths, extractor_version), shard_paths))
+
+    os.makedirs(output_dir, exist_ok=True)
+    done = completed_shards(output_dir)
+    pending = [(name, shard_paths) for name, shard_paths in shards if name not in done]
+    pending_images = sum(len(shard_paths) for _, shard_paths in pending)
+    print(f"{len(paths)} images in {len(shards)} shards ({skipped_no_label} without a label skipped); "
+          f"{len(shards) - len(pending)} shards already done, {pending_images} images to extract "
+          f"with {args.workers} workers [{extractor_version}]")
+
+    started = time.perf_counter()
+    processed = failed = 0
+    if pending:
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker) as pool:
+            futures = {pool.submit(extract_shard, shard_paths): (name, shard_paths) for name, shard_paths in pending}
+            for future in as_completed(futures):
+                name, shard_paths = futures[future]
+                X, kept, seconds = future.result()
+                kept_paths = [shard_paths[i] for i in kept]
+                shard_labels = [labels[os.path.basename(os.path.dirname(p))] if labels else -1 for p in kept_paths]
+                write_shard(output_dir, name, X, [image_id(p) for p in kept_paths], shard_labels,
+                            len(shard_paths) - len(kept), seconds, extractor_version)
+
+                processed += len(shard_paths)
+                failed += len(shard_paths) - len(kept)
+                _report(f"{name}: {len(kept)}/{len(shard_paths)} images in {seconds:.1f}s",
+                        processed, pending_images, started)
+
+    elapsed = time.perf_counter() - started
+    if pending:
+        print(f"Extracted {processed} images in {elapsed:.1f}s "
+              f"({processed / elapsed if elapsed > 0 else 0.0:.1f} images/s, {failed} unreadable)")
+
+    if table_path:
+        X, y, ids = load_shards(output_dir, [name for name, _ in shards], len(_main.FEATURE_NAMES))
+        write_table(table_path, X, y, ids, _main.FEATURE_NAMES)
+        print(f"Wrote {len(ids)} rows to {table_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
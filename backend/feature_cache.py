@@ -0,0 +1,114 @@
+"""
+Persistent feature cache for incremental retraining
+
+Features are keyed by image content hash (SHA-256) within a directory per
+extractor version, so an unchanged image is extracted once per extractor
+version no matter where it lives in the dataset, and bumping
+FEATURE_EXTRACTOR_VERSION starts a fresh cache instead of mixing vectors.
+
+Each batch of newly extracted images is appended as one immutable part:
+
+    <root>/<extractor_version>/part-<id>.features.npy   float32 (n, n_features)
+    <root>/<extractor_version>/part-<id>.keys.npy       raw digests, uint8 (n, 32)
+
+The keys file is written last (atomically), so an interrupted run leaves no
+half-visible part and simply resumes with what is missing. Parts are opened
+with mmap, and training matrices are gathered from them row by row without
+loading the whole cache.
+"""
+
+from typing import Dict, List, Tuple
+import os
+import uuid
+
+import numpy as np
+
+from atomic_files import atomic_write
+
+# Digests are stored as uint8 rows, not as "S32": NumPy's bytes dtype strips
+# trailing NULs, so a digest ending in 00 would not round-trip
+KEY_DTYPE = np.dtype("u1")
+KEY_BYTES = 32
+FEATURE_DTYPE = np.dtype("<f4")
+
+
+def _atomic_save(path: str, array: np.ndarray):
+    atomic_write(path, lambda f: np.save(f, array))
+
+
+class FeatureCache:
+    def __init__(self, root: str, extractor_version: str, n_features: int):
+        self.directory = os.path.join(root, extractor_version)
+        self.n_features = n_features
+        self._matrices: List[np.ndarray] = []
+        self._index: Dict[bytes, Tuple[int, int]] = {}
+        os.makedirs(self.directory, exist_ok=True)
+        for name in sorted(os.listdir(self.directory)):
+            if name.startswith("part-") and name.endswith(".keys.npy"):
+                self._open_part(name[:-len(".keys.npy")])
+
+    def _open_part(self, part: str):
+        keys = np.load(os.path.join(self.directory, part + ".keys.npy"), mmap_mode="r")
+        matrix = np.load(os.path.join(self.directory, part + ".features.npy"), mmap_mode="r")
+        number = len(self._matrices)
+        self._matrices.append(matrix)
+        if keys.dtype.kind == "S":
+            # Parts written before keys were uint8: restore the stripped trailing NULs
+            digests = [key.ljust(KEY_BYTES, b"\0") for key in keys.tolist()]
+        else:
+            raw = np.ascontiguousarray(keys).tobytes()
+            digests = [raw[i:i + KEY_BYTES] for i in range(0, len(raw), KEY_BYTES)]
+        for row, key in enumerate(digests):
+            self._index.setdefault(key, (number, row))
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, sha256: str) -> bool:
+        return bytes.fromhex(sha256) in self._index
+
+    @property
+    def parts(self) -> int:
+        return len(self._matrices)
+
+    def missing(self, hashes: List[str]) -> List[str]:
+        """Distinct hashes not in the cache, in first-seen order"""
+        seen = set()
+        result = []
+        for sha256 in hashes:
+            if sha256 not in seen and bytes.fromhex(sha256) not in self._index:
+                seen.add(sha256)
+                result.append(sha256)
+        return result
+
+    def add(self, hashes: List[str], X: np.ndarray) -> int:
+        """Append the rows whose hash is not cached yet as a new part; returns rows added"""
+        keep = [i for i, sha256 in enumerate(hashes) if bytes.fromhex(sha256) not in self._index]
+        if not keep:
+            return 0
+        part = f"part-{uuid.uuid4().hex}"
+        matrix = np.ascontiguousarray(np.asarray(X)[keep], dtype=FEATURE_DTYPE).reshape(-1, self.n_features)
+        keys = np.frombuffer(b"".join(bytes.fromhex(hashes[i]) for i in keep), dtype=KEY_DTYPE).reshape(-1, KEY_BYTES)
+        _atomic_save(os.path.join(self.directory, part + ".features.npy"), matrix)
+        _atomic_save(os.path.join(self.directory, part + ".keys.npy"), keys)
+        self._open_part(part)
+        return len(keep)
+
+    def matrix(self, hashes: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (X, found) for the given hashes in order: rows are gathered part by part
+        from the memory-mapped files; rows of uncached hashes are NaN.
+        """
+        X = np.full((len(hashes), self.n_features), np.nan, dtype=FEATURE_DTYPE)
+        found = np.zeros(len(hashes), dtype=bool)
+        by_part: Dict[int, Tuple[List[int], List[int]]] = {}
+        for i, sha256 in enumerate(hashes):
+            location = self._index.get(bytes.fromhex(sha256))
+            if location is not None:
+                targets, rows = by_part.setdefault(location[0], ([], []))
+                targets.append(i)
+                rows.append(location[1])
+        for number, (targets, rows) in by_part.items():
+            X[targets] = self._matrices[number][rows]
+            found[targets] = True
+        return X, found
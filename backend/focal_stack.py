@@ -0,0 +1,129 @@
+"""
+Multi-focal-plane (focal stack) prediction
+
+The training notebook fits one model per focal plane (FOCAL_PLANE = "F45"
+saves embryo_model_F45.pkl), and embryologists capture the same embryo at
+several planes (F15 ... F75). POST /predict/focal-stack takes one image per
+plane as multipart fields named after the plane. Each plane is routed to its
+plane-specific model set in the model registry ("ensemble_<PLANE>") and the
+planes are scored in parallel on a small thread pool; image decoding, OpenCV
+feature extraction and sklearn prediction release the GIL for most of their
+work. Per-plane probabilities are fused into one result. Planes without a
+model set are reported as skipped rather than failing the request.
+
+Plane model files are looked up next to the production models:
+embryo_model_<PLANE>.pkl, or embryo_model_<n>_<PLANE>.pkl for several models
+per plane. The production ensemble was trained on F45 and serves that plane
+unless a dedicated F45 file exists.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+import glob
+import logging
+import os
+import re
+import time
+
+import numpy as np
+
+from model_registry import get_model_set, list_model_sets, load_model_set, predict_matrix, register_model_set
+
+logger = logging.getLogger(__name__)
+
+PLANE_PATTERN = re.compile(r"^F\d{1,3}$")
+PRODUCTION_PLANE = os.getenv("PRODUCTION_FOCAL_PLANE", "F45")
+MAX_FOCAL_PLANES = 16
+FOCAL_STACK_WORKERS = int(os.getenv("FOCAL_STACK_WORKERS", "4"))
+FUSION_METHODS = ("mean", "confidence_weighted")
+
+_executor = ThreadPoolExecutor(max_workers=FOCAL_STACK_WORKERS, thread_name_prefix="focal-plane")
+
+
+def is_plane_field(name: str) -> bool:
+    return bool(PLANE_PATTERN.match(name))
+
+
+def plane_model_set_name(plane: str) -> str:
+    return f"ensemble_{plane}"
+
+
+def _plane_sort_key(plane: str) -> int:
+    return int(plane[1:])
+
+
+def load_plane_model_sets(model_dir: str, production_models: Dict[str, object]) -> List[str]:
+    """Register a model set per focal plane found in `model_dir`; returns the planes available"""
+    paths_by_plane: Dict[str, List[str]] = {}
+    for path in sorted(glob.glob(os.path.join(model_dir, "embryo_model_*F*.pkl"))):
+        match = re.match(r"^embryo_model_(?:\d+_)?(F\d{1,3})\.pkl$", os.path.basename(path))
+        if match:
+            paths_by_plane.setdefault(match.group(1), []).append(path)
+
+    for plane, paths in paths_by_plane.items():
+        try:
+            load_model_set(plane_model_set_name(plane), paths)
+        except Exception as e:
+            logger.error(f"Failed to load models for focal plane {plane}: {str(e)}")
+
+    if PRODUCTION_PLANE not in paths_by_plane and production_models:
+        register_model_set(plane_model_set_name(PRODUCTION_PLANE), production_models)
+
+    planes = available_planes()
+    logger.info(f"Focal planes with models: {', '.join(planes) or 'none'}")
+    return planes
+
+
+def available_planes() -> List[str]:
+    prefix = plane_model_set_name("")
+    planes = [name[len(prefix):] for name in list_model_sets() if name.startswith(prefix)]
+    return sorted((plane for plane in planes if is_plane_field(plane)), key=_plane_sort_key)
+
+
+def score_plane(plane: str, image_bytes: bytes, featurize: Callable[[str, bytes], np.ndarray]) -> Dict:
+    """Featurize and score one plane; never raises, the outcome is in 'status'"""
+    started = time.perf_counter()
+    name = plane_model_set_name(plane)
+    result = {"plane": plane, "model_set": name, "status": "scored", "probability_good": None,
+              "model_probabilities": {}, "reason": None}
+    try:
+        model_names = list(get_model_set(name))
+    except KeyError:
+        result.update(status="skipped", model_set=None, reason=f"No model set for focal plane {plane}")
+    else:
+        try:
+            X = featurize(plane, image_bytes)
+            averaged, per_model = predict_matrix(name, X, per_model=True)
+            result["probability_good"] = float(averaged[0])
+            result["model_probabilities"] = {model: float(p) for model, p in zip(model_names, per_model[0])}
+        except Exception as e:
+            logger.exception(f"Scoring focal plane {plane} failed")
+            result.update(status="failed", reason=str(e))
+    result["latency_ms"] = (time.perf_counter() - started) * 1000
+    return result
+
+
+def score_planes(images: Dict[str, bytes], featurize: Callable[[str, bytes], np.ndarray]) -> List[Dict]:
+    """
+    Score every plane concurrently; results are ordered by plane.
+    featurize(plane, image_bytes) returns the (1, n_features) matrix for a plane.
+    """
+    planes = sorted(images, key=_plane_sort_key)
+    futures = [_executor.submit(score_plane, plane, images[plane], featurize) for plane in planes]
+    return [future.result() for future in futures]
+
+
+def fuse_planes(plane_results: List[Dict], method: str = "mean") -> Optional[float]:
+    """
+    Fused probability of "good" over the scored planes, or None if none scored.
+    confidence_weighted weights each plane by its distance from 0.5, so a
+    plane that is out of focus (and therefore indecisive) counts for less.
+    """
+    probabilities = np.array([r["probability_good"] for r in plane_results if r["status"] == "scored"])
+    if not len(probabilities):
+        return None
+    if method == "confidence_weighted":
+        weights = np.abs(probabilities - 0.5) * 2
+        if weights.sum() > 0:
+            return float(np.average(probabilities, weights=weights))
+    return float(probabilities.mean())
@@ -0,0 +1,166 @@
+"""
+Content-addressed store for uploaded embryo images
+
+Originals are written once under IMAGE_STORE_DIR/originals/<sha[:2]>/<sha>,
+so re-uploading the same bytes is a no-op, and linked to every embryo they
+were submitted for. Resumable uploads (including time-lapse videos) are
+moved into place from their spool file instead of being copied. A JPEG thumbnail and the 128x128 working image used for
+feature extraction are generated at ingest. Files are served through mmap in
+fixed-size memoryview slices, with strong ETags (the content hash) and
+single byte-range support.
+"""
+
+from sqlalchemy.orm import Session
+from typing import Iterator, List, Optional, Tuple
+import io
+import mmap
+import os
+
+import numpy as np
+from PIL import Image
+
+from atomic_files import atomic_write
+from models import Embryo, ImageLink, StoredImage
+
+IMAGE_STORE_DIR = os.getenv("IMAGE_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "image_store"))
+THUMBNAIL_SIZE = int(os.getenv("IMAGE_THUMBNAIL_SIZE", "256"))
+STREAM_CHUNK_BYTES = 256 * 1024
+
+# variant -> (subdirectory, file suffix, media type); originals keep the upload's type
+IMAGE_VARIANTS = {
+    "original": ("originals", "", None),
+    "thumbnail": ("thumbnails", ".jpg", "image/jpeg"),
+    "working": ("working", ".png", "image/png"),
+}
+
+def variant_path(sha256: str, variant: str = "original") -> str:
+    directory, suffix, _ = IMAGE_VARIANTS[variant]
+    return os.path.join(IMAGE_STORE_DIR, directory, sha256[:2], sha256 + suffix)
+
+def _write_once(path: str, data: bytes):
+    """Atomically create `path` unless it already exists (content-addressed, so equal bytes)"""
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    atomic_write(path, lambda f: f.write(data))
+
+def _encode(image: Image.Image, fmt: str, **options) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt, **options)
+    return buffer.getvalue()
+
+def _store_derived(sha256: str, working_image: np.ndarray, preview: Image.Image):
+    """Write the 128x128 working PNG and the JPEG thumbnail of `preview`"""
+    _write_once(variant_path(sha256, "working"), _encode(Image.fromarray(working_image), "PNG", optimize=True))
+    thumbnail = preview.convert("RGB")
+    thumbnail.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+    _write_once(variant_path(sha256, "thumbnail"), _encode(thumbnail, "JPEG", quality=85))
+
+def _stored_image_row(db: Session, sha256: str, content_type: str, size_bytes: int,
+                      width: Optional[int], height: Optional[int]) -> StoredImage:
+    stored = StoredImage(sha256=sha256, content_type=content_type, size_bytes=size_bytes, width=width, height=height)
+    db.add(stored)
+    db.flush()
+    return stored
+
+def ingest_image(db: Session, contents: bytes, sha256: str, content_type: Optional[str],
+                 working_image: np.ndarray) -> StoredImage:
+    """
+    Persist an upload and its derived variants (caller commits).
+    `working_image` is the array preprocess_image_fast already produced.
+    """
+    stored = db.query(StoredImage).filter(StoredImage.sha256 == sha256).first()
+    if stored is not None and os.path.exists(variant_path(sha256)):
+        return stored
+
+    _write_once(variant_path(sha256), contents)
+    with Image.open(io.BytesIO(contents)) as original:
+        width, height = original.size
+        detected_type = Image.MIME.get(original.format)
+        # draft() lets JPEG decode at a reduced scale, which is most of the thumbnail cost
+        original.draft("RGB", (THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        _store_derived(sha256, working_image, original)
+
+    if stored is None:
+        stored = _stored_image_row(db, sha256, detected_type or content_type or "application/octet-stream",
+                                   len(contents), width, height)
+    return stored
+
+def ingest_file(db: Session, path: str, sha256: str, content_type: str, working_image: np.ndarray,
+                preview: Image.Image, width: Optional[int] = None, height: Optional[int] = None) -> StoredImage:
+    """
+    Persist an assembled upload that is already on local disk by moving it into
+    the store, so large files are never read back (caller commits). `preview`
+    (e.g. a representative video frame) is used for the thumbnail.
+    """
+    stored = db.query(StoredImage).filter(StoredImage.sha256 == sha256).first()
+    destination = variant_path(sha256)
+    size_bytes = os.path.getsize(path)
+    if os.path.exists(destination):
+        os.remove(path)
+    else:
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        os.replace(path, destination)
+    _store_derived(sha256, working_image, preview)
+
+    if stored is None:
+        stored = _stored_image_row(db, sha256, content_type, size_bytes, width, height)
+    return stored
+
+def link_image(db: Session, stored: StoredImage, embryo: Embryo) -> ImageLink:
+    link = db.query(ImageLink).filter(
+        ImageLink.stored_image_id == stored.id,
+        ImageLink.embryo_id == embryo.id
+    ).first()
+    if link is None:
+        link = ImageLink(stored_image_id=stored.id, embryo_id=embryo.id)
+        db.add(link)
+        db.flush()
+    return link
+
+def images_for_embryo(db: Session, embryo_pk: int) -> List[Tuple[StoredImage, ImageLink]]:
+    return (
+        db.query(StoredImage, ImageLink)
+        .join(ImageLink, ImageLink.stored_image_id == StoredImage.id)
+        .filter(ImageLink.embryo_id == embryo_pk)
+        .order_by(ImageLink.created_at.desc())
+        .all()
+    )
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single "bytes=start-end" range into an inclusive (start, end).
+    Returns None for no/unsupported ranges (serve the whole file) and raises
+    ValueError when the range cannot be satisfied.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_text, _, end_text = header[len("bytes="):].strip().partition("-")
+    try:
+        if start_text:
+            start = int(start_text)
+            end = int(end_text) if end_text else size - 1
+        else:
+            # Suffix range: the last N bytes
+            start = max(size - int(end_text), 0)
+            end = size - 1
+    except ValueError:
+        return None
+    end = min(end, size - 1)
+    if start > end or start >= size:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+def iter_file_range(path: str, start: int, end: int) -> Iterator[memoryview]:
+    """
+    Yield [start, end] of a file as memoryview slices of one read-only mapping.
+    The mapping is not closed explicitly: the server may still hold the last
+    slice, and the map is released once no slice references it.
+    """
+    if end < start:
+        return
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    for offset in range(start, end + 1, STREAM_CHUNK_BYTES):
+        yield view[offset:min(offset + STREAM_CHUNK_BYTES, end + 1)]
@@ -0,0 +1,127 @@
+"""
+Micro-batching scheduler for model inference
+
+Concurrent /predict calls each need a 1-row evaluation of every forest, and
+at that size per-call overhead dominates. Requests submit their feature
+vector here instead. A single collector task on the event loop takes the
+first waiting vector, keeps collecting for up to INFERENCE_BATCH_WAIT_MS or
+until INFERENCE_BATCH_MAX vectors, then scores the batch with one matrix
+evaluation per model (model_registry.predict_matrix) on a worker thread and
+resolves each request's future with its row. While a batch is being scored,
+new arrivals queue up, so batches grow naturally under load.
+
+Batch sizes, time spent waiting in the queue and batch run time are kept as
+histograms for tuning the window (GET /metrics/inference).
+"""
+
+from typing import Dict, List, Optional
+import asyncio
+import logging
+import os
+import time
+
+import numpy as np
+
+from metrics import Histogram
+from model_registry import get_model_set, predict_matrix
+
+logger = logging.getLogger(__name__)
+
+INFERENCE_BATCHING = os.getenv("INFERENCE_BATCHING", "1") not in ("0", "false", "False")
+INFERENCE_BATCH_MAX = int(os.getenv("INFERENCE_BATCH_MAX", "32"))
+INFERENCE_BATCH_WAIT_MS = float(os.getenv("INFERENCE_BATCH_WAIT_MS", "2"))
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+LATENCY_BUCKETS_MS = (0.5, 1, 2, 5, 10, 20, 50, 100, 250, 1000)
+
+
+class InferenceScheduler:
+    def __init__(self, max_batch_size: int = INFERENCE_BATCH_MAX, max_wait_ms: float = INFERENCE_BATCH_WAIT_MS):
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+        self.queue_wait_ms = Histogram(LATENCY_BUCKETS_MS)
+        self.batch_run_ms = Histogram(LATENCY_BUCKETS_MS)
+        self.batches = 0
+        self.failed_batches = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._collector: Optional[asyncio.Task] = None
+
+    def _ensure_started(self):
+        # Bound to the running loop; restarted if the app is served by a new loop
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._collector is None or self._collector.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._collector = loop.create_task(self._collect())
+
+    async def submit(self, model_set: str, x: np.ndarray) -> Dict[str, float]:
+        """Probability of "good" per model for one feature row, scored in a shared batch"""
+        self._ensure_started()
+        future = self._loop.create_future()
+        await self._queue.put((model_set, np.asarray(x, dtype=np.float64).reshape(-1), future, time.perf_counter()))
+        return await future
+
+    async def _collect(self):
+        while True:
+            batch = [await self._queue.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            await self._run(batch)
+
+    async def _run(self, batch: List[tuple]):
+        started = time.perf_counter()
+        for _, _, _, submitted in batch:
+            self.queue_wait_ms.observe((started - submitted) * 1000)
+        self.batch_sizes.observe(len(batch))
+        self.batches += 1
+
+        by_model_set: Dict[str, List[tuple]] = {}
+        for item in batch:
+            by_model_set.setdefault(item[0], []).append(item)
+        for model_set, items in by_model_set.items():
+            X = np.vstack([x for _, x, _, _ in items])
+            try:
+                names = list(get_model_set(model_set))
+                _, per_model = await self._loop.run_in_executor(None, lambda: predict_matrix(model_set, X, per_model=True))
+            except Exception as e:
+                self.failed_batches += 1
+                logger.error(f"Batched inference for '{model_set}' failed: {str(e)}")
+                for _, _, future, _ in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for row, (_, _, future, _) in zip(per_model, items):
+                # The request may have gone away while it waited
+                if not future.done():
+                    future.set_result({name: float(p) for name, p in zip(names, row)})
+        self.batch_run_ms.observe((time.perf_counter() - started) * 1000)
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": INFERENCE_BATCHING,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "batches": self.batches,
+            "failed_batches": self.failed_batches,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "batch_size": self.batch_sizes.snapshot(),
+            "queue_wait_ms": self.queue_wait_ms.snapshot(),
+            "batch_run_ms": self.batch_run_ms.snapshot(),
+        }
+
+
+inference_scheduler = InferenceScheduler()
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+Load-test harness replaying mixed clinic traffic with SLO reporting
+
+Starts a local uvicorn instance against a freshly seeded SQLite database (or
+targets --url), then runs virtual embryologists and auditors that replay a
+realistic mix: bursts of /predict uploads per cycle, logins, /audit-logs
+queries, note creation and occasional CSV/PDF exports.
+
+Usage (from the backend folder):
+    python load_test.py --duration 60 --embryologists 4 --auditors 1
+    python load_test.py --slo slo.json --output load_report.json
+    python load_test.py --url http://localhost:8000 --duration 30
+
+The SLO file maps endpoint names to thresholds, e.g.
+    {"predict": {"p95_ms": 400, "p99_ms": 800, "max_error_rate": 0.01},
+     "*": {"p99_ms": 1500, "max_error_rate": 0.02, "max_lock_rate": 0.0}}
+Exits with status 1 when any threshold is breached.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import httpx
+import numpy as np
+
+from bench_inference import encode_image, make_synthetic_embryo
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_SLO = {
+    "predict": {"p95_ms": 500, "p99_ms": 1000, "max_error_rate": 0.01},
+    "login": {"p95_ms": 300, "p99_ms": 600, "max_error_rate": 0.0},
+    "audit_logs": {"p95_ms": 800, "p99_ms": 1500, "max_error_rate": 0.01},
+    "notes": {"p95_ms": 200, "p99_ms": 500, "max_error_rate": 0.01},
+    "export_csv": {"p95_ms": 3000, "p99_ms": 5000, "max_error_rate": 0.01},
+    "export_pdf": {"p95_ms": 5000, "p99_ms": 8000, "max_error_rate": 0.01},
+    "*": {"max_lock_rate": 0.0},
+}
+
+CREDENTIALS = {
+    "embryologist": ("embryologist", "embryo123"),
+    "auditor": ("auditor", "audit123"),
+    "admin": ("admin", "admin123"),
+}
+
+
+class Recorder:
+    """Collects per-endpoint latencies and outcomes"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.locks: Dict[str, int] = defaultdict(int)
+        self.status_codes: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+
+    async def call(self, endpoint: str, coro):
+        start = time.perf_counter()
+        try:
+            response = await coro
+        except httpx.HTTPError:
+            self.latencies[endpoint].append((time.perf_counter() - start) * 1000)
+            self.errors[endpoint] += 1
+            self.status_codes[endpoint][0] += 1
+            return None
+        self.latencies[endpoint].append((time.perf_counter() - start) * 1000)
+        self.status_codes[endpoint][response.status_code] += 1
+        if response.status_code >= 400:
+            self.errors[endpoint] += 1
+            if "database is locked" in response.text.lower():
+                self.locks[endpoint] += 1
+        return response
+
+    def summary(self, elapsed: float) -> Dict[str, Dict]:
+        report = {}
+        for endpoint, values in sorted(self.latencies.items()):
+            arr = np.array(values)
+            count = len(values)
+            report[endpoint] = {
+                "requests": count,
+                "throughput_rps": count / elapsed if elapsed > 0 else 0.0,
+                "p50_ms": float(np.percentile(arr, 50)),
+                "p95_ms": float(np.percentile(arr, 95)),
+                "p99_ms": float(np.percentile(arr, 99)),
+                "max_ms": float(arr.max()),
+                "error_rate": self.errors[endpoint] / count,
+                "lock_rate": self.locks[endpoint] / count,
+                "status_codes": {str(k): v for k, v in self.status_codes[endpoint].items()},
+            }
+        return report
+
+
+def check_slos(report: Dict[str, Dict], slo: Dict[str, Dict]) -> List[str]:
+    """Return human-readable SLO breaches; '*' thresholds apply to every endpoint"""
+    breaches = []
+    defaults = slo.get("*", {})
+    for endpoint, stats in report.items():
+        thresholds = dict(defaults)
+        thresholds.update(slo.get(endpoint, {}))
+        for key, limit in thresholds.items():
+            if key.startswith("max_"):
+                value = stats.get(key[len("max_"):])
+                if value is not None and value > limit:
+                    breaches.append(f"{endpoint}: {key[len('max_'):]} {value:.4f} > {limit}")
+            elif key.endswith("_ms"):
+                value = stats.get(key)
+                if value is not None and value > limit:
+                    breaches.append(f"{endpoint}: {key} {value:.1f} > {limit}")
+    return breaches
+
+
+async def login(client: httpx.AsyncClient, recorder: Recorder, role: str) -> Optional[str]:
+    username, password = CREDENTIALS[role]
+    response = await recorder.call("login", client.post(
+        "/auth/login", json={"username": username, "password": password}))
+    if response is None or response.status_code != 200:
+        return None
+    return response.json()["access_token"]
+
+
+async def seed(client: httpx.AsyncClient, patients: int, cycles_per_patient: int,
+               embryos_per_cycle: int) -> List[Dict]:
+    """Create patients/cycles/embryos through the API; returns cycle descriptors"""
+    response = await client.post("/auth/login", json={"username": "admin", "password": "admin123"})
+    response.raise_for_status()
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    run_tag = f"{int(time.time())}-{random.randint(0, 9999)}"
+
+    cycles = []
+    for p in range(patients):
+        code = f"LT-{run_tag}-P{p:03d}"
+        patient = (await client.post("/patients", json={"audit_code": code}, headers=headers)).json()
+        for c in range(cycles_per_patient):
+            cycle_id = f"C{c + 1}"
+            cycle = (await client.post("/cycles", json={"patient_id": patient["id"], "cycle_id": cycle_id},
+                                       headers=headers)).json()
+            embryo_ids = []
+            for e in range(embryos_per_cycle):
+                embryo_id = f"E{e + 1}"
+                await client.post("/embryos", json={"cycle_id": cycle["id"], "embryo_id": embryo_id},
+                                  headers=headers)
+                embryo_ids.append(embryo_id)
+            cycles.append({"patient_audit_code": code, "cycle_id": cycle_id, "embryo_ids": embryo_ids})
+    return cycles
+
+
+async def embryologist_session(client, recorder, cycles, images, deadline, rng, mix):
+    token = await login(client, recorder, "embryologist")
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    while time.monotonic() < deadline:
+        cycle = rng.choice(cycles)
+        action = rng.choices(list(mix), weights=list(mix.values()))[0]
+        if action == "predict_burst":
+            # One cycle's worth of uploads submitted together, as the Assessment Hub does
+            uploads = []
+            for embryo_id in cycle["embryo_ids"]:
+                image = rng.choice(images)
+                data = {"prediction_data": json.dumps({
+                    "patient_audit_code": cycle["patient_audit_code"],
+                    "cycle_id": cycle["cycle_id"],
+                    "embryo_id": embryo_id,
+                })}
+                uploads.append(recorder.call("predict", client.post(
+                    "/predict", files={"file": (f"{embryo_id}.png", image, "image/png")},
+                    data=data, headers=headers)))
+            await asyncio.gather(*uploads)
+        elif action == "note":
+            await recorder.call("notes", client.post("/notes", headers=headers, json={
+                "patient_audit_code": cycle["patient_audit_code"],
+                "cycle_id": cycle["cycle_id"],
+                "embryo_id": rng.choice(cycle["embryo_ids"]),
+                "note_text": "Load test note: expansion grade 4, ICM A, TE B",
+            }))
+        elif action == "login":
+            token = await login(client, recorder, "embryologist") or token
+            headers = {"Authorization": f"Bearer {token}"} if token else {}
+        await asyncio.sleep(rng.uniform(0.05, 0.5))
+
+
+async def auditor_session(client, recorder, cycles, deadline, rng, mix):
+    token = await login(client, recorder, "auditor")
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    while time.monotonic() < deadline:
+        cycle = rng.choice(cycles)
+        action = rng.choices(list(mix), weights=list(mix.values()))[0]
+        if action == "audit_logs":
+            params = rng.choice([
+                {},
+                {"patient_audit_code": cycle["patient_audit_code"]},
+                {"cycle_id": cycle["cycle_id"], "action": "AI_PREDICTION"},
+            ])
+            await recorder.call("audit_logs", client.get("/audit-logs", params=params, headers=headers))
+        elif action == "export_csv":
+            await recorder.call("export_csv", client.get(
+                "/export/csv", params={"patient_audit_code": cycle["patient_audit_code"]}, headers=headers))
+        elif action == "export_pdf":
+            await recorder.call("export_pdf", client.get(
+                "/export/pdf", params={"patient_audit_code": cycle["patient_audit_code"]}, headers=headers))
+        await asyncio.sleep(rng.uniform(0.5, 2.0))
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port: int, workers: int, database_url: str, image_store_dir: str) -> subprocess.Popen:
+    env = dict(os.environ, DATABASE_URL=database_url, IMAGE_STORE_DIR=image_store_dir)
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+async def wait_for_health(base_url: str, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get("/health")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.5)
+    raise RuntimeError(f"Server at {base_url} did not become healthy within {timeout}s")
+
+
+async def run(args) -> Dict:
+    rng = random.Random(args.seed)
+    await wait_for_health(args.url)
+    images = [encode_image(make_synthetic_embryo(size, seed=i), "PNG")
+              for i, size in enumerate([256, 512, 768, 1024])]
+
+    timeout = httpx.Timeout(args.request_timeout)
+    limits = httpx.Limits(max_connections=args.max_connections)
+    async with httpx.AsyncClient(base_url=args.url, timeout=timeout, limits=limits) as client:
+        cycles = await seed(client, args.patients, args.cycles_per_patient, args.embryos_per_cycle)
+        recorder = Recorder()
+        embryologist_mix = {"predict_burst": 6, "note": 3, "login": 1}
+        auditor_mix = {"audit_logs": 8, "export_csv": 1, "export_pdf": 1}
+
+        started = time.monotonic()
+        deadline = started + args.duration
+        sessions = [embryologist_session(client, recorder, cycles, images, deadline,
+                                         random.Random(rng.random()), embryologist_mix)
+                    for _ in range(args.embryologists)]
+        sessions += [auditor_session(client, recorder, cycles, deadline,
+                                     random.Random(rng.random()), auditor_mix)
+                     for _ in range(args.auditors)]
+        await asyncio.gather(*sessions)
+        elapsed = time.monotonic() - started
+
+    report = recorder.summary(elapsed)
+    total = sum(stats["requests"] for stats in report.values())
+    return {
+        "config": dict(vars(args)),
+        "elapsed_s": elapsed,
+        "total_requests": total,
+        "throughput_rps": total / elapsed if elapsed > 0 else 0.0,
+        "endpoints": report,
+    }
+
+
+def main_cli(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Replay mixed clinic traffic and check SLOs")
+    parser.add_argument("--url", default=None, help="Target an already-running server instead of starting one")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the local server")
+    parser.add_argument("--database-url", default=None, help="Database for the local server (default: fresh SQLite)")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of traffic to replay")
+    parser.add_argument("--embryologists", type=int, default=4)
+    parser.add_argument("--auditors", type=int, default=1)
+    parser.add_argument("--patients", type=int, default=5)
+    parser.add_argument("--cycles-per-patient", type=int, default=2)
+    parser.add_argument("--embryos-per-cycle", type=int, default=6)
+    parser.add_argument("--max-connections", type=int, default=100)
+    parser.add_argument("--request-timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--slo", default=None, help="JSON file with per-endpoint SLO thresholds")
+    parser.add_argument("--output", default=None, help="Write the full report as JSON")
+    args = parser.parse_args(argv)
+
+    slo = DEFAULT_SLO
+    if args.slo:
+        with open(args.slo) as f:
+            slo = json.load(f)
+
+    server = None
+    if args.url is None:
+        scratch_dir = tempfile.mkdtemp(prefix="embrya-load-")
+        database_url = args.database_url or "sqlite:///" + os.path.join(scratch_dir, "load_test.db")
+        port = free_port()
+        args.url = f"http://127.0.0.1:{port}"
+        server = start_server(port, args.workers, database_url, os.path.join(scratch_dir, "image_store"))
+    try:
+        result = asyncio.run(run(args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=15)
+
+    breaches = check_slos(result["endpoints"], slo)
+    result["slo"] = slo
+    result["slo_breaches"] = breaches
+
+    print(f"\n{'='*96}")
+    print(f"{'endpoint':14s} {'requests':>9s} {'rps':>8s} {'p50 ms':>9s} {'p95 ms':>9s} "
+          f"{'p99 ms':>9s} {'errors':>8s} {'locks':>8s}")
+    print(f"{'-'*96}")
+    for endpoint, stats in result["endpoints"].items():
+        print(f"{endpoint:14s} {stats['requests']:9d} {stats['throughput_rps']:8.2f} "
+              f"{stats['p50_ms']:9.1f} {stats['p95_ms']:9.1f} {stats['p99_ms']:9.1f} "
+              f"{stats['error_rate']:8.2%} {stats['lock_rate']:8.2%}")
+    print(f"{'-'*96}")
+    print(f"Total: {result['total_requests']} requests in {result['elapsed_s']:.1f}s "
+          f"({result['throughput_rps']:.2f} req/s)")
+    if breaches:
+        print("\nSLO BREACHES:")
+        for breach in breaches:
+            print(f"   - {breach}")
+    else:
+        print("\nAll SLOs met")
+    print(f"{'='*96}\n")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    return 1 if breaches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -3,9 +3,10 @@ FastAPI Backend for Embryo Viability Analysis with Audit Trail System
 OPTIMIZED FOR SPEED - Ensemble prediction using 3 trained models
 """
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Query, Form, Request
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, Response
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 import joblib
 import numpy as np
@@ -26,18 +27,51 @@ from datetime import datetime, timezone
 from contextlib import asynccontextmanager
 import os
 import json
+import hashlib
+import asyncio
+import time
 
 # Database and auth imports
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from database import get_db, create_tables
-from models import User, Patient, Cycle, Embryo, AuditLog, Note
+from database import get_db, create_tables, SessionLocal, engine
+from models import User, Patient, Cycle, Embryo, AuditLog, Note, Prediction, StoredImage
 from auth import (
     authenticate_user, create_access_token, get_current_active_user,
     require_admin, require_embryologist, require_auditor, require_read_only,
-    get_password_hash, get_current_user_optional
+    get_password_hash, get_current_user_optional, get_current_active_user_optional
 )
 from schemas import *
 from audit_logger import *
+from prediction_store import (
+    can_create_clinical_records, get_or_create_embryo, store_feature_vector, record_prediction,
+    latest_predictions_for_cycle, prediction_history, model_probabilities
+)
+from model_registry import register_model_set
+from explainability import prepare_explainer, explain_prediction
+from image_store import (
+    IMAGE_VARIANTS, ingest_image, ingest_file, link_image, images_for_embryo, variant_path, parse_range, iter_file_range
+)
+from uploads import MAX_UPLOAD_BYTES, SNIFF_BYTES, read_prediction_upload, sniff_image_format, sniff_video_format
+from resumable_uploads import create_session, get_session, write_chunk, session_status, assemble, close_session
+from overlays import OVERLAY_KINDS, OVERLAY_FORMATS, store_overlay_buffers, overlay_urls, get_overlay
+from ranking import get_cycle_ranking, invalidate_cycle_ranking, invalidate_cycle_ranking_by_codes
+from aggregates import add_override, get_group, group_stats, list_groups
+from migrations import run_migrations
+from audit_archive import (
+    AUDIT_ARCHIVE_INTERVAL_S, AuditFilter, archive_forever, archived_entries, audit_entry, normalize_filters,
+    sql_conditions
+)
+from audit_chain import (
+    AUDIT_CHECKPOINT_INTERVAL_S, chain_key_configured, checkpoint_forever, create_checkpoint, verify_chain
+)
+from audit_rollups import AUDIT_ROLLUP_INTERVAL_S, GROUP_BY_DIMENSIONS, audit_stats, roll_up_forever
+from notes_search import InvalidCursor, list_notes, search_notes
+from inference_scheduler import INFERENCE_BATCHING, inference_scheduler
+from admission import admission, priority_for
+from focal_stack import (
+    FUSION_METHODS, MAX_FOCAL_PLANES, is_plane_field, load_plane_model_sets, score_planes, fuse_planes
+)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -45,6 +79,54 @@ logger = logging.getLogger(__name__)
 # Global model storage
 models = {}
 
+# Distilled single-model fallback for triage views (mode=fast)
+FAST_MODEL_NAME = 'fast'
+FAST_MODEL_PATH = '../Complete_training_pipeline/embryo_model_fast.pkl'
+MODEL_DIR = '../Complete_training_pipeline'
+fast_model = None
+
+# Model version recorded in the audit trail for each ensemble mode
+MODEL_VERSIONS = {
+    "full": "ensemble_v1",
+    "cascade": "ensemble_v1",
+    "fast": "distilled_fast_v1",
+    "focal_stack": "focal_stack_v1",
+}
+
+# Feature order expected by the trained models (20 features)
+FEATURE_NAMES = [
+    'std_dev_mean', 'std_dev_std',
+    'mean_intensity_mean', 'mean_intensity_std',
+    'contrast_mean', 'contrast_std',
+    'entropy_mean', 'entropy_std',
+    'edge_density_mean', 'edge_density_std',
+    'gradient_magnitude_mean', 'gradient_magnitude_std',
+    'circularity_mean', 'circularity_std',
+    'num_regions_mean', 'num_regions_std',
+    'frame_number', 'time_elapsed',
+    'frames_analyzed', 'total_duration'
+]
+
+# Bump whenever extract_features_fast changes so stored vectors are not mixed
+FEATURE_EXTRACTOR_VERSION = "extract_features_fast_v1"
+VIDEO_FEATURE_EXTRACTOR_VERSION = "extract_video_features_v1"
+VIDEO_SAMPLE_FRAMES = int(os.getenv("VIDEO_SAMPLE_FRAMES", "10"))
+
+# Ensemble evaluation: "full" averages every model, "cascade" stops early once
+# the running probability is outside the uncertainty band, "fast" uses only the
+# distilled model
+ENSEMBLE_MODES = ("full", "cascade", "fast")
+DEFAULT_ENSEMBLE_MODE = os.getenv("ENSEMBLE_MODE", "full")
+CASCADE_ORDER = [name.strip() for name in os.getenv("ENSEMBLE_CASCADE_ORDER", "model_1,model_2,model_3").split(",") if name.strip()]
+CASCADE_BAND_LOW = float(os.getenv("ENSEMBLE_CASCADE_BAND_LOW", "0.3"))
+CASCADE_BAND_HIGH = float(os.getenv("ENSEMBLE_CASCADE_BAND_HIGH", "0.7"))
+
+# POST /predict/stream: embryos per request, embryos scored at once, and
+# events buffered per connection before the scorers wait for the client
+STREAM_MAX_EMBRYOS = int(os.getenv("STREAM_MAX_EMBRYOS", "48"))
+STREAM_CONCURRENCY = int(os.getenv("STREAM_CONCURRENCY", "4"))
+STREAM_BUFFER_EVENTS = int(os.getenv("STREAM_BUFFER_EVENTS", "8"))
+
 # Define lifespan before app initialization
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -52,6 +134,10 @@ async def lifespan(app: FastAPI):
     logger.info("Starting up...")
     load_models()
     create_tables()
+    try:
+        run_migrations(engine, SessionLocal)
+    except Exception as e:
+        logger.error(f"Error migrating database: {e}")
     
     # Initialize database with default users
     from init_db import init_db
@@ -61,9 +147,30 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         logger.error(f"Error initializing database: {e}")
     
+    # Keep the audit rollups behind /audit-logs/stats current
+    rollup_task = None
+    if AUDIT_ROLLUP_INTERVAL_S > 0:
+        rollup_task = asyncio.create_task(roll_up_forever(SessionLocal, AUDIT_ROLLUP_INTERVAL_S))
+
+    # Move old audit entries out of the hot table
+    archive_task = None
+    if AUDIT_ARCHIVE_INTERVAL_S > 0:
+        archive_task = asyncio.create_task(archive_forever(SessionLocal, AUDIT_ARCHIVE_INTERVAL_S))
+
+    # Sign the verified head of the audit hash chain periodically
+    checkpoint_task = None
+    if not chain_key_configured():
+        logger.error("AUDIT_CHAIN_KEY is not set: audit chain checkpoints are disabled "
+                     "and verification is unsigned")
+    elif AUDIT_CHECKPOINT_INTERVAL_S > 0:
+        checkpoint_task = asyncio.create_task(checkpoint_forever(SessionLocal, AUDIT_CHECKPOINT_INTERVAL_S))
+
     logger.info("Ready to serve predictions")
     yield
     logger.info("Shutting down...")
+    for task in (rollup_task, archive_task, checkpoint_task):
+        if task is not None:
+            task.cancel()
 
 app = FastAPI(title="Embryo Viability API with Audit Trail", lifespan=lifespan)
 
@@ -91,11 +198,17 @@ class PredictionResponse(BaseModel):
     features: Dict[str, float]
     confusion_matrix: Optional[Dict[str, Any]] = None
     feature_importance: Optional[Dict[str, float]] = None
+    ensemble_mode: Optional[str] = None
+    model_version: Optional[str] = None
+    models_consulted: Optional[List[str]] = None
+    explanation: Optional[Dict[str, Any]] = None
+    overlay_urls: Optional[Dict[str, str]] = None
+    image_sha256: Optional[str] = None
 
 
 def load_models():
-    """Load all 3 trained models"""
-    global models
+    """Load all 3 trained models (and the distilled fast model if present)"""
+    global models, fast_model
     try:
         model_paths = [
             '../Complete_training_pipeline/embryo_model_1.pkl',
@@ -116,6 +229,33 @@ def load_models():
         else:
             logger.warning("No models loaded successfully")
 
+        if os.path.exists(FAST_MODEL_PATH):
+            try:
+                fast_model = joblib.load(FAST_MODEL_PATH)
+                logger.info(f"Loaded fast model from {FAST_MODEL_PATH}")
+            except Exception as e:
+                logger.error(f"Failed to load fast model: {str(e)}")
+        else:
+            logger.info(f"No fast model at {FAST_MODEL_PATH}; mode=fast disabled")
+
+        # Expose both sets to offline jobs (e.g. rescoring) under their audit names
+        register_model_set(MODEL_VERSIONS["full"], models)
+        if fast_model is not None:
+            register_model_set(MODEL_VERSIONS["fast"], {FAST_MODEL_NAME: fast_model})
+
+        # Plane-specific model sets (embryo_model_<PLANE>.pkl) for /predict/focal-stack
+        load_plane_model_sets(MODEL_DIR, models)
+
+        # Precompute per-node contribution tables for explain=true
+        explainable_sets = {MODEL_VERSIONS["full"]: models}
+        if fast_model is not None:
+            explainable_sets[MODEL_VERSIONS["fast"]] = {FAST_MODEL_NAME: fast_model}
+        for version, model_set in explainable_sets.items():
+            try:
+                prepare_explainer(version, model_set, len(FEATURE_NAMES))
+            except Exception as e:
+                logger.error(f"Failed to prepare explainer for {version}: {str(e)}")
+
     except Exception as e:
         logger.error(f"Error in load_models: {str(e)}")
 
@@ -126,6 +266,17 @@ def extract_features_fast(image_array: np.ndarray) -> Dict[str, float]:
     The model expects: 8 morphological features (mean + std) + 4 temporal features
     Since we have a single image, std values will be 0
     """
+    features, _ = extract_features_with_buffers(image_array)
+    return features
+
+
+def extract_features_with_buffers(image_array: np.ndarray):
+    """
+    Same as extract_features_fast, but also returns the intermediate arrays
+    (Canny edges, Sobel gradient magnitude, Otsu mask, largest contour) so
+    overlays can be rendered without recomputing them. Buffers are None when
+    extraction falls back to default features.
+    """
     try:
         # Convert to grayscale for analysis
         if len(image_array.shape) == 3:
@@ -156,11 +307,13 @@ def extract_features_fast(image_array: np.ndarray) -> Dict[str, float]:
         # Gradient magnitude
         grad_x = cv2.Sobel(gray, cv2.CV_64F, 1, 0, ksize=3)
         grad_y = cv2.Sobel(gray, cv2.CV_64F, 0, 1, ksize=3)
-        gradient_magnitude = float(np.mean(np.sqrt(grad_x**2 + grad_y**2)))
+        gradient_map = np.sqrt(grad_x**2 + grad_y**2)
+        gradient_magnitude = float(np.mean(gradient_map))
 
         # Circularity
         _, binary = cv2.threshold(gray.astype(np.uint8), 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
         contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        largest_contour = None
         if contours:
             largest_contour = max(contours, key=cv2.contourArea)
             area = cv2.contourArea(largest_contour)
@@ -204,7 +357,13 @@ def extract_features_fast(image_array: np.ndarray) -> Dict[str, float]:
             'total_duration': 0.0
         }
 
-        return features
+        buffers = {
+            'edges': edges,
+            'gradient_magnitude': gradient_map,
+            'binary_mask': binary,
+            'largest_contour': largest_contour
+        }
+        return features, buffers
     except Exception as e:
         logger.error(f"Error extracting features: {str(e)}")
         import traceback
@@ -231,13 +390,13 @@ def extract_features_fast(image_array: np.ndarray) -> Dict[str, float]:
             'time_elapsed': 0.0,
             'frames_analyzed': 1.0,
             'total_duration': 0.0
-        }
+        }, None
 
 
-def preprocess_image_fast(image_bytes: bytes) -> np.ndarray:
-    """FAST image preprocessing"""
+def preprocess_image_fast(image_bytes) -> np.ndarray:
+    """FAST image preprocessing (bytes, or a path for files assembled on disk)"""
     try:
-        image = Image.open(io.BytesIO(image_bytes))
+        image = Image.open(io.BytesIO(image_bytes) if isinstance(image_bytes, (bytes, bytearray)) else image_bytes)
 
         if image.mode != 'RGB':
             image = image.convert('RGB')
@@ -252,41 +411,131 @@ def preprocess_image_fast(image_bytes: bytes) -> np.ndarray:
         raise HTTPException(status_code=400, detail=f"Image processing failed: {str(e)}")
 
 
-def ensemble_predict(features: Dict[str, float]) -> Dict:
+def extract_video_features(video_path: str, sample_frames: int = VIDEO_SAMPLE_FRAMES):
+    """
+    Features for a time-lapse video, following the training notebook's process_video:
+    frames sampled evenly, the 8 morphological features averaged (mean/std) across
+    them, and frame-to-frame motion in the 4 temporal slots. Frames go through the
+    same 128x128 working-image path as single images.
+    Returns (features, middle working frame, middle full-size RGB frame).
+    """
+    capture = cv2.VideoCapture(video_path)
+    try:
+        total_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        if total_frames <= 0:
+            raise HTTPException(status_code=400, detail="Video has no readable frames")
+        frame_indices = np.linspace(0, total_frames - 1, min(sample_frames, total_frames), dtype=int)
+
+        per_frame, gray_frames, working_frames, full_frames = [], [], [], []
+        for index in frame_indices:
+            capture.set(cv2.CAP_PROP_POS_FRAMES, int(index))
+            ok, frame = capture.read()
+            if not ok or frame is None:
+                continue
+            rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            working = cv2.resize(rgb, (128, 128), interpolation=cv2.INTER_LINEAR)
+            frame_features = extract_features_fast(working)
+            per_frame.append({name[:-len('_mean')]: value for name, value in frame_features.items() if name.endswith('_mean')})
+            gray_frames.append(np.mean(working, axis=2))
+            working_frames.append(working)
+            full_frames.append(rgb)
+    finally:
+        capture.release()
+
+    if not per_frame:
+        raise HTTPException(status_code=400, detail="Video has no readable frames")
+
+    features = {}
+    for base in per_frame[0]:
+        values = [frame[base] for frame in per_frame]
+        features[f'{base}_mean'] = float(np.mean(values))
+        features[f'{base}_std'] = float(np.std(values))
+
+    # The backend's temporal names hold the notebook's mean/std/max motion and development speed
+    diffs = [float(np.mean(np.abs(gray_frames[i] - gray_frames[i - 1]))) for i in range(1, len(gray_frames))]
+    features['frame_number'] = float(np.mean(diffs)) if diffs else 0.0
+    features['time_elapsed'] = float(np.std(diffs)) if diffs else 0.0
+    features['frames_analyzed'] = float(np.max(diffs)) if diffs else 0.0
+    features['total_duration'] = float(np.sum(diffs) / len(diffs)) if diffs else 0.0
+
+    middle = len(working_frames) // 2
+    return features, working_frames[middle], full_frames[middle]
+
+
+def get_cascade_order() -> List[str]:
+    """Model evaluation order for cascade mode; unknown names are ignored"""
+    ordered = [name for name in CASCADE_ORDER if name in models]
+    # Any loaded model missing from the configured order is consulted last
+    ordered += [name for name in models if name not in ordered]
+    return ordered
+
+
+def predict_model_probability(model, X: np.ndarray):
+    """Return (predicted class, probability of good) for one row; supports the distilled regressor"""
+    if hasattr(model, 'predict_proba'):
+        pred = model.predict(X)[0]
+        proba = model.predict_proba(X)[0]
+        prob_good = float(proba[1]) if len(proba) > 1 else float(proba[0])
+        return int(pred), prob_good
+    # Distilled model regresses the ensemble's soft output directly
+    prob_good = float(np.clip(model.predict(X)[0], 0.0, 1.0))
+    return int(prob_good > 0.5), prob_good
+
+
+def confidence_level_for(confidence: float) -> str:
+    if confidence >= 0.8:
+        return "high"
+    if confidence >= 0.6:
+        return "medium"
+    return "low"
+
+
+def ensemble_predict(features: Dict[str, float], mode: str = "full",
+                     model_probabilities: Optional[Dict[str, float]] = None) -> Dict:
     """
     Fast ensemble prediction using all 3 models with 20 features
     Returns predictions with feature importance and model performance metrics
+
+    mode="cascade" evaluates models in CASCADE_ORDER and stops as soon as the
+    running averaged probability leaves the [CASCADE_BAND_LOW, CASCADE_BAND_HIGH]
+    uncertainty band, so clearly good/poor embryos skip the remaining forests.
+    mode="fast" uses only the distilled model trained on the ensemble's soft outputs.
+    model_probabilities (per-model probability of "good", e.g. from the
+    micro-batching scheduler) replaces the per-model evaluation when given.
     """
-    if not models:
+    if mode == "fast":
+        if fast_model is None:
+            raise HTTPException(status_code=503, detail="Fast model not loaded")
+        model_set = {FAST_MODEL_NAME: fast_model}
+    elif not models:
         logger.error("No models loaded")
         raise HTTPException(status_code=500, detail="Models not loaded")
+    else:
+        model_set = models
 
     # Prepare feature vector in correct order (20 features)
-    feature_names = [
-        'std_dev_mean', 'std_dev_std',
-        'mean_intensity_mean', 'mean_intensity_std',
-        'contrast_mean', 'contrast_std',
-        'entropy_mean', 'entropy_std',
-        'edge_density_mean', 'edge_density_std',
-        'gradient_magnitude_mean', 'gradient_magnitude_std',
-        'circularity_mean', 'circularity_std',
-        'num_regions_mean', 'num_regions_std',
-        'frame_number', 'time_elapsed',
-        'frames_analyzed', 'total_duration'
-    ]
+    feature_names = FEATURE_NAMES
     X = np.array([[features.get(name, 0.0) for name in feature_names]])
 
     predictions = []
     probabilities = []
     all_feature_importances = []
+    models_consulted = []
 
-    # Get predictions from all models
-    for name, model in models.items():
-        try:
-            pred = model.predict(X)[0]
-            proba = model.predict_proba(X)[0]
+    if mode == "cascade":
+        model_order = get_cascade_order()
+    else:
+        model_order = list(model_set)
 
-            prob_good = float(proba[1]) if len(proba) > 1 else float(proba[0])
+    # Get predictions from all models (or until the cascade is confident)
+    for name in model_order:
+        model = model_set[name]
+        try:
+            if model_probabilities is not None and name in model_probabilities:
+                prob_good = model_probabilities[name]
+                pred = int(prob_good > 0.5)
+            else:
+                pred, prob_good = predict_model_probability(model, X)
 
             predictions.append({
                 'model': name,
@@ -297,6 +546,7 @@ def ensemble_predict(features: Dict[str, float]) -> Dict:
             })
 
             probabilities.append(prob_good)
+            models_consulted.append(name)
             
             # Extract feature importance if model has it (RandomForest)
             if hasattr(model, 'feature_importances_'):
@@ -307,6 +557,11 @@ def ensemble_predict(features: Dict[str, float]) -> Dict:
             logger.error(f"Error predicting with {name}: {str(e)}")
             continue
 
+        if mode == "cascade":
+            running_probability = float(np.mean(probabilities))
+            if running_probability < CASCADE_BAND_LOW or running_probability > CASCADE_BAND_HIGH:
+                break
+
     if not predictions:
         # Fallback if all predictions fail
         logger.warning("All model predictions failed, using fallback")
@@ -319,7 +574,10 @@ def ensemble_predict(features: Dict[str, float]) -> Dict:
             'viability_score': 65.0,
             'model_predictions': [
                 {'model': 'fallback', 'prediction': 1, 'probability_good': 0.65, 'probability_not_good': 0.35}
-            ]
+            ],
+            'ensemble_mode': mode,
+            'model_version': MODEL_VERSIONS[mode],
+            'models_consulted': []
         }
 
     # Ensemble: average probabilities
@@ -332,12 +590,7 @@ def ensemble_predict(features: Dict[str, float]) -> Dict:
     # Confidence
     confidence = float(max(avg_probability_good, avg_probability_not_good))
 
-    if confidence >= 0.8:
-        confidence_level = "high"
-    elif confidence >= 0.6:
-        confidence_level = "medium"
-    else:
-        confidence_level = "low"
+    confidence_level = confidence_level_for(confidence)
 
     # Viability score (0-100)
     viability_score = avg_probability_good * 100
@@ -363,7 +616,8 @@ def ensemble_predict(features: Dict[str, float]) -> Dict:
     }
     
     # Try to load from results files (generated during model training)
-    results_path = os.path.join('..', 'Complete_training_pipeline', 'results_model_1.json')
+    results_file = 'results_model_fast.json' if mode == "fast" else 'results_model_1.json'
+    results_path = os.path.join('..', 'Complete_training_pipeline', results_file)
     print(f"\n{'='*80}")
     print(f"[CONFUSION MATRIX] Attempting to load from: {results_path}")
     print(f"[CONFUSION MATRIX] File exists: {os.path.exists(results_path)}")
@@ -432,7 +686,10 @@ def ensemble_predict(features: Dict[str, float]) -> Dict:
         'viability_score': viability_score,
         'model_predictions': predictions,
         'feature_importance': averaged_feature_importance,
-        'confusion_matrix': confusion_matrix_data
+        'confusion_matrix': confusion_matrix_data,
+        'ensemble_mode': mode,
+        'model_version': MODEL_VERSIONS[mode],
+        'models_consulted': models_consulted
     }
 
 # ==================== API ENDPOINTS ====================
@@ -459,6 +716,7 @@ async def health_check():
     return {
         "status": "healthy" if models_loaded else "degraded",
         "models_loaded": len(models),
+        "fast_model_loaded": fast_model is not None,
         "timestamp": datetime.now(timezone.utc).isoformat()
     }
 
@@ -583,95 +841,795 @@ class PredictionRequest(BaseModel):
     cycle_id: str
     embryo_id: str
 
-@app.post("/predict", response_model=PredictionResponse)
+def ai_prediction_log(metadata: PredictionRequestData, result: Dict[str, Any],
+                      risk_indicators: Optional[Dict[str, Any]] = None) -> AIPredictionLog:
+    return AIPredictionLog(
+        patient_audit_code=metadata.patient_audit_code,
+        cycle_id=metadata.cycle_id,
+        embryo_id=metadata.embryo_id,
+        model_version=result['model_version'],
+        confidence_score=result['confidence'],
+        risk_indicators={"viability_score": result['viability_score'], **(risk_indicators or {})},
+        abnormal_flags=[] if result['prediction'] == 'good' else ['low_viability'],
+        ensemble_mode=result['ensemble_mode'],
+        models_consulted=result['models_consulted']
+    )
+
+
+def store_prediction(db: Session, current_user: Optional[User], metadata: PredictionRequestData,
+                     result: Dict[str, Any], ai_log: AIPredictionLog, store_features=None) -> Optional[Embryo]:
+    """
+    Store a prediction made for an active clinical user: the embryo (created if
+    needed), the feature vector via store_features(embryo), the Prediction row
+    and its AI_PREDICTION audit entry, all in one transaction. Other callers
+    only get the result back, so they cannot change an embryo's ranking.
+    Returns the embryo, or None when nothing was stored.
+    """
+    if not can_create_clinical_records(current_user):
+        logger.info(f"Not storing prediction for embryo {metadata.embryo_id}: caller may not create clinical records")
+        return None
+    if not result['models_consulted']:
+        # ensemble_predict's fallback when every model failed is not a real prediction
+        logger.warning(f"Not storing prediction for embryo {metadata.embryo_id}: no model produced a score")
+        return None
+    for attempt in range(2):
+        try:
+            embryo = get_or_create_embryo(db, current_user, metadata.patient_audit_code, metadata.cycle_id,
+                                          metadata.embryo_id)
+            feature_vector = store_features(embryo) if store_features is not None else None
+            record_prediction(db, embryo, result, feature_vector)
+            add_ai_prediction(db, current_user, ai_log)
+            db.commit()
+            break
+        except IntegrityError:
+            db.rollback()
+            # A concurrent prediction created the same patient, cycle or embryo; the retry finds it
+            if attempt:
+                logger.exception("Failed to store prediction; continuing without it.")
+                return None
+        except Exception:
+            db.rollback()
+            logger.exception("Failed to store prediction; continuing without it.")
+            return None
+    invalidate_cycle_ranking(embryo.cycle_id)
+    return embryo
+
+
+def complete_prediction(db: Session, current_user: Optional[User], metadata: PredictionRequestData,
+                        features: Dict[str, float], image_sha256: str, mode: str, explain: bool,
+                        store_upload=None, extractor_version: str = FEATURE_EXTRACTOR_VERSION,
+                        model_probabilities: Optional[Dict[str, float]] = None):
+    """
+    Shared tail of every prediction path: run the ensemble, optionally explain,
+    store the prediction with its feature vector and audit entry (see
+    store_prediction) and the upload via store_upload(embryo). Returns
+    (result, explanation). model_probabilities are already-computed per-model
+    scores (see batched_model_probabilities). Blocking: async handlers call it
+    through run_in_threadpool, so only the scheduler await stays on the loop.
+    """
+    # Ensemble prediction
+    result = ensemble_predict(features, mode=mode, model_probabilities=model_probabilities)
+    logger.info(f"Prediction complete: viability_score={result['viability_score']:.1f}")
+
+    vector = np.array([features.get(name, 0.0) for name in FEATURE_NAMES], dtype=np.float32)
+
+    # Per-feature contributions from the models that produced this prediction
+    explanation = None
+    if explain and result['models_consulted']:
+        explanation = explain_prediction(result['model_version'], vector, FEATURE_NAMES, result['models_consulted'])
+
+    # The feature vector is kept so new model versions can rescore without the image
+    def store_features(embryo):
+        return store_feature_vector(db, embryo, image_sha256, extractor_version, vector)
+
+    embryo = store_prediction(db, current_user, metadata, result, ai_prediction_log(metadata, result), store_features)
+    if embryo is not None and store_upload is not None:
+        try:
+            stored_image = store_upload(embryo)
+            link_image(db, stored_image, embryo)
+            db.commit()
+        except Exception:
+            db.rollback()
+            logger.exception("Failed to store uploaded image; continuing without it.")
+
+    return result, explanation
+
+
+async def batched_model_probabilities(features: Dict[str, float], mode: str) -> Optional[Dict[str, float]]:
+    """
+    Per-model probabilities from the micro-batching scheduler, or None when the
+    caller should evaluate the models itself (cascade mode stops early per
+    image, batching is disabled, or the batch failed)
+    """
+    if not INFERENCE_BATCHING or mode == "cascade" or (mode == "fast" and fast_model is None) or not models:
+        return None
+    x = np.array([features.get(name, 0.0) for name in FEATURE_NAMES])
+    try:
+        return await inference_scheduler.submit(MODEL_VERSIONS[mode], x)
+    except Exception:
+        logger.exception("Batched inference failed; scoring this request directly.")
+        return None
+
+
+def prediction_response(result: Dict, features: Dict[str, float], explanation: Optional[Dict] = None,
+                        **extra) -> PredictionResponse:
+    return PredictionResponse(
+        prediction=result['prediction'],
+        viability_score=result['viability_score'],
+        confidence=result['confidence'],
+        confidence_level=result['confidence_level'],
+        model_predictions=result['model_predictions'],
+        features=features,
+        confusion_matrix=result.get('confusion_matrix'),
+        feature_importance=result.get('feature_importance'),
+        ensemble_mode=result['ensemble_mode'],
+        model_version=result['model_version'],
+        models_consulted=result['models_consulted'],
+        explanation=explanation,
+        **extra
+    )
+
+
+# /predict parses its multipart body itself (see uploads.py); document the form for OpenAPI
+PREDICT_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["prediction_data", "file"],
+                    "properties": {
+                        "prediction_data": {
+                            "type": "string",
+                            "description": "JSON with patient_audit_code, cycle_id and embryo_id; send before file so it is validated first"
+                        },
+                        "file": {"type": "string", "format": "binary"}
+                    }
+                }
+            }
+        }
+    }
+}
+
+async def prediction_admission(current_user: Optional[User] = Depends(get_current_active_user_optional)) -> int:
+    """
+    Admission priority for the caller. Turns the request away with 429 before
+    its body is read when it could not even queue; the slot itself is only held
+    around preprocessing and inference (admission.slot), not the upload.
+    """
+    priority = priority_for(current_user)
+    admission.check(priority)
+    return priority
+
+
+@app.post("/predict", response_model=PredictionResponse, openapi_extra=PREDICT_REQUEST_BODY)
 async def predict(
     request: Request,
-    file: UploadFile = File(...),
-    prediction_data: str = Form(...),
+    priority: int = Depends(prediction_admission),
+    mode: str = Query(DEFAULT_ENSEMBLE_MODE, description="Ensemble evaluation mode: full, cascade or fast"),
+    explain: bool = Query(False, description="Include per-feature contributions for this prediction"),
+    overlays: bool = Query(False, description="Keep edge/gradient/contour overlays and return their URLs"),
+    current_user: Optional[User] = Depends(get_current_active_user_optional),
     db: Session = Depends(get_db)
 ):
     """
     Predict embryo viability from uploaded image
     Uses ensemble of 3 models - OPTIMIZED FOR SPEED
-    Requires authentication and logs AI prediction
+    Logs AI prediction (attributed to the caller when a bearer token is sent)
+    Admission-controlled: 429 with Retry-After when the service is saturated;
+    signed-in clinical users are admitted ahead of anonymous callers.
+
+    Expects multipart fields prediction_data and file (image up to MAX_UPLOAD_MB).
     """
     # Public endpoint: do not require authentication for /predict
-    user_info = "public"
+    user_info = current_user.username if current_user else "public"
     logger.info(f"Predict endpoint called by user: {user_info}")
+    if mode not in ENSEMBLE_MODES:
+        raise HTTPException(status_code=400, detail=f"Invalid mode '{mode}'. Expected one of: {', '.join(ENSEMBLE_MODES)}")
+
+    # Stream the body: oversized, non-image or badly described uploads are
+    # rejected (413/415/422) before they are fully read
+    upload = await read_prediction_upload(request, MAX_UPLOAD_BYTES)
     try:
-        # Parse prediction data
-        import json
-        pred_data = json.loads(prediction_data)
-        patient_code = pred_data["patient_audit_code"]
-        cycle_id = pred_data["cycle_id"]
-        embryo_id = pred_data["embryo_id"]
-
-        print(f"\n\n{'='*80}")
-        print(f"[BACKEND] REQUEST RECEIVED FOR FILE: {file.filename}")
-        print(f"[BACKEND] Patient: {patient_code}, Cycle: {cycle_id}, Embryo: {embryo_id}")
-        print(f"[BACKEND] User: {user_info}")
-        print(f"{'='*80}\n")
-        logger.info(f"Processing file: {file.filename} for patient {patient_code}")
-
-        # Read image
-        contents = await file.read()
-        print(f"[BACKEND] File read successfully: {len(contents)} bytes")
-        logger.info(f"File read: {len(contents)} bytes")
-
-        # Preprocess (FAST)
-        image = preprocess_image_fast(contents)
-        print(f"[BACKEND] Image preprocessed: {image.shape}")
-        logger.info(f"Image preprocessed: {image.shape}")
-
-        # Extract features (FAST)
+        patient_code = upload.metadata.patient_audit_code
+        cycle_id = upload.metadata.cycle_id
+        embryo_id = upload.metadata.embryo_id
+
+        logger.info(f"Processing file: {upload.filename} for patient {patient_code}")
+        logger.debug(f"Cycle: {cycle_id}, Embryo: {embryo_id}, User: {user_info}")
+
+        # Image bytes and hash were produced while streaming
+        contents = upload.contents
+        image_sha256 = upload.sha256
+        logger.info(f"File read: {len(contents)} bytes ({upload.image_format})")
+
+        async with admission.slot(priority):
+            # Preprocess (FAST); image work runs on the thread pool so concurrent
+            # requests reach the inference scheduler together
+            image = await run_in_threadpool(preprocess_image_fast, contents)
+            logger.info(f"Image preprocessed: {image.shape}")
+
+            # Extract features (FAST); the intermediate arrays back the optional overlays
+            features, buffers = await run_in_threadpool(extract_features_with_buffers, image)
+            logger.info(f"Features extracted: {len(features)} features")
+
+            overlay_links = None
+            if overlays and store_overlay_buffers(image_sha256, buffers):
+                overlay_links = overlay_urls(image_sha256)
+
+            # Keep the upload (deduplicated by hash) so it can be re-reviewed without re-uploading
+            def store_upload(embryo):
+                return ingest_image(db, contents, image_sha256, upload.content_type, image)
+
+            model_probabilities = await batched_model_probabilities(features, mode)
+            result, explanation = await run_in_threadpool(
+                complete_prediction, db, current_user, upload.metadata, features, image_sha256, mode, explain, store_upload,
+                model_probabilities=model_probabilities)
+        response = prediction_response(result, features, explanation,
+                                       overlay_urls=overlay_links, image_sha256=image_sha256)
+        return response
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception(f"Prediction error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
+
+
+FOCAL_STACK_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["prediction_data"],
+                    "properties": {
+                        "prediction_data": {
+                            "type": "string",
+                            "description": "JSON with patient_audit_code, cycle_id and embryo_id"
+                        }
+                    },
+                    "patternProperties": {"^F[0-9]{1,3}$": {"type": "string", "format": "binary"}},
+                    "description": "One image per focal plane, in a field named after the plane (F15, F30, F45, ...)"
+                }
+            }
+        }
+    }
+}
+
+@app.post("/predict/focal-stack", response_model=FocalStackResponse, openapi_extra=FOCAL_STACK_REQUEST_BODY)
+async def predict_focal_stack(
+    request: Request,
+    priority: int = Depends(prediction_admission),
+    fusion: str = Query("mean", description="How per-plane probabilities are fused: mean or confidence_weighted"),
+    current_user: Optional[User] = Depends(get_current_active_user_optional),
+    db: Session = Depends(get_db)
+):
+    """
+    Predict embryo viability from a focal stack.
+    Each plane is scored in parallel by its plane-specific model set; planes
+    without one are skipped and reported. Logs the fused AI prediction.
+    """
+    if fusion not in FUSION_METHODS:
+        raise HTTPException(status_code=400, detail=f"Invalid fusion '{fusion}'. Expected one of: {', '.join(FUSION_METHODS)}")
+
+    started = time.perf_counter()
+    upload = await read_prediction_upload(request, MAX_UPLOAD_BYTES, accept_file=is_plane_field,
+                                          max_files=MAX_FOCAL_PLANES)
+    metadata = upload.metadata
+    logger.info(f"Focal stack for embryo {metadata.embryo_id}: planes {', '.join(upload.files)}")
+
+    working_images = {}
+
+    def featurize(plane: str, image_bytes: bytes) -> np.ndarray:
+        image = preprocess_image_fast(image_bytes)
+        working_images[plane] = image
         features = extract_features_fast(image)
-        print(f"[BACKEND] Features extracted: {len(features)} features")
-        logger.info(f"Features extracted: {len(features)} features")
-
-        # Ensemble prediction
-        result = ensemble_predict(features)
-        print(f"[BACKEND] Prediction complete: viability_score={result['viability_score']:.1f}")
-        logger.info(f"Prediction complete: viability_score={result['viability_score']:.1f}")
-
-        # Log AI prediction
-        ai_log = AIPredictionLog(
-            patient_audit_code=patient_code,
-            cycle_id=cycle_id,
-            embryo_id=embryo_id,
-            model_version="ensemble_v1",  # Could be made configurable
-            confidence_score=result['confidence'],
-            risk_indicators={"viability_score": result['viability_score']},
-            abnormal_flags=[] if result['prediction'] == 'good' else ['low_viability']
-        )
-        # Log AI prediction without requiring authentication
+        return np.array([[features.get(name, 0.0) for name in FEATURE_NAMES]])
+
+    async with admission.slot(priority):
+        try:
+            plane_results = await asyncio.get_running_loop().run_in_executor(
+                None, score_planes, {plane: f.contents for plane, f in upload.files.items()}, featurize)
+        except Exception as e:
+            logger.error(f"Focal stack prediction error: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
+    for plane_result in plane_results:
+        plane_result["image_sha256"] = upload.files[plane_result["plane"]].sha256
+
+    probability_good = fuse_planes(plane_results, fusion)
+    if probability_good is None:
+        raise HTTPException(status_code=422, detail={
+            "message": "None of the uploaded focal planes could be scored",
+            "planes": [{key: r[key] for key in ("plane", "status", "reason")} for r in plane_results]
+        })
+
+    scored = [r for r in plane_results if r["status"] == "scored"]
+    confidence = max(probability_good, 1.0 - probability_good)
+    result = {
+        'prediction': "good" if probability_good > 0.5 else "not_good",
+        'viability_score': probability_good * 100,
+        'confidence': confidence,
+        'confidence_level': confidence_level_for(confidence),
+        'model_version': MODEL_VERSIONS["focal_stack"],
+        'ensemble_mode': "focal_stack",
+        # Plane models are not the production model_1..3, so no per-model columns
+        'model_predictions': [],
+        'models_consulted': [f"{r['plane']}:{model}" for r in scored for model in r["model_probabilities"]],
+    }
+
+    ai_log = ai_prediction_log(metadata, result, {
+        "plane_probabilities": {r["plane"]: r["probability_good"] for r in scored}})
+
+    # Database writes and image ingest (files, working PNG, thumbnail) block, so they run on the thread pool
+    def store():
+        embryo = store_prediction(db, current_user, metadata, result, ai_log)
+        if embryo is None:
+            return
         try:
-            log_ai_prediction(db, None, ai_log)
+            for r in scored:
+                upload_file = upload.files[r["plane"]]
+                stored_image = ingest_image(db, upload_file.contents, upload_file.sha256,
+                                            upload_file.content_type, working_images[r["plane"]])
+                link_image(db, stored_image, embryo)
+            db.commit()
         except Exception:
-            logger.exception("Failed to log AI prediction; continuing without audit log.")
-
-        response = PredictionResponse(
-            prediction=result['prediction'],
-            viability_score=result['viability_score'],
-            confidence=result['confidence'],
-            confidence_level=result['confidence_level'],
-            model_predictions=result['model_predictions'],
-            features=features,
-            confusion_matrix=result.get('confusion_matrix'),
-            feature_importance=result.get('feature_importance')
+            db.rollback()
+            logger.exception("Failed to store focal stack images; continuing without them.")
+
+    await run_in_threadpool(store)
+
+    return FocalStackResponse(
+        prediction=result['prediction'],
+        viability_score=result['viability_score'],
+        confidence=result['confidence'],
+        confidence_level=result['confidence_level'],
+        fusion=fusion,
+        fused_planes=[r["plane"] for r in scored],
+        planes=plane_results,
+        model_version=result['model_version'],
+        latency_ms=(time.perf_counter() - started) * 1000
+    )
+
+
+STREAM_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["prediction_data"],
+                    "properties": {
+                        "prediction_data": {
+                            "type": "string",
+                            "description": "JSON with patient_audit_code and cycle_id"
+                        }
+                    },
+                    "additionalProperties": {"type": "string", "format": "binary"},
+                    "description": "One image per embryo, in a field named after the embryo id"
+                }
+            }
+        }
+    }
+}
+
+def sse_event(event: str, data: Dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+async def predict_stream_embryo(current_user: Optional[User], metadata: PredictionRequestData,
+                                upload_file, mode: str, explain: bool) -> PredictionResponse:
+    """
+    One embryo of a streamed cycle, through the same pipeline as /predict.
+    Embryos are scored concurrently, so each stores its result through its
+    own session.
+    """
+    contents, image_sha256 = upload_file.contents, upload_file.sha256
+    image = await run_in_threadpool(preprocess_image_fast, contents)
+    features = await run_in_threadpool(extract_features_fast, image)
+    model_probabilities = await batched_model_probabilities(features, mode)
+
+    def complete():
+        db = SessionLocal()
+        try:
+            def store_upload(embryo):
+                return ingest_image(db, contents, image_sha256, upload_file.content_type, image)
+
+            return complete_prediction(db, current_user, metadata, features, image_sha256, mode, explain,
+                                       store_upload, model_probabilities=model_probabilities)
+        finally:
+            db.close()
+
+    result, explanation = await run_in_threadpool(complete)
+    return prediction_response(result, features, explanation, image_sha256=image_sha256)
+
+@app.post("/predict/stream", openapi_extra=STREAM_REQUEST_BODY,
+          responses={200: {"content": {"text/event-stream": {}}}})
+async def predict_stream(
+    request: Request,
+    mode: str = Query(DEFAULT_ENSEMBLE_MODE, description="Ensemble evaluation mode: full, cascade or fast"),
+    explain: bool = Query(False, description="Include per-feature contributions for each prediction"),
+    priority: int = Depends(prediction_admission),
+    current_user: Optional[User] = Depends(get_current_active_user_optional)
+):
+    """
+    Predict every embryo of a cycle and stream the results as server-sent events:
+    "start" (embryo ids), then per embryo "prediction" (a PredictionResponse) or
+    "error", each followed by "progress", and a final "summary" for the cycle.
+    Embryos are scored concurrently (up to STREAM_CONCURRENCY) and reported in
+    completion order; at most STREAM_BUFFER_EVENTS events are buffered for a
+    slow client before scoring pauses. Each embryo takes its own admission
+    slot while it is scored, so a stream counts as many inferences as it runs.
+    """
+    if mode not in ENSEMBLE_MODES:
+        raise HTTPException(status_code=400, detail=f"Invalid mode '{mode}'. Expected one of: {', '.join(ENSEMBLE_MODES)}")
+
+    started = time.perf_counter()
+    upload = await read_prediction_upload(
+        request, MAX_UPLOAD_BYTES, accept_file=lambda name: 0 < len(name) <= 128,
+        max_files=STREAM_MAX_EMBRYOS, metadata_schema=CyclePredictionRequestData)
+    cycle = upload.metadata
+    embryo_ids = list(upload.files)
+    logger.info(f"Streaming predictions for cycle {cycle.cycle_id}: {len(embryo_ids)} embryos")
+
+    async def events():
+        queue: asyncio.Queue = asyncio.Queue(maxsize=STREAM_BUFFER_EVENTS)
+        limiter = asyncio.Semaphore(STREAM_CONCURRENCY)
+
+        async def score(embryo_id: str):
+            metadata = PredictionRequestData(
+                patient_audit_code=cycle.patient_audit_code, cycle_id=cycle.cycle_id, embryo_id=embryo_id)
+            async with limiter:
+                try:
+                    async with admission.slot(priority):
+                        response = await predict_stream_embryo(
+                            current_user, metadata, upload.files[embryo_id], mode, explain)
+                    outcome = ("prediction", {"embryo_id": embryo_id, **response.model_dump()})
+                except HTTPException as e:
+                    outcome = ("error", {"embryo_id": embryo_id, "status_code": e.status_code, "detail": e.detail})
+                except Exception as e:
+                    logger.exception(f"Streamed prediction for embryo {embryo_id} failed")
+                    outcome = ("error", {"embryo_id": embryo_id, "status_code": 500, "detail": f"Prediction failed: {str(e)}"})
+                finally:
+                    # Drop the image as soon as it is scored
+                    upload.files[embryo_id].contents = None
+            await queue.put(outcome)
+
+        tasks = [asyncio.create_task(score(embryo_id)) for embryo_id in embryo_ids]
+        results, errors = [], []
+        first_result_ms = None
+        try:
+            yield sse_event("start", {"cycle_id": cycle.cycle_id, "total": len(embryo_ids), "embryo_ids": embryo_ids})
+            for completed in range(1, len(embryo_ids) + 1):
+                event, data = await queue.get()
+                if first_result_ms is None:
+                    first_result_ms = (time.perf_counter() - started) * 1000
+                (results if event == "prediction" else errors).append(data)
+                yield sse_event(event, data)
+                yield sse_event("progress", {"completed": completed, "total": len(embryo_ids),
+                                             "embryo_id": data["embryo_id"]})
+            ranked = sorted(results, key=lambda r: (r["prediction"] == "good", r["viability_score"]), reverse=True)
+            yield sse_event("summary", {
+                "cycle_id": cycle.cycle_id,
+                "total": len(embryo_ids),
+                "succeeded": len(results),
+                "failed": len(errors),
+                "good": sum(1 for r in results if r["prediction"] == "good"),
+                "ranking": [{"rank": rank, "embryo_id": r["embryo_id"], "prediction": r["prediction"],
+                             "viability_score": r["viability_score"]} for rank, r in enumerate(ranked, 1)],
+                "first_result_ms": first_result_ms,
+                "total_ms": (time.perf_counter() - started) * 1000,
+            })
+        finally:
+            # Client gone or stream finished: stop outstanding work (their slots are released on cancel)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.post("/uploads", response_model=UploadSessionResponse)
+async def create_upload_session(
+    session_data: UploadSessionCreate,
+    current_user: Optional[User] = Depends(get_current_user_optional),
+    db: Session = Depends(get_db)
+):
+    """Start a resumable upload for a large image or time-lapse video"""
+    session = create_session(db, current_user, session_data.prediction_data, session_data.total_size,
+                             session_data.filename, session_data.chunk_size)
+    return session_status(session)
+
+@app.put("/uploads/{upload_id}/chunks/{index}", response_model=UploadSessionResponse)
+async def upload_chunk(
+    upload_id: str,
+    index: int,
+    request: Request,
+    offset: int = Query(..., ge=0, description="Byte offset of this chunk in the file"),
+    x_chunk_sha256: Optional[str] = Header(None, description="Optional SHA-256 of the chunk body"),
+    current_user: Optional[User] = Depends(get_current_user_optional),
+    db: Session = Depends(get_db)
+):
+    """Write one chunk (raw request body) at `offset`; safe to retry"""
+    session = get_session(db, upload_id, current_user)
+    session = await write_chunk(db, session, index, offset, request, x_chunk_sha256)
+    return session_status(session)
+
+@app.get("/uploads/{upload_id}", response_model=UploadSessionResponse)
+async def get_upload_session(
+    upload_id: str,
+    current_user: Optional[User] = Depends(get_current_user_optional),
+    db: Session = Depends(get_db)
+):
+    """Received and missing byte ranges, for resuming after a dropped connection"""
+    return session_status(get_session(db, upload_id, current_user, require_open=False))
+
+@app.delete("/uploads/{upload_id}")
+async def abort_upload_session(
+    upload_id: str,
+    current_user: Optional[User] = Depends(get_current_user_optional),
+    db: Session = Depends(get_db)
+):
+    """Abandon an upload and delete its spool file"""
+    close_session(db, get_session(db, upload_id, current_user), "aborted")
+    return {"message": "Upload aborted"}
+
+def decode_assembled_upload(path: str):
+    """
+    Sniff, decode and extract features from an assembled upload on disk
+    (images via PIL, videos frame by frame via OpenCV). Returns (content_type,
+    extractor_version, features, image, preview, width, height), or None for
+    unsupported files.
+    """
+    with open(path, "rb") as f:
+        head = f.read(SNIFF_BYTES)
+    image_kind = sniff_image_format(head)
+    video_kind = None if image_kind else sniff_video_format(head)
+    if image_kind:
+        image = preprocess_image_fast(path)
+        features = extract_features_fast(image)
+        with Image.open(path) as original:
+            width, height = original.size
+            original.draft("RGB", (512, 512))
+            preview = original.convert("RGB")
+        return image_kind[1], FEATURE_EXTRACTOR_VERSION, features, image, preview, width, height
+    if video_kind:
+        features, image, frame = extract_video_features(path)
+        height, width = frame.shape[:2]
+        return video_kind[1], VIDEO_FEATURE_EXTRACTOR_VERSION, features, image, Image.fromarray(frame), width, height
+    return None
+
+@app.post("/uploads/{upload_id}/finalize", response_model=PredictionResponse)
+async def finalize_upload(
+    upload_id: str,
+    priority: int = Depends(prediction_admission),
+    mode: str = Query(DEFAULT_ENSEMBLE_MODE, description="Ensemble evaluation mode: full, cascade or fast"),
+    explain: bool = Query(False, description="Include per-feature contributions for this prediction"),
+    current_user: Optional[User] = Depends(get_current_active_user_optional),
+    db: Session = Depends(get_db)
+):
+    """
+    Predict from a completely received upload. The assembled file is decoded
+    from disk (images via PIL, videos frame by frame via OpenCV) and then
+    moved into the image store, so it is never read back into memory whole.
+    """
+    if mode not in ENSEMBLE_MODES:
+        raise HTTPException(status_code=400, detail=f"Invalid mode '{mode}'. Expected one of: {', '.join(ENSEMBLE_MODES)}")
+    session = get_session(db, upload_id, current_user)
+    path, sha256 = await run_in_threadpool(assemble, db, session)
+    async with admission.slot(priority):
+        # Decoding (a video can be hundreds of MB) runs on the thread pool
+        decoded = await run_in_threadpool(decode_assembled_upload, path)
+        if decoded is None:
+            raise HTTPException(status_code=415, detail="Unsupported file type; expected an image or a MP4/MOV/AVI/MKV video")
+        content_type, extractor_version, features, image, preview, width, height = decoded
+        logger.info(f"Finalizing upload {upload_id}: {session.total_size} bytes ({content_type})")
+
+        def store_upload(embryo):
+            return ingest_file(db, path, sha256, content_type, image, preview, width, height)
+
+        metadata = PredictionRequestData(**session.prediction_data)
+        model_probabilities = await batched_model_probabilities(features, mode)
+        result, explanation = await run_in_threadpool(
+            complete_prediction, db, current_user, metadata, features, sha256, mode, explain, store_upload, extractor_version,
+            model_probabilities)
+    close_session(db, session, "finalized", sha256)
+    return prediction_response(result, features, explanation, image_sha256=sha256)
+
+@app.get("/metrics/inference")
+async def get_inference_metrics(current_user: User = Depends(require_auditor)):
+    """Micro-batching histograms (batch size, queue wait, batch run time) for tuning the window"""
+    return inference_scheduler.stats()
+
+
+@app.get("/metrics/admission")
+async def get_admission_metrics(current_user: User = Depends(require_auditor)):
+    """Active and queued prediction requests, admissions and 429 rejections"""
+    return admission.stats()
+
+
+@app.get("/overlays/{image_sha256}/{kind}")
+async def get_prediction_overlay(
+    image_sha256: str,
+    kind: str,
+    format: str = Query("png", description="png or webp"),
+    current_user: User = Depends(require_auditor)
+):
+    """Overlay image kept by /predict?overlays=true (edges, gradient or contour); derived from the upload, so Auditor+ like /images"""
+    if kind not in OVERLAY_KINDS:
+        raise HTTPException(status_code=400, detail=f"Invalid overlay '{kind}'. Expected one of: {', '.join(OVERLAY_KINDS)}")
+    if format not in OVERLAY_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid format '{format}'. Expected one of: {', '.join(OVERLAY_FORMATS)}")
+
+    data = get_overlay(image_sha256, kind, format)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Overlay not found; re-run /predict with overlays=true")
+    return Response(
+        content=data,
+        media_type=OVERLAY_FORMATS[format],
+        headers={"Cache-Control": "private, max-age=3600", "ETag": f'"{image_sha256}-{kind}-{format}"'}
+    )
+
+def stored_image_urls(sha256: str) -> Dict[str, str]:
+    return {variant: f"/images/{sha256}?variant={variant}" for variant in IMAGE_VARIANTS}
+
+@app.get("/images/{sha256}")
+async def get_stored_image(
+    sha256: str,
+    request: Request,
+    variant: str = Query("original", description="original, thumbnail or working"),
+    current_user: User = Depends(require_auditor),
+    db: Session = Depends(get_db)
+):
+    """Serve a stored upload or one of its derived variants, with ETag and Range support (Auditor+)"""
+    if variant not in IMAGE_VARIANTS:
+        raise HTTPException(status_code=400, detail=f"Invalid variant '{variant}'. Expected one of: {', '.join(IMAGE_VARIANTS)}")
+    stored = db.query(StoredImage).filter(StoredImage.sha256 == sha256).first()
+    path = variant_path(sha256, variant)
+    if not stored or not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    # Content-addressed, so the hash is a strong validator and the bytes never change
+    etag = f'"{sha256}"' if variant == "original" else f'"{sha256}-{variant}"'
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, max-age=31536000, immutable"
+    }
+    if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    media_type = IMAGE_VARIANTS[variant][2] or stored.content_type
+    size = os.path.getsize(path)
+    try:
+        byte_range = parse_range(request.headers.get("range"), size)
+    except ValueError:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+    # If-Range with a different validator means the client's partial copy is stale
+    if byte_range and request.headers.get("if-range", etag) != etag:
+        byte_range = None
+
+    if byte_range is None:
+        start, end, status_code = 0, size - 1, 200
+    else:
+        (start, end), status_code = byte_range, 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(iter_file_range(path, start, end), status_code=status_code,
+                             media_type=media_type, headers=headers)
+
+@app.get("/embryos/{embryo_id}/images", response_model=List[StoredImageResponse])
+async def get_embryo_images(embryo_id: int, current_user: User = Depends(require_auditor), db: Session = Depends(get_db)):
+    """Images uploaded for an embryo, newest first (Auditor+)"""
+    embryo = db.query(Embryo).filter(Embryo.id == embryo_id).first()
+    if not embryo:
+        raise HTTPException(status_code=404, detail="Embryo not found")
+
+    return [
+        StoredImageResponse(
+            sha256=stored.sha256,
+            content_type=stored.content_type,
+            size_bytes=stored.size_bytes,
+            width=stored.width,
+            height=stored.height,
+            linked_at=link.created_at,
+            urls=stored_image_urls(stored.sha256)
         )
+        for stored, link in images_for_embryo(db, embryo_id)
+    ]
 
-        print(f"[BACKEND] Returning response: {response.dict()}")
-        print(f"[BACKEND] REQUEST COMPLETED SUCCESSFULLY\n")
+def prediction_record_response(prediction: Prediction, embryo_code: str) -> PredictionRecordResponse:
+    return PredictionRecordResponse(
+        id=prediction.id,
+        embryo_id=prediction.embryo_id,
+        embryo_code=embryo_code,
+        cycle_id=prediction.cycle_id,
+        prediction=prediction.prediction,
+        viability_score=prediction.viability_score,
+        confidence=prediction.confidence,
+        confidence_level=prediction.confidence_level,
+        model_probabilities=model_probabilities(prediction),
+        model_version=prediction.model_version,
+        ensemble_mode=prediction.ensemble_mode,
+        created_at=prediction.created_at
+    )
 
-        return response
+@app.get("/cycles/{cycle_id}/predictions/latest", response_model=List[PredictionRecordResponse])
+async def get_cycle_latest_predictions(cycle_id: int, current_user: User = Depends(require_auditor), db: Session = Depends(get_db)):
+    """Latest prediction for every embryo in a cycle (Auditor+)"""
+    cycle = db.query(Cycle).filter(Cycle.id == cycle_id).first()
+    if not cycle:
+        raise HTTPException(status_code=404, detail="Cycle not found")
 
-    except Exception as e:
-        print(f"\n[BACKEND] ERROR: {str(e)}")
-        import traceback
-        print(f"[BACKEND] Traceback:\n{traceback.format_exc()}\n")
-        logger.error(f"Prediction error: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
+    rows = latest_predictions_for_cycle(db, cycle_id)
+    return [prediction_record_response(prediction, embryo_code) for prediction, embryo_code in rows]
 
+@app.get("/cycles/{cycle_id}/ranking", response_model=CycleRankingResponse)
+async def get_cycle_ranking_endpoint(
+    cycle_id: int,
+    top_k: Optional[int] = Query(None, ge=1, le=100, description="Only return the best k embryos"),
+    current_user: User = Depends(require_auditor),
+    db: Session = Depends(get_db)
+):
+    """Rank a cycle's embryos by their latest prediction with AI overrides applied (Auditor+)"""
+    cycle = db.query(Cycle).filter(Cycle.id == cycle_id).first()
+    if not cycle:
+        raise HTTPException(status_code=404, detail="Cycle not found")
+
+    ranking, cached = get_cycle_ranking(db, cycle, top_k)
+    return CycleRankingResponse(cycle_id=cycle_id, total_ranked=len(ranking), cached=cached, ranking=ranking)
+
+@app.get("/embryos/{embryo_id}/predictions", response_model=List[PredictionRecordResponse])
+async def get_embryo_predictions(
+    embryo_id: int,
+    limit: int = Query(50, ge=1, le=500),
+    current_user: User = Depends(require_auditor),
+    db: Session = Depends(get_db)
+):
+    """Prediction history for one embryo, newest first (Auditor+)"""
+    embryo = db.query(Embryo).filter(Embryo.id == embryo_id).first()
+    if not embryo:
+        raise HTTPException(status_code=404, detail="Embryo not found")
+
+    predictions = prediction_history(db, embryo_id, limit)
+    return [prediction_record_response(prediction, embryo.embryo_id) for prediction in predictions]
+
+def aggregate_response(scope: str, key: str, row) -> AggregateStatsResponse:
+    if row is None:
+        return AggregateStatsResponse(scope=scope, key=key, prediction_count=0, good_count=0, good_rate=0.0,
+                                      mean_viability=0.0, std_viability=0.0, mean_confidence=0.0,
+                                      confidence_levels={"high": 0, "medium": 0, "low": 0},
+                                      override_count=0, override_rate=0.0)
+    return AggregateStatsResponse(**group_stats(row))
+
+@app.get("/stats/cycles/{cycle_id}", response_model=AggregateStatsResponse)
+async def get_cycle_stats(cycle_id: int, current_user: User = Depends(require_auditor), db: Session = Depends(get_db)):
+    """Prediction counts, viability mean/spread and confidence levels for a cycle, from the aggregates (Auditor+)"""
+    cycle = db.query(Cycle).filter(Cycle.id == cycle_id).first()
+    if not cycle:
+        raise HTTPException(status_code=404, detail="Cycle not found")
+    return aggregate_response("cycle", str(cycle_id), get_group(db, "cycle", str(cycle_id)))
+
+@app.get("/stats/days", response_model=List[AggregateStatsResponse])
+async def get_daily_stats(
+    start_date: Optional[datetime] = Query(None),
+    end_date: Optional[datetime] = Query(None),
+    current_user: User = Depends(require_auditor),
+    db: Session = Depends(get_db)
+):
+    """Per-day prediction aggregates (UTC days) for trend charts (Auditor+)"""
+    rows = list_groups(db, "day",
+                       start=start_date.strftime("%Y-%m-%d") if start_date else None,
+                       end=end_date.strftime("%Y-%m-%d") if end_date else None)
+    return [aggregate_response(row.scope, row.key, row) for row in rows]
+
+@app.get("/stats/model-versions", response_model=List[AggregateStatsResponse])
+async def get_model_version_stats(current_user: User = Depends(require_auditor), db: Session = Depends(get_db)):
+    """Prediction aggregates per model version (Auditor+)"""
+    return [aggregate_response(row.scope, row.key, row) for row in list_groups(db, "model_version")]
 
 @app.post("/notes", response_model=NoteResponse)
 async def create_note(note_data: NoteCreate, current_user: User = Depends(require_embryologist), db: Session = Depends(get_db)):
@@ -697,24 +1655,154 @@ async def create_note(note_data: NoteCreate, current_user: User = Depends(requir
     )
     log_user_action(db, current_user, log_data)
 
-    return NoteResponse(
-        id=note.id,
-        user_id=note.user_id,
-        username=current_user.username,
-        role=current_user.role,
-        patient_audit_code=note.patient_audit_code,
-        cycle_id=note.cycle_id,
-        embryo_id=note.embryo_id,
-        note_text=note.note_text,
-        timestamp=note.timestamp
+    return NoteResponse(**note_fields(note, current_user))
+
+def note_fields(note: Note, user: Optional[User]) -> Dict[str, Any]:
+    return {
+        "id": note.id,
+        "user_id": note.user_id,
+        "username": user.username if user else "",
+        "role": user.role if user else "",
+        "patient_audit_code": note.patient_audit_code,
+        "cycle_id": note.cycle_id,
+        "embryo_id": note.embryo_id,
+        "note_text": note.note_text,
+        "timestamp": note.timestamp,
+    }
+
+def note_authors(db: Session, notes: List[Note]) -> Dict[int, User]:
+    return {user.id: user for user in db.query(User).filter(User.id.in_({note.user_id for note in notes}))}
+
+@app.get("/notes", response_model=NotePageResponse)
+async def get_notes(
+    patient_audit_code: Optional[str] = Query(None),
+    cycle_id: Optional[str] = Query(None),
+    embryo_id: Optional[str] = Query(None),
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    current_user: User = Depends(require_auditor),
+    db: Session = Depends(get_db)
+):
+    """Notes for a patient, cycle or embryo, newest first, paginated by cursor (Auditor+)"""
+    filters = {"patient_audit_code": patient_audit_code, "cycle_id": cycle_id, "embryo_id": embryo_id}
+    try:
+        notes, next_cursor = list_notes(db, filters, limit, cursor)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    authors = note_authors(db, notes)
+    return NotePageResponse(
+        notes=[NoteResponse(**note_fields(note, authors.get(note.user_id))) for note in notes],
+        next_cursor=next_cursor
+    )
+
+@app.get("/notes/search", response_model=NoteSearchResponse)
+async def search_notes_endpoint(
+    q: str = Query(..., min_length=1, max_length=200, description="Words that must all appear; word* matches a prefix"),
+    patient_audit_code: Optional[str] = Query(None),
+    cycle_id: Optional[str] = Query(None),
+    embryo_id: Optional[str] = Query(None),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    current_user: User = Depends(require_auditor),
+    db: Session = Depends(get_db)
+):
+    """Full-text search of note text, most relevant first, paginated by cursor (Auditor+)"""
+    filters = {"patient_audit_code": patient_audit_code, "cycle_id": cycle_id, "embryo_id": embryo_id}
+    try:
+        results, next_cursor = search_notes(db, q, filters, limit, cursor)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    authors = note_authors(db, [note for note, _ in results])
+    return NoteSearchResponse(
+        query=q,
+        results=[NoteSearchResult(**note_fields(note, authors.get(note.user_id)), rank=rank) for note, rank in results],
+        next_cursor=next_cursor
     )
 
 @app.post("/ai-override")
-async def log_ai_override(override_data: AIOverrideLog, current_user: User = Depends(require_embryologist), db: Session = Depends(get_db)):
+async def create_ai_override(override_data: AIOverrideLog, current_user: User = Depends(require_embryologist), db: Session = Depends(get_db)):
     """Log AI override with reason (Embryologist+)"""
+    # Counted in the aggregates; committed together with the audit entry
+    add_override(db, override_data.patient_audit_code, override_data.cycle_id, override_data.embryo_id)
     log_ai_override(db, current_user, override_data)
+    invalidate_cycle_ranking_by_codes(db, override_data.patient_audit_code, override_data.cycle_id)
     return {"message": "AI override logged successfully"}
 
+@app.get("/audit-logs/stats", response_model=AuditStatsResponse)
+async def get_audit_log_stats(
+    start_date: Optional[datetime] = Query(None),
+    end_date: Optional[datetime] = Query(None),
+    group_by: str = Query("action", description="Comma-separated: action, user, day, hour, model_version"),
+    current_user: User = Depends(require_auditor),
+    db: Session = Depends(get_db)
+):
+    """Audit entry counts for a date range, grouped by action/user/day/hour/model version (Auditor+)"""
+    dimensions = [d.strip() for d in group_by.split(",") if d.strip()]
+    invalid = [d for d in dimensions if d not in GROUP_BY_DIMENSIONS]
+    if invalid or not dimensions or len(set(dimensions)) != len(dimensions):
+        raise HTTPException(status_code=400, detail=f"Invalid group_by '{group_by}'. Expected a comma-separated subset of: {', '.join(GROUP_BY_DIMENSIONS)}")
+
+    stats = audit_stats(db, start_date, end_date, dimensions)
+    return AuditStatsResponse(start_date=start_date, end_date=end_date, group_by=dimensions, **stats)
+
+@app.get("/audit-logs/verify", response_model=AuditChainVerificationResponse)
+async def verify_audit_chain(
+    full: bool = Query(False, description="Walk the whole chain instead of starting at the last signed checkpoint"),
+    current_user: User = Depends(require_auditor),
+    db: Session = Depends(get_db)
+):
+    """Check the audit hash chain for altered, removed or reordered entries (Auditor+)"""
+    verification = await run_in_threadpool(verify_chain, db, full)
+
+    log_data = AuditLogCreate(action="AUDIT_CHAIN_VERIFIED", details={
+        "full": full,
+        "signed": verification["signed"],
+        "ok": verification["ok"],
+        "checked_rows": verification["checked_rows"],
+        "to_id": verification["to_id"],
+        "failure": verification["failure"]
+    })
+    log_user_action(db, current_user, log_data)
+    return AuditChainVerificationResponse(**verification)
+
+@app.post("/audit-logs/checkpoints", response_model=AuditChainCheckpointResponse)
+async def create_audit_chain_checkpoint(current_user: User = Depends(require_admin), db: Session = Depends(get_db)):
+    """Verify the chain since the last checkpoint and sign its current head (Admin only)"""
+    if not chain_key_configured():
+        raise HTTPException(status_code=503, detail="Audit chain checkpoints need AUDIT_CHAIN_KEY to be configured")
+    verification = await run_in_threadpool(verify_chain, db)
+    if not verification["ok"]:
+        raise HTTPException(status_code=409, detail={"message": "Audit chain verification failed",
+                                                     "failure": verification["failure"]})
+    if verification["to_id"] is None:
+        raise HTTPException(status_code=409, detail="The audit chain has no entries yet")
+    checkpoint = create_checkpoint(db, verification)
+    db.commit()
+    return AuditChainCheckpointResponse(
+        id=checkpoint.id,
+        last_id=checkpoint.last_id,
+        head_hash=checkpoint.head_hash,
+        chained_rows=checkpoint.chained_rows,
+        created_at=checkpoint.created_at,
+        verification=AuditChainVerificationResponse(**verification)
+    )
+
+def find_audit_entries(db: Session, filters: List[AuditFilter]) -> List[Dict[str, Any]]:
+    """
+    Audit entries matching (column, operator, value) filters from the hot table
+    and the archive segments, newest first, with the user's name and role
+    """
+    filters = normalize_filters(filters)
+    entries = [audit_entry(log) for log in db.query(AuditLog).filter(*sql_conditions(filters)).all()]
+    entries.extend(archived_entries(db, filters))
+    users = {user.id: user for user in db.query(User).filter(User.id.in_({entry["user_id"] for entry in entries}))}
+    for entry in entries:
+        user = users.get(entry["user_id"])
+        entry["username"] = user.username if user else ""
+        entry["role"] = user.role if user else ""
+    entries.sort(key=lambda entry: (entry["timestamp"] or datetime.min, entry["id"]), reverse=True)
+    return entries
+
 @app.get("/audit-logs", response_model=List[AuditLogResponse])
 async def get_audit_logs(
     patient_audit_code: Optional[str] = Query(None),
@@ -723,26 +1811,50 @@ async def get_audit_logs(
     end_date: Optional[datetime] = Query(None),
     action: Optional[str] = Query(None),
     user_id: Optional[int] = Query(None),
+    event_type: Optional[str] = Query(None, description="e.g. ai_prediction, ai_override, login"),
+    model_version: Optional[str] = Query(None),
+    min_confidence: Optional[float] = Query(None, ge=0, le=1),
+    max_confidence: Optional[float] = Query(None, ge=0, le=1),
+    min_viability: Optional[float] = Query(None, ge=0, le=100),
+    max_viability: Optional[float] = Query(None, ge=0, le=100),
+    original_prediction: Optional[str] = Query(None),
+    overridden_prediction: Optional[str] = Query(None),
     current_user: User = Depends(require_auditor),
     db: Session = Depends(get_db)
 ):
-    """Get audit logs with filtering (Auditor+)"""
-    query = db.query(AuditLog).join(User)
+    """Get audit logs with filtering; AI event fields are filtered through indexed columns (Auditor+)"""
+    filters = []
 
     if patient_audit_code:
-        query = query.filter(AuditLog.patient_audit_code == patient_audit_code)
+        filters.append(("patient_audit_code", "==", patient_audit_code))
     if cycle_id:
-        query = query.filter(AuditLog.cycle_id == cycle_id)
+        filters.append(("cycle_id", "==", cycle_id))
     if start_date:
-        query = query.filter(AuditLog.timestamp >= start_date)
+        filters.append(("timestamp", ">=", start_date))
     if end_date:
-        query = query.filter(AuditLog.timestamp <= end_date)
+        filters.append(("timestamp", "<=", end_date))
     if action:
-        query = query.filter(AuditLog.action == action)
+        filters.append(("action", "==", action))
     if user_id:
-        query = query.filter(AuditLog.user_id == user_id)
-
-    logs = query.order_by(AuditLog.timestamp.desc()).all()
+        filters.append(("user_id", "==", user_id))
+    if event_type:
+        filters.append(("event_type", "==", event_type))
+    if model_version:
+        filters.append(("model_version", "==", model_version))
+    if min_confidence is not None:
+        filters.append(("confidence_score", ">=", min_confidence))
+    if max_confidence is not None:
+        filters.append(("confidence_score", "<=", max_confidence))
+    if min_viability is not None:
+        filters.append(("viability_score", ">=", min_viability))
+    if max_viability is not None:
+        filters.append(("viability_score", "<=", max_viability))
+    if original_prediction:
+        filters.append(("original_prediction", "==", original_prediction))
+    if overridden_prediction:
+        filters.append(("overridden_prediction", "==", overridden_prediction))
+
+    logs = find_audit_entries(db, filters)
 
     # Log audit access
     log_data = AuditLogCreate(action="AUDIT_LOG_ACCESSED", details={
@@ -751,22 +1863,33 @@ async def get_audit_logs(
         "start_date": str(start_date) if start_date else None,
         "end_date": str(end_date) if end_date else None,
         "action": action,
-        "user_id": user_id
+        "user_id": user_id,
+        # Nested so they are not mistaken for this entry's own indexed fields
+        "ai_event_filters": {
+            "event_type": event_type,
+            "model_version": model_version,
+            "min_confidence": min_confidence,
+            "max_confidence": max_confidence,
+            "min_viability": min_viability,
+            "max_viability": max_viability,
+            "original_prediction": original_prediction,
+            "overridden_prediction": overridden_prediction
+        }
     })
     log_user_action(db, current_user, log_data)
 
     return [
         AuditLogResponse(
-            id=log.id,
-            user_id=log.user_id,
-            username=log.user.username,
-            role=log.user.role,
-            action=log.action,
-            timestamp=log.timestamp,
-            patient_audit_code=log.patient_audit_code,
-            cycle_id=log.cycle_id,
-            embryo_id=log.embryo_id,
-            details=log.details
+            id=log["id"],
+            user_id=log["user_id"],
+            username=log["username"],
+            role=log["role"],
+            action=log["action"],
+            timestamp=log["timestamp"],
+            patient_audit_code=log["patient_audit_code"],
+            cycle_id=log["cycle_id"],
+            embryo_id=log["embryo_id"],
+            details=log["details"]
         ) for log in logs
     ]
 
@@ -781,32 +1904,32 @@ async def export_audit_csv(
 ):
     """Export audit logs as CSV (Auditor+)"""
     # Get filtered logs
-    query = db.query(AuditLog).join(User)
+    filters = []
 
     if patient_audit_code:
-        query = query.filter(AuditLog.patient_audit_code == patient_audit_code)
+        filters.append(("patient_audit_code", "==", patient_audit_code))
     if cycle_id:
-        query = query.filter(AuditLog.cycle_id == cycle_id)
+        filters.append(("cycle_id", "==", cycle_id))
     if start_date:
-        query = query.filter(AuditLog.timestamp >= start_date)
+        filters.append(("timestamp", ">=", start_date))
     if end_date:
-        query = query.filter(AuditLog.timestamp <= end_date)
+        filters.append(("timestamp", "<=", end_date))
 
-    logs = query.order_by(AuditLog.timestamp.desc()).all()
+    logs = find_audit_entries(db, filters)
 
     # Convert to DataFrame
     data = []
     for log in logs:
         data.append({
-            "Timestamp": log.timestamp.isoformat(),
-            "User ID": log.user_id,
-            "Username": log.user.username,
-            "Role": log.user.role,
-            "Action": log.action,
-            "Patient Code": log.patient_audit_code or "",
-            "Cycle ID": log.cycle_id or "",
-            "Embryo ID": log.embryo_id or "",
-            "Details": str(log.details) if log.details else ""
+            "Timestamp": log["timestamp"].isoformat(),
+            "User ID": log["user_id"],
+            "Username": log["username"],
+            "Role": log["role"],
+            "Action": log["action"],
+            "Patient Code": log["patient_audit_code"] or "",
+            "Cycle ID": log["cycle_id"] or "",
+            "Embryo ID": log["embryo_id"] or "",
+            "Details": str(log["details"]) if log["details"] else ""
         })
 
     df = pd.DataFrame(data)
@@ -837,18 +1960,18 @@ async def export_audit_pdf(
 ):
     """Export audit logs as PDF (Auditor+)"""
     # Get filtered logs
-    query = db.query(AuditLog).join(User)
+    filters = []
 
     if patient_audit_code:
-        query = query.filter(AuditLog.patient_audit_code == patient_audit_code)
+        filters.append(("patient_audit_code", "==", patient_audit_code))
     if cycle_id:
-        query = query.filter(AuditLog.cycle_id == cycle_id)
+        filters.append(("cycle_id", "==", cycle_id))
     if start_date:
-        query = query.filter(AuditLog.timestamp >= start_date)
+        filters.append(("timestamp", ">=", start_date))
     if end_date:
-        query = query.filter(AuditLog.timestamp <= end_date)
+        filters.append(("timestamp", "<=", end_date))
 
-    logs = query.order_by(AuditLog.timestamp.desc()).all()
+    logs = find_audit_entries(db, filters)
 
     # Create PDF
     output = BytesIO()
@@ -867,14 +1990,14 @@ async def export_audit_pdf(
     data = [["Timestamp", "User", "Role", "Action", "Patient", "Cycle", "Embryo", "Details"]]
     for log in logs:
         data.append([
-            log.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
-            log.user.username,
-            log.user.role,
-            log.action,
-            log.patient_audit_code or "",
-            log.cycle_id or "",
-            log.embryo_id or "",
-            str(log.details)[:50] + "..." if log.details and len(str(log.details)) > 50 else str(log.details or "")
+            log["timestamp"].strftime("%Y-%m-%d %H:%M:%S"),
+            log["username"],
+            log["role"],
+            log["action"],
+            log["patient_audit_code"] or "",
+            log["cycle_id"] or "",
+            log["embryo_id"] or "",
+            str(log["details"])[:50] + "..." if log["details"] and len(str(log["details"])) > 50 else str(log["details"] or "")
         ])
 
     # Create table
@@ -0,0 +1,45 @@
+"""
+Small in-process metrics for tuning the serving path
+
+Fixed-bucket histograms are cheap enough to update on every request and are
+reported as JSON by the /metrics endpoints. Counts are per process, so with
+several uvicorn workers each worker reports its own.
+"""
+
+from typing import Dict, List, Sequence
+import bisect
+import threading
+
+
+class Histogram:
+    """Per-bucket (non-cumulative) counts for `le` upper bounds plus an overflow bucket"""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets: List[float] = sorted(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._count = 0
+        self._sum = 0.0
+        self._max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._count += 1
+            self._sum += value
+            self._max = max(self._max, value)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            counts = list(self._counts)
+            count, total, peak = self._count, self._sum, self._max
+        buckets = {f"le_{bound:g}": n for bound, n in zip(self.buckets, counts)}
+        buckets["inf"] = counts[-1]
+        return {
+            "count": count,
+            "sum": round(total, 3),
+            "mean": round(total / count, 3) if count else 0.0,
+            "max": round(peak, 3),
+            "buckets": buckets,
+        }
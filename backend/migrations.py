@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Schema migrations for existing databases
+
+create_tables() creates missing tables but never alters existing ones. This
+brings an existing database up to the models. It adds any nullable column
+the models have but the table lacks, with ALTER TABLE ... ADD COLUMN, and
+creates missing indexes, including the notes full-text index (see
+notes_search.py). It then runs the data backfills for those columns
+in batches, with a commit per batch, so a large audit trail is not locked in
+one long transaction and an interrupted run simply continues.
+
+Every step is idempotent. The app runs migrations on startup, and they can
+also be run by hand (from the backend folder):
+    python migrations.py
+"""
+
+from typing import Callable, Dict, List, Optional
+import argparse
+import logging
+import os
+import sys
+
+from sqlalchemy import bindparam, inspect, select, text, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKFILL_BATCH_SIZE = 1000
+
+logger = logging.getLogger(__name__)
+
+
+def add_missing_columns(engine: Engine) -> List[str]:
+    """ADD COLUMN for nullable model columns absent from existing tables; returns 'table.column' names"""
+    from models import Base
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            present = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in present:
+                    continue
+                if not column.nullable:
+                    raise RuntimeError(f"Cannot add NOT NULL column {table.name}.{column.name} automatically")
+                column_type = column.type.compile(dialect=engine.dialect)
+                connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column_type}'))
+                added.append(f"{table.name}.{column.name}")
+    return added
+
+
+def create_missing_indexes(engine: Engine) -> List[str]:
+    from models import Base
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    created = []
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        present = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in present:
+                index.create(bind=engine, checkfirst=True)
+                created.append(index.name)
+    return created
+
+
+def backfill_audit_fields(db: Session, batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+    """
+    Fill the indexed AuditLog columns for rows written before they existed.
+    Every written row gets an event_type, so rows still without one are exactly
+    the ones left to do.
+    """
+    from audit_logger import audit_fields
+    from models import AuditLog
+    table = AuditLog.__table__
+    columns = list(audit_fields("", None))
+    statement = (
+        update(table)
+        .where(table.c.id == bindparam("row_id"))
+        .values({column: bindparam(f"new_{column}") for column in columns})
+    )
+    updated = 0
+    last_id = 0
+    while True:
+        rows = db.execute(
+            select(table.c.id, table.c.action, table.c.details)
+            .where(table.c.id > last_id, table.c.event_type.is_(None))
+            .order_by(table.c.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            return updated
+        db.execute(statement, [
+            {"row_id": row_id, **{f"new_{column}": value for column, value in audit_fields(action, details).items()}}
+            for row_id, action, details in rows
+        ])
+        db.commit()
+        updated += len(rows)
+        last_id = rows[-1][0]
+
+
+def backfill_audit_chain(db: Session, batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+    """Hash-chain audit rows written before the chain existed"""
+    from audit_chain import backfill_audit_chain as backfill
+    return backfill(db, batch_size)
+
+
+# Data migrations, run after the schema is up to date, in order (the chain
+# hashes the fields filled by the first)
+BACKFILLS: Dict[str, Callable[[Session, int], int]] = {
+    "audit_log_fields": backfill_audit_fields,
+    "audit_chain": backfill_audit_chain,
+}
+
+
+def run_migrations(engine: Engine, session_factory: Optional[Callable[[], Session]] = None,
+                   batch_size: int = BACKFILL_BATCH_SIZE) -> Dict[str, object]:
+    from notes_search import ensure_search_index
+    added = add_missing_columns(engine)
+    indexes = create_missing_indexes(engine)
+    if ensure_search_index(engine):
+        indexes.append("notes full-text search")
+    for name in added:
+        logger.info(f"Added column {name}")
+    for name in indexes:
+        logger.info(f"Created index {name}")
+
+    backfilled = {}
+    if session_factory is not None:
+        for name, backfill in BACKFILLS.items():
+            db = session_factory()
+            try:
+                backfilled[name] = backfill(db, batch_size)
+            finally:
+                db.close()
+            if backfilled[name]:
+                logger.info(f"Backfill {name}: {backfilled[name]} rows")
+    return {"columns": added, "indexes": indexes, "backfilled": backfilled}
+
+
+def main_cli(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Bring an existing database up to the current models")
+    parser.add_argument("--batch-size", type=int, default=BACKFILL_BATCH_SIZE, help="Rows per backfill transaction")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    os.chdir(BACKEND_DIR)
+    from database import SessionLocal, engine
+    from models import Base
+
+    Base.metadata.create_all(bind=engine)
+    result = run_migrations(engine, SessionLocal, args.batch_size)
+    print(f"Added {len(result['columns'])} columns and {len(result['indexes'])} indexes; "
+          f"backfilled {result['backfilled']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
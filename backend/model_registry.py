@@ -0,0 +1,67 @@
+"""
+Registry of named model sets
+
+A model set is an ordered mapping of model name -> fitted estimator whose
+probabilities are averaged. main.load_models registers the production
+ensemble and the distilled fast model under their audit model_version names;
+offline jobs can register additional sets (e.g. a new model version) from
+.pkl files and score feature matrices against any of them.
+"""
+
+from typing import Dict, List
+import logging
+
+import joblib
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_model_sets: Dict[str, Dict[str, object]] = {}
+
+
+def register_model_set(name: str, models: Dict[str, object]):
+    """Register (or replace) a model set; the mapping is kept by reference"""
+    _model_sets[name] = models
+    logger.info(f"Registered model set '{name}' ({len(models)} models)")
+
+
+def load_model_set(name: str, paths: List[str]) -> Dict[str, object]:
+    """Load .pkl files into a new model set and register it"""
+    models = {}
+    for i, path in enumerate(paths, 1):
+        models[f"model_{i}"] = joblib.load(path)
+    register_model_set(name, models)
+    return models
+
+
+def get_model_set(name: str) -> Dict[str, object]:
+    if name not in _model_sets or not _model_sets[name]:
+        raise KeyError(f"Model set '{name}' is not registered or has no models")
+    return _model_sets[name]
+
+
+def list_model_sets() -> List[str]:
+    return [name for name, models in _model_sets.items() if models]
+
+
+def model_probability_matrix(model, X: np.ndarray) -> np.ndarray:
+    """Probability of "good" for every row of X"""
+    if hasattr(model, "predict_proba"):
+        proba = model.predict_proba(X)
+        return proba[:, 1] if proba.shape[1] > 1 else proba[:, 0]
+    # Distilled regressors predict the probability directly
+    return np.clip(model.predict(X), 0.0, 1.0)
+
+
+def predict_matrix(name: str, X: np.ndarray, per_model: bool = False):
+    """
+    Score a feature matrix with one call per model.
+    Returns the averaged probability of "good" (n_rows,), plus the per-model
+    matrix (n_rows, n_models) when per_model=True.
+    """
+    models = get_model_set(name)
+    stacked = np.column_stack([model_probability_matrix(model, X) for model in models.values()])
+    averaged = stacked.mean(axis=1)
+    if per_model:
+        return averaged, stacked
+    return averaged
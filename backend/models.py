@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, Boolean, Float, JSON
+from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, Boolean, Float, JSON, LargeBinary, BigInteger, UniqueConstraint, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -52,16 +52,34 @@ class AuditLog(Base):
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     action = Column(String, nullable=False)
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    timestamp = Column(DateTime, default=datetime.utcnow, index=True)
     patient_audit_code = Column(String, nullable=True)
     cycle_id = Column(String, nullable=True)
     embryo_id = Column(String, nullable=True)
     details = Column(JSON, nullable=True)  # For AI events, overrides, etc.
+    # Copied out of details when the entry is written (see audit_logger.audit_fields)
+    # so AI events can be filtered through indexes
+    event_type = Column(String, nullable=True, index=True)
+    model_version = Column(String, nullable=True, index=True)
+    confidence_score = Column(Float, nullable=True, index=True)
+    viability_score = Column(Float, nullable=True)
+    original_prediction = Column(String, nullable=True)
+    overridden_prediction = Column(String, nullable=True, index=True)
+    # Hash chain over the trail in id order (see audit_chain.py)
+    prev_hash = Column(String(64), nullable=True)
+    row_hash = Column(String(64), nullable=True)
 
     user = relationship("User")
 
 class Note(Base):
     __tablename__ = "notes"
+    # Filtered listings are read off these in id (newest first) order; note_text
+    # is searched through the full-text index made by notes_search.py
+    __table_args__ = (
+        Index("ix_notes_patient_newest", "patient_audit_code", "id"),
+        Index("ix_notes_cycle_newest", "cycle_id", "id"),
+        Index("ix_notes_embryo_newest", "embryo_id", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -72,4 +90,171 @@ class Note(Base):
     timestamp = Column(DateTime, default=datetime.utcnow)
 
     user = relationship("User")
-    # Note: These are not foreign keys to avoid coupling, just string references
\ No newline at end of file
+    # Note: These are not foreign keys to avoid coupling, just string references
+
+class FeatureVector(Base):
+    __tablename__ = "feature_vectors"
+    __table_args__ = (
+        UniqueConstraint("embryo_id", "image_sha256", "extractor_version", name="uq_feature_vector_image"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    embryo_id = Column(Integer, ForeignKey("embryos.id"), nullable=False, index=True)
+    image_sha256 = Column(String(64), nullable=False, index=True)
+    extractor_version = Column(String, nullable=False)
+    features = Column(LargeBinary, nullable=False)  # float32 little-endian, FEATURE_NAMES order
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    embryo = relationship("Embryo")
+
+class Prediction(Base):
+    __tablename__ = "predictions"
+    __table_args__ = (
+        Index("ix_predictions_cycle_created", "cycle_id", "created_at"),
+        Index("ix_predictions_embryo_created", "embryo_id", "created_at"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    embryo_id = Column(Integer, ForeignKey("embryos.id"), nullable=False)
+    cycle_id = Column(Integer, ForeignKey("cycles.id"), nullable=False)  # Denormalized for per-cycle lookups
+    feature_vector_id = Column(Integer, ForeignKey("feature_vectors.id"), nullable=True)
+    prediction = Column(String, nullable=False)  # good, not_good
+    viability_score = Column(Float, nullable=False)
+    confidence = Column(Float, nullable=False)
+    confidence_level = Column(String, nullable=False)  # high, medium, low
+    model_1_probability = Column(Float, nullable=True)  # Null when the model was not consulted
+    model_2_probability = Column(Float, nullable=True)
+    model_3_probability = Column(Float, nullable=True)
+    model_version = Column(String, nullable=False)
+    ensemble_mode = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    embryo = relationship("Embryo")
+    cycle = relationship("Cycle")
+
+class StoredImage(Base):
+    __tablename__ = "stored_images"
+
+    id = Column(Integer, primary_key=True, index=True)
+    sha256 = Column(String(64), unique=True, index=True, nullable=False)
+    content_type = Column(String, nullable=False)
+    size_bytes = Column(Integer, nullable=False)
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class ImageLink(Base):
+    __tablename__ = "image_links"
+    __table_args__ = (
+        UniqueConstraint("stored_image_id", "embryo_id", name="uq_image_link"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    stored_image_id = Column(Integer, ForeignKey("stored_images.id"), nullable=False)
+    embryo_id = Column(Integer, ForeignKey("embryos.id"), nullable=False, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    stored_image = relationship("StoredImage")
+    embryo = relationship("Embryo")
+
+class UploadSession(Base):
+    __tablename__ = "upload_sessions"
+
+    id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    filename = Column(String, nullable=True)
+    total_size = Column(BigInteger, nullable=False)
+    chunk_size = Column(Integer, nullable=False)
+    prediction_data = Column(JSON, nullable=False)  # Validated patient/cycle/embryo codes
+    received_ranges = Column(JSON, nullable=False, default=list)  # Merged [start, end) byte ranges
+    received_bytes = Column(BigInteger, nullable=False, default=0)
+    status = Column(String, nullable=False, default="open")  # open, finalized, aborted, expired
+    sha256 = Column(String(64), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class PredictionAggregate(Base):
+    """
+    Running totals over predictions for one group: a cycle (key = cycle pk),
+    a UTC day (key = YYYY-MM-DD) or a model version. Maintained by
+    aggregates.py in the same transaction as each prediction and override.
+    """
+    __tablename__ = "prediction_aggregates"
+    __table_args__ = (
+        UniqueConstraint("scope", "key", name="uq_prediction_aggregate_group"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    scope = Column(String, nullable=False)  # cycle, day, model_version
+    key = Column(String, nullable=False)
+    prediction_count = Column(Integer, nullable=False, default=0)
+    good_count = Column(Integer, nullable=False, default=0)
+    viability_sum = Column(Float, nullable=False, default=0.0)
+    viability_sum_sq = Column(Float, nullable=False, default=0.0)
+    confidence_sum = Column(Float, nullable=False, default=0.0)
+    confidence_high = Column(Integer, nullable=False, default=0)
+    confidence_medium = Column(Integer, nullable=False, default=0)
+    confidence_low = Column(Integer, nullable=False, default=0)
+    override_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class AuditRollup(Base):
+    """Audit entries per hour, action, user and model version (see audit_rollups.py)"""
+    __tablename__ = "audit_rollups"
+    __table_args__ = (
+        UniqueConstraint("hour", "action", "user_id", "model_version", name="uq_audit_rollup_group"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    hour = Column(DateTime, nullable=False)  # Start of the UTC hour
+    action = Column(String, nullable=False)
+    user_id = Column(Integer, nullable=False)
+    model_version = Column(String, nullable=False, default="")  # "" when the entry has none
+    count = Column(Integer, nullable=False, default=0)
+
+class AuditRollupState(Base):
+    """High-water mark: audit_logs rows with id <= high_water_id are counted in audit_rollups"""
+    __tablename__ = "audit_rollup_state"
+
+    name = Column(String, primary_key=True)
+    high_water_id = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class AuditArchiveSegment(Base):
+    """Manifest entry for a compressed, read-only segment of archived audit_logs rows (see audit_archive.py)"""
+    __tablename__ = "audit_archive_segments"
+    __table_args__ = (
+        Index("ix_audit_archive_segments_time", "start_time", "end_time"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    filename = Column(String, unique=True, nullable=False)  # Relative to AUDIT_ARCHIVE_DIR
+    first_id = Column(Integer, nullable=False)
+    last_id = Column(Integer, nullable=False)
+    start_time = Column(DateTime, nullable=False)
+    end_time = Column(DateTime, nullable=False)
+    row_count = Column(Integer, nullable=False)
+    sha256 = Column(String(64), nullable=False)
+    size_bytes = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class AuditChainState(Base):
+    """Head of the audit hash chain; its row is locked while an entry is appended"""
+    __tablename__ = "audit_chain_state"
+
+    name = Column(String, primary_key=True)
+    genesis_id = Column(Integer, nullable=False)  # First chained audit_logs id; earlier rows predate the chain
+    last_id = Column(Integer, nullable=False)
+    head_hash = Column(String(64), nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class AuditChainCheckpoint(Base):
+    """HMAC-signed (last_id, head_hash) after a successful verification; later checks start here"""
+    __tablename__ = "audit_chain_checkpoints"
+
+    id = Column(Integer, primary_key=True, index=True)
+    last_id = Column(Integer, nullable=False, index=True)
+    head_hash = Column(String(64), nullable=False)
+    chained_rows = Column(Integer, nullable=False)  # Rows from genesis through last_id
+    signature = Column(String(64), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
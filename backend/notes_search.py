@@ -0,0 +1,195 @@
+"""
+Listing and full-text search of clinical notes
+
+Both queries return notes newest or most relevant first, one page at a
+time. Pages use keyset pagination: the cursor is an opaque token holding the
+sort key of the last note returned. A page costs the same however deep it
+is, and notes added meanwhile do not shift later pages. Patient, cycle and
+embryo filters use the composite (column, id) indexes on notes, so a
+filtered list is read straight off an index in id order.
+
+Search uses the database's own full-text index:
+
+    SQLite      notes_fts, an external-content FTS5 table over notes.note_text
+                and the filter columns, kept in sync by triggers on notes;
+                ranked by bm25 over note_text
+    PostgreSQL  notes.note_tsv, a stored generated tsvector column with a GIN
+                index; ranked by ts_rank
+
+ensure_search_index() creates either one, and fills it from the existing
+notes. It is idempotent and runs with the migrations (see migrations.py).
+Other databases fall back to a LIKE scan without ranking.
+
+Search text is split into words, and all of them must match. Punctuation is
+ignored, so user input can never be a query syntax error. A trailing * on a
+word matches it as a prefix.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+import base64
+import json
+import re
+
+from sqlalchemy import column, func, inspect, literal, literal_column, or_, select, table, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from models import Note
+
+FTS_TABLE = "notes_fts"
+TSVECTOR_COLUMN = "note_tsv"
+TSVECTOR_CONFIG = "english"
+FILTER_COLUMNS = ("patient_audit_code", "cycle_id", "embryo_id")
+
+# The filter columns are indexed too, so a filtered search intersects the
+# (short) posting list of e.g. the cycle with the words' instead of walking
+# every note containing a common word. They carry no weight in the ranking.
+FTS_COLUMNS = ("note_text",) + FILTER_COLUMNS
+_fts_columns = ", ".join(FTS_COLUMNS)
+_new_values = ", ".join(f"new.{name}" for name in FTS_COLUMNS)
+_old_values = ", ".join(f"old.{name}" for name in FTS_COLUMNS)
+SQLITE_SEARCH_DDL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    f"{_fts_columns}, content='notes', content_rowid='id', tokenize='porter unicode61')",
+    f"CREATE TRIGGER IF NOT EXISTS notes_fts_insert AFTER INSERT ON notes BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, {_fts_columns}) VALUES (new.id, {_new_values}); END",
+    f"CREATE TRIGGER IF NOT EXISTS notes_fts_delete AFTER DELETE ON notes BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_fts_columns}) VALUES ('delete', old.id, {_old_values}); END",
+    f"CREATE TRIGGER IF NOT EXISTS notes_fts_update AFTER UPDATE ON notes BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_fts_columns}) VALUES ('delete', old.id, {_old_values}); "
+    f"INSERT INTO {FTS_TABLE}(rowid, {_fts_columns}) VALUES (new.id, {_new_values}); END",
+]
+
+POSTGRES_SEARCH_DDL = [
+    f"ALTER TABLE notes ADD COLUMN IF NOT EXISTS {TSVECTOR_COLUMN} tsvector "
+    f"GENERATED ALWAYS AS (to_tsvector('{TSVECTOR_CONFIG}', note_text)) STORED",
+    f"CREATE INDEX IF NOT EXISTS ix_notes_{TSVECTOR_COLUMN} ON notes USING GIN ({TSVECTOR_COLUMN})",
+]
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def ensure_search_index(engine: Engine) -> bool:
+    """Create the full-text index for notes if it is missing; returns True if it was created"""
+    inspector = inspect(engine)
+    if "notes" not in inspector.get_table_names():
+        return False
+    dialect = engine.dialect.name
+    if dialect == "sqlite":
+        if FTS_TABLE in inspector.get_table_names():
+            return False
+        with engine.begin() as connection:
+            for statement in SQLITE_SEARCH_DDL:
+                connection.execute(text(statement))
+            # Index the notes written before the table existed
+            connection.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+        return True
+    if dialect == "postgresql":
+        if TSVECTOR_COLUMN in {existing["name"] for existing in inspector.get_columns("notes")}:
+            return False
+        # The generated column is computed for existing rows as it is added
+        with engine.begin() as connection:
+            for statement in POSTGRES_SEARCH_DDL:
+                connection.execute(text(statement))
+        return True
+    return False
+
+
+def encode_cursor(key: Dict[str, Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(key, separators=(",", ":")).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: Optional[str], fields: Tuple[str, ...]) -> Optional[Dict[str, Any]]:
+    if not cursor:
+        return None
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        if not isinstance(key, dict) or set(key) != set(fields) or not isinstance(key["id"], int) \
+                or not isinstance(key.get("rank", 0.0), (int, float)):
+            raise ValueError(cursor)
+        return key
+    except (ValueError, TypeError, UnicodeError):
+        raise InvalidCursor("Invalid pagination cursor")
+
+
+def search_terms(query: str) -> List[Tuple[str, bool]]:
+    """(word, is_prefix) pairs from free text"""
+    return [(match.group(1).lower(), bool(match.group(2))) for match in re.finditer(r"(\w+)(\*?)", query)]
+
+
+def _fts5_query(terms: List[Tuple[str, bool]], filters: Dict[str, Optional[str]]) -> str:
+    words = " ".join(f'"{word}"' + ("*" if prefix else "") for word, prefix in terms)
+    query = f"note_text : ({words})"
+    # Narrowing only: the phrase also matches longer values, so the SQL equality still applies
+    for column, value in filters.items():
+        if column in FILTER_COLUMNS and value is not None and re.search(r"\w", value):
+            escaped = value.replace('"', '""')
+            query += f' AND {column} : "{escaped}"'
+    return query
+
+
+def _tsquery(terms: List[Tuple[str, bool]]) -> str:
+    return " & ".join(word + (":*" if prefix else "") for word, prefix in terms)
+
+
+def _filters(filters: Dict[str, Optional[str]]) -> list:
+    return [getattr(Note, column) == value for column, value in filters.items()
+            if column in FILTER_COLUMNS and value is not None]
+
+
+def list_notes(db: Session, filters: Dict[str, Optional[str]], limit: int,
+               cursor: Optional[str] = None) -> Tuple[List[Note], Optional[str]]:
+    """Notes matching the filters, newest first; returns (page, cursor of the next page or None)"""
+    key = decode_cursor(cursor, ("id",))
+    query = db.query(Note).filter(*_filters(filters))
+    if key is not None:
+        query = query.filter(Note.id < key["id"])
+    notes = query.order_by(Note.id.desc()).limit(limit + 1).all()
+    next_cursor = encode_cursor({"id": notes[limit - 1].id}) if len(notes) > limit else None
+    return notes[:limit], next_cursor
+
+
+def search_notes(db: Session, query_text: str, filters: Dict[str, Optional[str]], limit: int,
+                 cursor: Optional[str] = None) -> Tuple[List[Tuple[Note, float]], Optional[str]]:
+    """
+    Notes containing every word of query_text, most relevant first (ties
+    newest first); returns ([(note, rank)], cursor of the next page or None).
+    A higher rank is more relevant.
+    """
+    key = decode_cursor(cursor, ("rank", "id"))
+    terms = search_terms(query_text)
+    if not terms:
+        return [], None
+
+    dialect = db.get_bind().dialect.name
+    conditions = _filters(filters)
+    if dialect == "sqlite":
+        fts = table(FTS_TABLE, column("rowid"))
+        # bm25 is lower for better matches; only note_text is weighted
+        rank = -func.bm25(literal_column(FTS_TABLE), 1.0, *([0.0] * len(FILTER_COLUMNS)))
+        statement = (
+            select(Note, rank.label("rank"))
+            .join(fts, fts.c.rowid == Note.id)
+            .where(literal_column(FTS_TABLE).op("MATCH")(_fts5_query(terms, filters)), *conditions)
+        )
+    elif dialect == "postgresql":
+        tsquery = func.to_tsquery(TSVECTOR_CONFIG, _tsquery(terms))
+        vector = literal_column(f"notes.{TSVECTOR_COLUMN}")
+        rank = func.ts_rank(vector, tsquery)
+        statement = select(Note, rank.label("rank")).where(vector.op("@@")(tsquery), *conditions)
+    else:
+        rank = literal(0.0)
+        matched = [Note.note_text.ilike(f"%{word}%") for word, _ in terms]
+        statement = select(Note, rank.label("rank")).where(*matched, *conditions)
+
+    if key is not None:
+        statement = statement.where(or_(rank < key["rank"], (rank == key["rank"]) & (Note.id < key["id"])))
+    rows = db.execute(statement.order_by(rank.desc(), Note.id.desc()).limit(limit + 1)).all()
+    results = [(note, float(row_rank)) for note, row_rank in rows]
+    next_cursor = None
+    if len(results) > limit:
+        note, row_rank = results[limit - 1]
+        next_cursor = encode_cursor({"rank": row_rank, "id": note.id})
+    return results[:limit], next_cursor
@@ -0,0 +1,110 @@
+"""
+Explainability overlays built from feature-extraction buffers
+
+/predict?overlays=true keeps the Canny edge map, Sobel gradient magnitude
+and largest Otsu contour that extract_features_with_buffers already computed,
+reduced to compact uint8 arrays and cached by image hash. The viewer fetches
+each overlay separately from GET /overlays/{image_sha256}/{kind}, rendered
+on first request as a transparent PNG or WebP the size of the 128x128
+working image and memoised per format.
+"""
+
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+import io
+import os
+import threading
+
+import cv2
+import numpy as np
+from PIL import Image
+
+OVERLAY_KINDS = ("edges", "gradient", "contour")
+OVERLAY_FORMATS = {"png": "image/png", "webp": "image/webp"}
+
+# Entries are small (~35 KB of buffers plus rendered images), so a few
+# thousand fit comfortably in memory
+OVERLAY_CACHE_ENTRIES = int(os.getenv("OVERLAY_CACHE_ENTRIES", "2048"))
+
+EDGE_COLOR = (0, 255, 255)
+CONTOUR_COLOR = (255, 64, 64)
+
+
+class OverlayEntry:
+    def __init__(self, edges: np.ndarray, gradient: np.ndarray, contour: Optional[np.ndarray]):
+        self.edges = edges
+        self.gradient = gradient
+        self.contour = contour
+        self.rendered: Dict[Tuple[str, str], bytes] = {}
+
+
+_cache: "OrderedDict[str, OverlayEntry]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def store_overlay_buffers(image_sha256: str, buffers: Dict) -> bool:
+    """Keep the compact overlay inputs for an image; returns False if there is nothing to store"""
+    if not buffers:
+        return False
+    gradient = buffers["gradient_magnitude"]
+    peak = float(gradient.max())
+    gradient_u8 = (gradient * (255.0 / peak)).astype(np.uint8) if peak > 0 else np.zeros(gradient.shape, np.uint8)
+    entry = OverlayEntry(
+        edges=(buffers["edges"] > 0).astype(np.uint8) * 255,
+        gradient=gradient_u8,
+        contour=buffers.get("largest_contour"),
+    )
+    with _cache_lock:
+        _cache[image_sha256] = entry
+        _cache.move_to_end(image_sha256)
+        while len(_cache) > OVERLAY_CACHE_ENTRIES:
+            _cache.popitem(last=False)
+    return True
+
+
+def overlay_urls(image_sha256: str) -> Dict[str, str]:
+    return {kind: f"/overlays/{image_sha256}/{kind}" for kind in OVERLAY_KINDS}
+
+
+def _rgba(color_rgb: np.ndarray, alpha: np.ndarray) -> np.ndarray:
+    return np.dstack([color_rgb, alpha]).astype(np.uint8)
+
+
+def render_overlay(entry: OverlayEntry, kind: str) -> np.ndarray:
+    """RGBA overlay array for one kind"""
+    height, width = entry.edges.shape
+    if kind == "edges":
+        color = np.broadcast_to(np.array(EDGE_COLOR, np.uint8), (height, width, 3))
+        return _rgba(color, entry.edges)
+    if kind == "gradient":
+        heat = cv2.applyColorMap(entry.gradient, cv2.COLORMAP_JET)[:, :, ::-1]
+        return _rgba(heat, entry.gradient)
+    canvas = np.zeros((height, width, 4), np.uint8)
+    if entry.contour is not None:
+        cv2.drawContours(canvas, [entry.contour], -1, CONTOUR_COLOR + (255,), 1)
+    return canvas
+
+
+def encode_overlay(array: np.ndarray, fmt: str) -> bytes:
+    buffer = io.BytesIO()
+    image = Image.fromarray(array, mode="RGBA")
+    if fmt == "webp":
+        image.save(buffer, format="WEBP", lossless=True, method=4)
+    else:
+        image.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def get_overlay(image_sha256: str, kind: str, fmt: str = "png") -> Optional[bytes]:
+    """Encoded overlay, or None if the image is not (or no longer) cached"""
+    with _cache_lock:
+        entry = _cache.get(image_sha256)
+        if entry is None:
+            return None
+        _cache.move_to_end(image_sha256)
+        data = entry.rendered.get((kind, fmt))
+    if data is None:
+        data = encode_overlay(render_overlay(entry, kind), fmt)
+        with _cache_lock:
+            entry.rendered[(kind, fmt)] = data
+    return data
@@ -0,0 +1,36 @@
+"""
+Periodic maintenance jobs for the app lifespan
+
+run_periodically() runs job(db) every interval_s seconds on the default
+executor, with a fresh session from session_factory each time, so the job
+never blocks the event loop. A failed run is logged and retried at the next
+interval. The audit rollups, archival and chain checkpoints all use it.
+"""
+
+from typing import Any, Callable
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+async def run_periodically(name: str, session_factory, job: Callable[[Any], Any], interval_s: float,
+                           run_first: bool = True):
+    """Run job(db) now (or after one interval if not run_first), then every interval_s seconds"""
+    loop = asyncio.get_running_loop()
+
+    def run_once():
+        db = session_factory()
+        try:
+            job(db)
+        finally:
+            db.close()
+
+    if not run_first:
+        await asyncio.sleep(interval_s)
+    while True:
+        try:
+            await loop.run_in_executor(None, run_once)
+        except Exception:
+            logger.exception(f"{name} failed; retrying next interval")
+        await asyncio.sleep(interval_s)
@@ -0,0 +1,172 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import select, func
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import numpy as np
+from models import Patient, Cycle, Embryo, FeatureVector, Prediction, User
+from aggregates import add_predictions, prediction_values
+from audit_logger import add_user_action
+from auth import CLINICAL_ROLES
+from schemas import AuditLogCreate
+
+# Per-model probability columns on Prediction, keyed by ensemble model name
+MODEL_PROBABILITY_COLUMNS = {
+    'model_1': 'model_1_probability',
+    'model_2': 'model_2_probability',
+    'model_3': 'model_3_probability',
+}
+
+# Stored vectors are float32 little-endian so they can be concatenated and
+# reinterpreted as a matrix without per-row parsing
+FEATURE_DTYPE = np.dtype('<f4')
+
+def encode_features(vector: np.ndarray) -> bytes:
+    """Pack a feature vector as float32 bytes"""
+    return np.ascontiguousarray(vector, dtype=FEATURE_DTYPE).tobytes()
+
+def decode_features(blobs, n_features: int) -> np.ndarray:
+    """Turn a sequence of stored blobs into an (n, n_features) float32 matrix with one copy"""
+    if not blobs:
+        return np.empty((0, n_features), dtype=FEATURE_DTYPE)
+    return np.frombuffer(b"".join(blobs), dtype=FEATURE_DTYPE).reshape(-1, n_features)
+
+def can_create_clinical_records(user: Optional[User]) -> bool:
+    return user is not None and user.is_active and user.role in CLINICAL_ROLES
+
+def get_or_create_embryo(db: Session, user: Optional[User], patient_audit_code: str, cycle_id: str,
+                         embryo_id: str) -> Optional[Embryo]:
+    """
+    Resolve the free-text patient/cycle/embryo identifiers sent with a prediction
+    to an Embryo row. Missing rows are only created for active clinical users
+    (as POST /patients, /cycles and /embryos require), each with its audit entry
+    in the caller's transaction; otherwise returns None and nothing is written.
+    """
+    patient = db.query(Patient).filter(Patient.audit_code == patient_audit_code).first()
+    cycle = embryo = None
+    if patient is not None:
+        cycle = db.query(Cycle).filter(Cycle.patient_id == patient.id, Cycle.cycle_id == cycle_id).first()
+    if cycle is not None:
+        embryo = db.query(Embryo).filter(Embryo.cycle_id == cycle.id, Embryo.embryo_id == embryo_id).first()
+    if embryo is not None:
+        return embryo
+    if not can_create_clinical_records(user):
+        return None
+
+    details = {"source": "prediction"}
+    if patient is None:
+        patient = Patient(audit_code=patient_audit_code)
+        db.add(patient)
+        db.flush()
+        add_user_action(db, user, AuditLogCreate(action="PATIENT_CREATED", patient_audit_code=patient_audit_code,
+                                                 details=details))
+    if cycle is None:
+        cycle = Cycle(patient_id=patient.id, cycle_id=cycle_id)
+        db.add(cycle)
+        db.flush()
+        add_user_action(db, user, AuditLogCreate(action="CYCLE_CREATED", patient_audit_code=patient_audit_code,
+                                                 cycle_id=cycle_id, details=details))
+    embryo = Embryo(cycle_id=cycle.id, embryo_id=embryo_id)
+    db.add(embryo)
+    db.flush()
+    add_user_action(db, user, AuditLogCreate(action="EMBRYO_CREATED", patient_audit_code=patient_audit_code,
+                                             cycle_id=cycle_id, embryo_id=embryo_id, details=details))
+    return embryo
+
+def store_feature_vector(db: Session, embryo: Embryo, image_sha256: str, extractor_version: str,
+                         vector: np.ndarray) -> FeatureVector:
+    """Record the extracted features for an image; re-uploads of the same image are deduplicated"""
+    existing = db.query(FeatureVector).filter(
+        FeatureVector.embryo_id == embryo.id,
+        FeatureVector.image_sha256 == image_sha256,
+        FeatureVector.extractor_version == extractor_version
+    ).first()
+    if existing is not None:
+        return existing
+    feature_vector = FeatureVector(
+        embryo_id=embryo.id,
+        image_sha256=image_sha256,
+        extractor_version=extractor_version,
+        features=encode_features(vector)
+    )
+    db.add(feature_vector)
+    db.flush()
+    return feature_vector
+
+def iter_feature_chunks(db: Session, n_features: int, chunk_size: int = 65536,
+                        extractor_version: Optional[str] = None,
+                        after_id: int = 0) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Stream stored vectors in id order as (feature_vector_ids, embryo_ids, X) chunks.
+    Uses keyset pagination so each chunk is one indexed range scan.
+    """
+    table = FeatureVector.__table__
+    last_id = after_id
+    while True:
+        query = select(table.c.id, table.c.embryo_id, table.c.features).where(table.c.id > last_id)
+        if extractor_version:
+            query = query.where(table.c.extractor_version == extractor_version)
+        rows = db.execute(query.order_by(table.c.id).limit(chunk_size)).all()
+        if not rows:
+            return
+        ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        embryo_ids = np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows))
+        X = decode_features([row[2] for row in rows], n_features)
+        last_id = int(ids[-1])
+        yield ids, embryo_ids, X
+
+def record_prediction(db: Session, embryo: Embryo, result: Dict[str, Any],
+                      feature_vector: Optional[FeatureVector] = None) -> Prediction:
+    """Store an ensemble_predict result as a Prediction row and count it in the aggregates (caller commits)"""
+    per_model = {p['model']: p['probability_good'] for p in result.get('model_predictions', [])}
+    prediction = Prediction(
+        embryo_id=embryo.id,
+        cycle_id=embryo.cycle_id,
+        feature_vector_id=feature_vector.id if feature_vector is not None else None,
+        prediction=result['prediction'],
+        viability_score=result['viability_score'],
+        confidence=result['confidence'],
+        confidence_level=result['confidence_level'],
+        model_version=result.get('model_version', 'ensemble_v1'),
+        ensemble_mode=result.get('ensemble_mode'),
+        **{column: per_model.get(name) for name, column in MODEL_PROBABILITY_COLUMNS.items()}
+    )
+    db.add(prediction)
+    db.flush()
+    # Dashboard aggregates move in the same transaction
+    add_predictions(db, [prediction_values(prediction)])
+    return prediction
+
+def model_probabilities(prediction: Prediction) -> Dict[str, Optional[float]]:
+    return {name: getattr(prediction, column) for name, column in MODEL_PROBABILITY_COLUMNS.items()}
+
+def latest_predictions_for_cycle(db: Session, cycle_pk: int) -> List[Tuple[Prediction, str]]:
+    """
+    Latest prediction per embryo in a cycle as (Prediction, embryo code) pairs.
+    A single statement: the window function ranks rows found through the
+    (cycle_id, created_at) index.
+    """
+    ranked = select(
+        Prediction.id.label("id"),
+        func.row_number().over(
+            partition_by=Prediction.embryo_id,
+            order_by=(Prediction.created_at.desc(), Prediction.id.desc())
+        ).label("rank")
+    ).where(Prediction.cycle_id == cycle_pk).subquery()
+
+    return (
+        db.query(Prediction, Embryo.embryo_id)
+        .join(ranked, ranked.c.id == Prediction.id)
+        .join(Embryo, Embryo.id == Prediction.embryo_id)
+        .filter(ranked.c.rank == 1)
+        .order_by(Embryo.embryo_id)
+        .all()
+    )
+
+def prediction_history(db: Session, embryo_pk: int, limit: int = 50) -> List[Prediction]:
+    """Most recent predictions for one embryo via the (embryo_id, created_at) index"""
+    return (
+        db.query(Prediction)
+        .filter(Prediction.embryo_id == embryo_pk)
+        .order_by(Prediction.created_at.desc(), Prediction.id.desc())
+        .limit(limit)
+        .all()
+    )
@@ -0,0 +1,114 @@
+"""
+Server-side embryo ranking for a cycle
+
+Ranks each embryo by its latest stored prediction, after applying the most
+recent AI override logged for it. Embryos predicted "good" come first, then
+by viability score, with confidence breaking ties. Rankings are cached per
+cycle in process and invalidated when a prediction or override arrives.
+"""
+
+from sqlalchemy.orm import Session
+from typing import Any, Dict, List, Optional, Tuple
+import heapq
+import threading
+from models import AuditLog, Cycle, Patient
+from prediction_store import latest_predictions_for_cycle
+
+_ranking_cache: Dict[int, Dict[Optional[int], List[Dict[str, Any]]]] = {}
+_ranking_generation: Dict[int, int] = {}
+_ranking_lock = threading.Lock()
+
+def invalidate_cycle_ranking(cycle_pk: int):
+    with _ranking_lock:
+        _ranking_cache.pop(cycle_pk, None)
+        _ranking_generation[cycle_pk] = _ranking_generation.get(cycle_pk, 0) + 1
+
+def invalidate_cycle_ranking_by_codes(db: Session, patient_audit_code: str, cycle_id: str):
+    """Invalidate using the free-text codes sent with overrides"""
+    cycle = (
+        db.query(Cycle)
+        .join(Patient, Patient.id == Cycle.patient_id)
+        .filter(Patient.audit_code == patient_audit_code, Cycle.cycle_id == cycle_id)
+        .first()
+    )
+    if cycle is not None:
+        invalidate_cycle_ranking(cycle.id)
+
+def latest_overrides(db: Session, cycle: Cycle) -> Dict[str, Dict[str, Any]]:
+    """Most recent AI_OVERRIDE details per embryo code for a cycle"""
+    rows = (
+        db.query(AuditLog.embryo_id, AuditLog.details)
+        .filter(
+            AuditLog.action == "AI_OVERRIDE",
+            AuditLog.patient_audit_code == cycle.patient.audit_code,
+            AuditLog.cycle_id == cycle.cycle_id
+        )
+        .order_by(AuditLog.timestamp, AuditLog.id)
+        .all()
+    )
+    # Later rows win
+    return {embryo_code: details or {} for embryo_code, details in rows}
+
+def apply_override(prediction: str, viability_score: float, override: Optional[Dict[str, Any]]) -> Tuple[str, float]:
+    """
+    An override replaces the label ("good"/"not_good") or, when a number is
+    sent, the viability score (0-100)
+    """
+    if not override:
+        return prediction, viability_score
+    value = str(override.get("overridden_prediction", "")).strip()
+    if value in ("good", "not_good"):
+        return value, viability_score
+    try:
+        score = min(max(float(value), 0.0), 100.0)
+    except ValueError:
+        return prediction, viability_score
+    return ("good" if score > 50 else "not_good"), score
+
+def ranking_key(entry: Dict[str, Any]) -> Tuple[int, float, float]:
+    return (entry["prediction"] == "good", entry["viability_score"], entry["confidence"])
+
+def compute_cycle_ranking(db: Session, cycle: Cycle, top_k: Optional[int] = None) -> List[Dict[str, Any]]:
+    overrides = latest_overrides(db, cycle)
+    entries = []
+    for prediction, embryo_code in latest_predictions_for_cycle(db, cycle.id):
+        override = overrides.get(embryo_code)
+        label, score = apply_override(prediction.prediction, prediction.viability_score, override)
+        entries.append({
+            "embryo_id": prediction.embryo_id,
+            "embryo_code": embryo_code,
+            "prediction_id": prediction.id,
+            "prediction": label,
+            "viability_score": score,
+            "confidence": prediction.confidence,
+            "confidence_level": prediction.confidence_level,
+            "ai_prediction": prediction.prediction,
+            "ai_viability_score": prediction.viability_score,
+            "overridden": override is not None,
+            "override_reason": override.get("reason") if override else None,
+            "model_version": prediction.model_version,
+            "predicted_at": prediction.created_at,
+        })
+
+    if top_k is not None and top_k < len(entries):
+        ranked = heapq.nlargest(top_k, entries, key=ranking_key)
+    else:
+        ranked = sorted(entries, key=ranking_key, reverse=True)
+    for rank, entry in enumerate(ranked, 1):
+        entry["rank"] = rank
+    return ranked
+
+def get_cycle_ranking(db: Session, cycle: Cycle, top_k: Optional[int] = None) -> Tuple[List[Dict[str, Any]], bool]:
+    """Return (ranking, served_from_cache)"""
+    with _ranking_lock:
+        cached = _ranking_cache.get(cycle.id, {}).get(top_k)
+        generation = _ranking_generation.get(cycle.id, 0)
+    if cached is not None:
+        return cached, True
+
+    ranked = compute_cycle_ranking(db, cycle, top_k)
+    with _ranking_lock:
+        # Skip caching if a prediction/override invalidated the cycle meanwhile
+        if _ranking_generation.get(cycle.id, 0) == generation:
+            _ranking_cache.setdefault(cycle.id, {})[top_k] = ranked
+    return ranked, False
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Batch rescoring of stored feature vectors
+
+Streams the feature_vectors table in large chunks and scores each chunk as a
+single matrix with any registered model set, so a clinic's history can be
+rescored when a new model version ships without re-uploading images.
+
+Usage (from the backend folder):
+    python rescore.py --model-set ensemble_v1 --output rescored.csv
+    python rescore.py --model-files new_1.pkl,new_2.pkl,new_3.pkl --model-set ensemble_v2
+    python rescore.py --model-set ensemble_v1 --explain --output explained.csv
+    python rescore.py --list
+"""
+
+import argparse
+import csv
+import os
+import sys
+import time
+from typing import List, Optional
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def main_cli(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Rescore stored feature vectors with a model set")
+    parser.add_argument("--model-set", default="ensemble_v1", help="Registered model set to score with")
+    parser.add_argument("--model-files", default=None,
+                        help="Comma-separated .pkl files to register as --model-set before scoring")
+    parser.add_argument("--extractor-version", default=None,
+                        help="Only rescore vectors from this extractor version (default: current)")
+    parser.add_argument("--chunk-size", type=int, default=65536)
+    parser.add_argument("--output", default="rescored.csv", help="CSV of per-vector scores")
+    parser.add_argument("--explain", action="store_true",
+                        help="Add per-feature contribution columns (tree ensembles only)")
+    parser.add_argument("--list", action="store_true", help="List registered model sets and exit")
+    args = parser.parse_args(argv)
+    args.output = os.path.abspath(args.output)
+    model_files = [os.path.abspath(p) for p in args.model_files.split(",")] if args.model_files else None
+
+    # Model paths in main.py are relative to the backend folder
+    os.chdir(BACKEND_DIR)
+    sys.path.insert(0, BACKEND_DIR)
+    import main
+    import model_registry
+    from explainability import explain_batch, prepare_explainer
+    from database import SessionLocal, engine
+    from models import Base
+    from prediction_store import iter_feature_chunks
+
+    Base.metadata.create_all(bind=engine)
+    main.load_models()
+    if model_files:
+        model_registry.load_model_set(args.model_set, model_files)
+    if args.list:
+        for name in model_registry.list_model_sets():
+            print(name)
+        return 0
+
+    extractor_version = args.extractor_version or main.FEATURE_EXTRACTOR_VERSION
+    n_features = len(main.FEATURE_NAMES)
+    model_set = model_registry.get_model_set(args.model_set)
+    if args.explain and prepare_explainer(args.model_set, model_set, n_features) is None:
+        print(f"Model set '{args.model_set}' cannot be explained (not tree ensembles)")
+        return 1
+
+    db = SessionLocal()
+    total = 0
+    score_seconds = 0.0
+    started = time.perf_counter()
+    try:
+        with open(args.output, "w", newline="") as f:
+            writer = csv.writer(f)
+            header = ["feature_vector_id", "embryo_id", "model_set", "probability_good", "prediction"]
+            if args.explain:
+                header += ["base_value"] + [f"contribution_{name}" for name in main.FEATURE_NAMES]
+            writer.writerow(header)
+            for ids, embryo_ids, X in iter_feature_chunks(db, n_features, args.chunk_size, extractor_version):
+                chunk_started = time.perf_counter()
+                probability = model_registry.predict_matrix(args.model_set, X.astype(np.float64))
+                score_seconds += time.perf_counter() - chunk_started
+                labels = np.where(probability > 0.5, "good", "not_good")
+                columns = [ids.tolist(), embryo_ids.tolist(), [args.model_set] * len(ids),
+                           np.round(probability, 6).tolist(), labels.tolist()]
+                if args.explain:
+                    base, contributions = explain_batch(args.model_set, X)
+                    columns += [np.round(base, 6).tolist()] + np.round(contributions, 6).T.tolist()
+                writer.writerows(zip(*columns))
+                total += len(ids)
+                print(f"   rescored {total} vectors...", file=sys.stderr)
+    finally:
+        db.close()
+
+    elapsed = time.perf_counter() - started
+    rate = total / elapsed if elapsed > 0 else 0.0
+    print(f"Rescored {total} vectors with '{args.model_set}' in {elapsed:.2f}s "
+          f"({rate:,.0f} vectors/s, {score_seconds:.2f}s in models) -> {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,258 @@
+"""
+Resumable chunked uploads for large files (e.g. incubator time-lapse exports)
+
+Protocol:
+    POST /uploads                              create a session (metadata + total size)
+    PUT  /uploads/{id}/chunks/{index}?offset=N  write one chunk at a byte offset
+    GET  /uploads/{id}                         received and missing byte ranges
+    POST /uploads/{id}/finalize                predict from the assembled file
+
+Chunks stream straight into a preallocated spool file at their offset, so a
+dropped connection only loses the chunk in flight and no request holds more
+than one chunk. The SHA-256 is computed incrementally over the contiguous
+prefix: in-order chunks are hashed as they stream in, and gaps filled out of
+order are caught up from the spool file. Spool writes, hashing and catch-up
+reads run on the thread pool, so a large chunk never blocks the event loop.
+"""
+
+from datetime import datetime, timedelta
+from sqlalchemy.orm import Session
+from typing import Dict, List, Optional, Tuple
+import hashlib
+import os
+import threading
+
+from fastapi import HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+
+from models import UploadSession, User
+from schemas import PredictionRequestData
+
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "upload_spool"))
+MAX_RESUMABLE_UPLOAD_BYTES = int(os.getenv("MAX_RESUMABLE_UPLOAD_MB", "2048")) * 1024 * 1024
+DEFAULT_CHUNK_BYTES = 8 * 1024 * 1024
+MAX_CHUNK_BYTES = int(os.getenv("MAX_UPLOAD_CHUNK_MB", "32")) * 1024 * 1024
+UPLOAD_SESSION_TTL = timedelta(hours=int(os.getenv("UPLOAD_SESSION_TTL_HOURS", "24")))
+HASH_READ_BYTES = 1024 * 1024
+SPOOL_WRITE_BYTES = 1024 * 1024  # Received data is handed to the thread pool in blocks of about this size
+
+# Per-session incremental hash state: session id -> [hasher, hashed_offset].
+# Lost on restart, in which case finalize rehashes from the spool file.
+_hash_state: Dict[str, list] = {}
+_session_locks: Dict[str, threading.Lock] = {}
+_state_lock = threading.Lock()
+
+
+def spool_path(session_id: str) -> str:
+    return os.path.join(UPLOAD_SPOOL_DIR, f"{session_id}.part")
+
+
+def _session_lock(session_id: str) -> threading.Lock:
+    with _state_lock:
+        return _session_locks.setdefault(session_id, threading.Lock())
+
+
+def _forget(session_id: str):
+    with _state_lock:
+        _hash_state.pop(session_id, None)
+        _session_locks.pop(session_id, None)
+
+
+def merge_range(ranges: List[List[int]], start: int, end: int) -> List[List[int]]:
+    """Insert [start, end) into sorted, non-overlapping ranges, merging neighbours"""
+    merged = []
+    for low, high in sorted(ranges + [[start, end]]):
+        if merged and low <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], high)
+        else:
+            merged.append([low, high])
+    return merged
+
+
+def missing_ranges(ranges: List[List[int]], total_size: int) -> List[List[int]]:
+    missing = []
+    position = 0
+    for low, high in ranges:
+        if low > position:
+            missing.append([position, low])
+        position = max(position, high)
+    if position < total_size:
+        missing.append([position, total_size])
+    return missing
+
+
+def expire_stale_sessions(db: Session):
+    """Drop spool files of open sessions untouched for UPLOAD_SESSION_TTL"""
+    cutoff = datetime.utcnow() - UPLOAD_SESSION_TTL
+    stale = db.query(UploadSession).filter(UploadSession.status == "open", UploadSession.updated_at < cutoff).all()
+    for session in stale:
+        if os.path.exists(spool_path(session.id)):
+            os.remove(spool_path(session.id))
+        session.status = "expired"
+        _forget(session.id)
+    if stale:
+        db.commit()
+
+
+def create_session(db: Session, user: Optional[User], metadata: PredictionRequestData, total_size: int,
+                   filename: Optional[str] = None, chunk_size: Optional[int] = None) -> UploadSession:
+    if total_size <= 0:
+        raise HTTPException(status_code=400, detail="total_size must be positive")
+    if total_size > MAX_RESUMABLE_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds the {MAX_RESUMABLE_UPLOAD_BYTES // (1024 * 1024)} MB limit")
+    chunk_size = min(chunk_size or DEFAULT_CHUNK_BYTES, MAX_CHUNK_BYTES)
+
+    expire_stale_sessions(db)
+    session = UploadSession(
+        user_id=user.id if user else None,
+        filename=filename,
+        total_size=total_size,
+        chunk_size=chunk_size,
+        prediction_data=metadata.model_dump(),
+        received_ranges=[],
+        received_bytes=0
+    )
+    db.add(session)
+    db.flush()
+
+    # Preallocate (sparse) so chunks can be written at any offset
+    os.makedirs(UPLOAD_SPOOL_DIR, exist_ok=True)
+    with open(spool_path(session.id), "wb") as f:
+        f.truncate(total_size)
+    db.commit()
+    return session
+
+
+def get_session(db: Session, session_id: str, user: Optional[User], require_open: bool = True) -> UploadSession:
+    session = db.query(UploadSession).filter(UploadSession.id == session_id).first()
+    if session is None:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    if session.user_id is not None and (user is None or user.id != session.user_id):
+        raise HTTPException(status_code=403, detail="Upload session belongs to another user")
+    if require_open and session.status != "open":
+        raise HTTPException(status_code=409, detail=f"Upload session is {session.status}")
+    return session
+
+
+def _catch_up_hash(session: UploadSession, ranges: List[List[int]]):
+    """Extend the incremental hash over any received bytes contiguous with the hashed prefix"""
+    with _state_lock:
+        state = _hash_state.setdefault(session.id, [hashlib.sha256(), 0])
+    hasher, offset = state
+    contiguous_end = ranges[0][1] if ranges and ranges[0][0] == 0 else 0
+    if contiguous_end <= offset:
+        return
+    with open(spool_path(session.id), "rb") as f:
+        f.seek(offset)
+        while offset < contiguous_end:
+            block = f.read(min(HASH_READ_BYTES, contiguous_end - offset))
+            if not block:
+                break
+            hasher.update(block)
+            offset += len(block)
+    state[1] = offset
+
+
+async def write_chunk(db: Session, session: UploadSession, index: int, offset: int, request: Request,
+                      chunk_sha256: Optional[str] = None) -> UploadSession:
+    """Stream one chunk into the spool file at `offset` and record its byte range"""
+    if offset < 0 or offset >= session.total_size:
+        raise HTTPException(status_code=416, detail=f"Offset {offset} is outside the {session.total_size}-byte upload")
+    limit = min(session.total_size - offset, MAX_CHUNK_BYTES)
+    declared_length = request.headers.get("content-length")
+    if declared_length and declared_length.isdigit() and int(declared_length) > limit:
+        raise HTTPException(status_code=413, detail=f"Chunk {index} is larger than the {limit} bytes allowed at offset {offset}")
+
+    lock = _session_lock(session.id)
+    with _state_lock:
+        state = _hash_state.get(session.id)
+    # In-order chunks extend the running hash while they stream
+    inline_hasher = hashlib.sha256() if state is None or state[1] != offset else state[0].copy()
+    chunk_hasher = hashlib.sha256() if chunk_sha256 else None
+    written = 0
+
+    def write_block(f, block: bytes):
+        f.write(block)
+        inline_hasher.update(block)
+        if chunk_hasher is not None:
+            chunk_hasher.update(block)
+
+    f = await run_in_threadpool(open, spool_path(session.id), "r+b")
+    try:
+        await run_in_threadpool(f.seek, offset)
+        pending = bytearray()
+        async for data in request.stream():
+            if written + len(pending) + len(data) > limit:
+                raise HTTPException(status_code=413, detail=f"Chunk {index} is larger than the {limit} bytes allowed at offset {offset}")
+            pending += data
+            if len(pending) >= SPOOL_WRITE_BYTES:
+                await run_in_threadpool(write_block, f, bytes(pending))
+                written += len(pending)
+                pending.clear()
+        if pending:
+            await run_in_threadpool(write_block, f, bytes(pending))
+            written += len(pending)
+    finally:
+        await run_in_threadpool(f.close)
+    if written == 0:
+        raise HTTPException(status_code=400, detail=f"Chunk {index} is empty")
+    if chunk_hasher is not None and chunk_hasher.hexdigest() != chunk_sha256.lower():
+        raise HTTPException(status_code=400, detail=f"Chunk {index} failed its SHA-256 check; resend it")
+
+    def record():
+        with lock:
+            db.refresh(session)
+            ranges = merge_range([list(r) for r in session.received_ranges or []], offset, offset + written)
+            session.received_ranges = ranges
+            session.received_bytes = sum(high - low for low, high in ranges)
+            with _state_lock:
+                state = _hash_state.get(session.id)
+                if state is not None and state[1] == offset:
+                    _hash_state[session.id] = [inline_hasher, offset + written]
+                elif state is None and offset == 0:
+                    _hash_state[session.id] = [inline_hasher, written]
+            # May read back the rest of the spool file when this chunk filled a gap
+            _catch_up_hash(session, ranges)
+            db.commit()
+
+    await run_in_threadpool(record)
+    return session
+
+
+def session_status(session: UploadSession) -> Dict:
+    ranges = session.received_ranges or []
+    return {
+        "upload_id": session.id,
+        "status": session.status,
+        "filename": session.filename,
+        "total_size": session.total_size,
+        "chunk_size": session.chunk_size,
+        "received_bytes": session.received_bytes,
+        "received_ranges": ranges,
+        "missing_ranges": missing_ranges(ranges, session.total_size),
+        "sha256": session.sha256,
+    }
+
+
+def assemble(db: Session, session: UploadSession) -> Tuple[str, str]:
+    """Check the upload is complete and return (spool path, sha256); may hash from disk, so call off the event loop"""
+    ranges = session.received_ranges or []
+    if missing_ranges(ranges, session.total_size):
+        raise HTTPException(status_code=409, detail="Upload is incomplete; query the session for missing ranges")
+    with _session_lock(session.id):
+        _catch_up_hash(session, ranges)
+        with _state_lock:
+            hasher, offset = _hash_state[session.id]
+    if offset != session.total_size:
+        raise HTTPException(status_code=500, detail="Upload hash is incomplete")
+    return spool_path(session.id), hasher.hexdigest()
+
+
+def close_session(db: Session, session: UploadSession, status: str, sha256: Optional[str] = None):
+    """Mark a session finalized/aborted and drop whatever is left of its spool file"""
+    session.status = status
+    session.sha256 = sha256
+    db.commit()
+    if os.path.exists(spool_path(session.id)):
+        os.remove(spool_path(session.id))
+    _forget(session.id)
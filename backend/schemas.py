@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, List, Dict, Any
 from datetime import datetime
 from datetime import datetime
@@ -75,6 +75,50 @@ class AuditLogResponse(BaseModel):
     embryo_id: Optional[str] = None
     details: Optional[Dict[str, Any]] = None
 
+class AuditStatsGroup(BaseModel):
+    action: Optional[str] = None
+    user_id: Optional[int] = None
+    username: Optional[str] = None
+    day: Optional[str] = None
+    hour: Optional[datetime] = None
+    model_version: Optional[str] = None
+    count: int
+
+class AuditStatsResponse(BaseModel):
+    start_date: Optional[datetime] = None
+    end_date: Optional[datetime] = None
+    group_by: List[str]
+    total: int
+    groups: List[AuditStatsGroup]
+    high_water_id: int  # Entries up to this id were served from the hourly rollups
+    raw_rows: int  # Entries read from the raw table (current tail and partial edge hours)
+
+class AuditChainFailure(BaseModel):
+    id: Optional[int] = None
+    reason: str
+
+class AuditChainVerificationResponse(BaseModel):
+    ok: bool
+    full: bool
+    signed: bool  # False without AUDIT_CHAIN_KEY: checkpoints ignored, checked from genesis
+    checked_rows: int
+    chained_rows: int
+    from_id: Optional[int] = None
+    to_id: Optional[int] = None
+    checkpoint_id: Optional[int] = None  # Checkpoint an incremental check started from
+    head_hash: Optional[str] = None
+    failure: Optional[AuditChainFailure] = None
+    seconds: float
+    rows_per_second: float
+
+class AuditChainCheckpointResponse(BaseModel):
+    id: int
+    last_id: int
+    head_hash: str
+    chained_rows: int
+    created_at: datetime
+    verification: AuditChainVerificationResponse
+
 # Note schemas
 class NoteCreate(BaseModel):
     patient_audit_code: Optional[str] = None
@@ -93,6 +137,18 @@ class NoteResponse(BaseModel):
     note_text: str
     timestamp: datetime
 
+class NotePageResponse(BaseModel):
+    notes: List[NoteResponse]
+    next_cursor: Optional[str] = None  # Pass back as ?cursor= for the next page; None on the last page
+
+class NoteSearchResult(NoteResponse):
+    rank: float  # Higher is more relevant
+
+class NoteSearchResponse(BaseModel):
+    query: str
+    results: List[NoteSearchResult]
+    next_cursor: Optional[str] = None
+
 # Search schemas
 class AuditSearch(BaseModel):
     patient_audit_code: Optional[str] = None
@@ -111,6 +167,8 @@ class AIPredictionLog(BaseModel):
     confidence_score: float
     risk_indicators: Optional[Dict[str, Any]] = None
     abnormal_flags: Optional[List[str]] = None
+    ensemble_mode: Optional[str] = None
+    models_consulted: Optional[List[str]] = None
 
 class AIOverrideLog(BaseModel):
     patient_audit_code: str
@@ -118,4 +176,118 @@ class AIOverrideLog(BaseModel):
     embryo_id: str
     original_prediction: str
     overridden_prediction: str
-    reason: str
\ No newline at end of file
+    reason: str
+
+# Metadata sent as the prediction_data form field of /predict
+class PredictionRequestData(BaseModel):
+    patient_audit_code: str = Field(min_length=1, max_length=128)
+    cycle_id: str = Field(min_length=1, max_length=128)
+    embryo_id: str = Field(min_length=1, max_length=128)
+
+# Metadata for POST /predict/stream, where each file part is named after its embryo
+class CyclePredictionRequestData(BaseModel):
+    patient_audit_code: str = Field(min_length=1, max_length=128)
+    cycle_id: str = Field(min_length=1, max_length=128)
+
+# Stored prediction schemas
+class PredictionRecordResponse(BaseModel):
+    id: int
+    embryo_id: int
+    embryo_code: str
+    cycle_id: int
+    prediction: str
+    viability_score: float
+    confidence: float
+    confidence_level: str
+    model_probabilities: Dict[str, Optional[float]]
+    model_version: str
+    ensemble_mode: Optional[str] = None
+    created_at: datetime
+
+# Cycle ranking schemas
+class RankedEmbryo(BaseModel):
+    rank: int
+    embryo_id: int
+    embryo_code: str
+    prediction_id: int
+    prediction: str
+    viability_score: float
+    confidence: float
+    confidence_level: str
+    ai_prediction: str
+    ai_viability_score: float
+    overridden: bool
+    override_reason: Optional[str] = None
+    model_version: str
+    predicted_at: datetime
+
+class CycleRankingResponse(BaseModel):
+    cycle_id: int
+    total_ranked: int
+    cached: bool
+    ranking: List[RankedEmbryo]
+
+# Dashboard aggregate schemas
+class AggregateStatsResponse(BaseModel):
+    scope: str
+    key: str
+    prediction_count: int
+    good_count: int
+    good_rate: float
+    mean_viability: float
+    std_viability: float
+    mean_confidence: float
+    confidence_levels: Dict[str, int]
+    override_count: int
+    override_rate: float
+    updated_at: Optional[datetime] = None
+
+# Stored image schemas
+class StoredImageResponse(BaseModel):
+    sha256: str
+    content_type: str
+    size_bytes: int
+    width: Optional[int] = None
+    height: Optional[int] = None
+    linked_at: datetime
+    urls: Dict[str, str]
+
+# Resumable upload schemas
+class UploadSessionCreate(BaseModel):
+    prediction_data: PredictionRequestData
+    total_size: int
+    filename: Optional[str] = None
+    chunk_size: Optional[int] = None
+
+class UploadSessionResponse(BaseModel):
+    upload_id: str
+    status: str
+    filename: Optional[str] = None
+    total_size: int
+    chunk_size: int
+    received_bytes: int
+    received_ranges: List[List[int]]
+    missing_ranges: List[List[int]]
+    sha256: Optional[str] = None
+
+# Focal stack schemas
+class FocalPlaneResult(BaseModel):
+    plane: str
+    model_set: Optional[str] = None
+    status: str  # scored, skipped, failed
+    probability_good: Optional[float] = None
+    model_probabilities: Dict[str, float] = {}
+    latency_ms: float
+    reason: Optional[str] = None
+    image_sha256: Optional[str] = None
+
+class FocalStackResponse(BaseModel):
+    prediction: str
+    viability_score: float
+    confidence: float
+    confidence_level: str
+    fusion: str
+    fused_planes: List[str]
+    planes: List[FocalPlaneResult]
+    model_version: str
+    latency_ms: float
@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from admission import PRIORITY_ANONYMOUS, PRIORITY_AUTHENTICATED, PRIORITY_CLINICAL, AdmissionController
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_waiters_are_admitted_by_priority_then_arrival():
+    async def run():
+        controller = AdmissionController(max_concurrent=1, max_queue=4, queue_timeout_s=5)
+        await controller.acquire(PRIORITY_CLINICAL)
+        order = []
+
+        async def wait(name, priority):
+            await controller.acquire(priority)
+            order.append(name)
+
+        tasks = [asyncio.create_task(wait(name, priority)) for name, priority in [
+            ("anonymous", PRIORITY_ANONYMOUS), ("authenticated", PRIORITY_AUTHENTICATED),
+            ("clinical", PRIORITY_CLINICAL), ("clinical later", PRIORITY_CLINICAL)]]
+        await settle()
+        for _ in tasks:
+            controller.release()
+            await settle()
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(run()) == ["clinical", "clinical later", "authenticated", "anonymous"]
+
+
+def test_full_queue_displaces_the_newest_lower_priority_waiter():
+    async def run():
+        controller = AdmissionController(max_concurrent=1, max_queue=2, queue_timeout_s=5)
+        await controller.acquire(PRIORITY_CLINICAL)
+        older = asyncio.create_task(controller.acquire(PRIORITY_ANONYMOUS))
+        newer = asyncio.create_task(controller.acquire(PRIORITY_ANONYMOUS))
+        await settle()
+
+        # Nobody ranks below an anonymous arrival, so it is turned away up front
+        with pytest.raises(HTTPException) as rejected:
+            controller.check(PRIORITY_ANONYMOUS)
+        assert rejected.value.status_code == 429
+        assert "Retry-After" in rejected.value.headers
+
+        clinical = asyncio.create_task(controller.acquire(PRIORITY_CLINICAL))
+        await settle()
+        with pytest.raises(HTTPException) as displaced:
+            await newer
+        assert displaced.value.status_code == 429
+        assert not older.done()
+        assert controller.rejected["displaced"] == 1
+
+        controller.release()
+        await clinical
+        controller.release()
+        await older
+        return controller.active
+
+    assert asyncio.run(run()) == 1
+
+
+def test_waiter_times_out_with_429():
+    async def run():
+        controller = AdmissionController(max_concurrent=1, max_queue=2, queue_timeout_s=0.05)
+        await controller.acquire(PRIORITY_CLINICAL)
+        with pytest.raises(HTTPException) as timed_out:
+            await controller.acquire(PRIORITY_CLINICAL)
+        assert timed_out.value.status_code == 429
+        return controller.stats()
+
+    stats = asyncio.run(run())
+    assert stats["rejected"]["timeout"] == 1
+    assert stats["queue_depth"] == 0
+    assert stats["active"] == 1
+
+
+def test_cancelled_holders_and_waiters_free_their_slots():
+    async def run():
+        controller = AdmissionController(max_concurrent=1, max_queue=2, queue_timeout_s=5)
+        entered = asyncio.Event()
+
+        async def hold():
+            async with controller.slot(PRIORITY_CLINICAL):
+                entered.set()
+                await asyncio.sleep(60)
+
+        holder = asyncio.create_task(hold())
+        await entered.wait()
+        waiter = asyncio.create_task(controller.acquire(PRIORITY_CLINICAL))
+        await settle()
+        assert controller.stats()["queue_depth"] == 1
+
+        # A cancelled waiter leaves the queue without taking a slot
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert controller.stats()["queue_depth"] == 0
+
+        # Cancelling the holder (e.g. the client went away) releases its slot
+        holder.cancel()
+        await asyncio.gather(holder, return_exceptions=True)
+        assert controller.active == 0
+
+        # A queued slot() cancelled as it is granted does not run its body and gives the slot back
+        await controller.acquire(PRIORITY_CLINICAL)
+        entered.clear()
+        granted = asyncio.create_task(hold())
+        await settle()
+        controller.release()
+        granted.cancel()
+        await asyncio.gather(granted, return_exceptions=True)
+        assert granted.cancelled() and not entered.is_set()
+        return controller.active
+
+    assert asyncio.run(run()) == 0
@@ -0,0 +1,182 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, func, select, text
+from sqlalchemy.orm import sessionmaker
+
+import audit_archive
+from audit_chain import (
+    CHAIN_NAME, GENESIS_HASH, ChainKeyNotConfigured, create_checkpoint, insert_entries, verify_chain
+)
+from audit_logger import add_user_action, audit_fields
+from models import AuditChainCheckpoint, AuditChainState, AuditLog, Base, User
+from schemas import AuditLogCreate
+
+LINK_BROKEN = "link to the previous entry is broken (an entry was removed, reordered or altered)"
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setenv("AUDIT_CHAIN_KEY", "test-chain-key")
+    monkeypatch.setattr(audit_archive, "AUDIT_ARCHIVE_DIR", str(tmp_path / "archive"))
+    engine = create_engine(f"sqlite:///{tmp_path / 'audit.db'}")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    session.add(User(username="auditor", hashed_password="-", role="Auditor"))
+    session.commit()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def user(db):
+    return db.query(User).one()
+
+
+def append(db, count, action="LOGIN"):
+    for i in range(count):
+        add_user_action(db, user(db), AuditLogCreate(action=action, details={"n": i}))
+    db.commit()
+
+
+def insert(db, count, timestamp=None):
+    rows = [{"user_id": user(db).id, "action": "LOGOUT", "details": {"n": i}, **audit_fields("LOGOUT", {"n": i})}
+            for i in range(count)]
+    if timestamp is not None:
+        for row in rows:
+            row["timestamp"] = timestamp
+    insert_entries(db, rows)
+    db.commit()
+
+
+def row_ids(db):
+    return db.execute(select(AuditLog.id).order_by(AuditLog.id)).scalars().all()
+
+
+def tamper(db, statement, **params):
+    db.execute(text(statement), params)
+    db.commit()
+    db.expire_all()
+
+
+def test_append_and_insert_extend_one_chain_in_id_order(db):
+    append(db, 3)
+    insert(db, 4)
+    append(db, 2)
+
+    logs = db.query(AuditLog).order_by(AuditLog.id).all()
+    assert logs[0].prev_hash == GENESIS_HASH
+    assert all(later.prev_hash == earlier.row_hash for earlier, later in zip(logs, logs[1:]))
+    state = db.get(AuditChainState, CHAIN_NAME)
+    assert (state.last_id, state.head_hash) == (logs[-1].id, logs[-1].row_hash)
+
+    result = verify_chain(db, full=True, chunk_size=2)
+    assert result["ok"] and result["signed"]
+    assert result["checked_rows"] == result["chained_rows"] == 9
+
+
+def test_edited_entry_is_reported(db):
+    append(db, 5)
+    edited = row_ids(db)[2]
+    tamper(db, "UPDATE audit_logs SET action = 'LOGOUT' WHERE id = :id", id=edited)
+
+    result = verify_chain(db, full=True)
+    assert not result["ok"]
+    assert result["failure"] == {"id": edited, "reason": "entry content does not match its hash"}
+
+
+def test_deleted_entries_are_reported(db):
+    append(db, 5)
+    ids = row_ids(db)
+    tamper(db, "DELETE FROM audit_logs WHERE id = :id", id=ids[2])
+    assert verify_chain(db, full=True)["failure"] == {"id": ids[3], "reason": LINK_BROKEN}
+
+    # Removing the newest entries leaves the recorded head unreachable
+    tamper(db, "DELETE FROM audit_logs WHERE id >= :id", id=ids[2])
+    assert verify_chain(db, full=True)["failure"] == {
+        "id": ids[2], "reason": "entries are missing before the chain head"}
+
+
+def test_incremental_check_starts_at_the_checkpoint(db):
+    append(db, 5)
+    checkpoint = create_checkpoint(db, verify_chain(db))
+    db.commit()
+    append(db, 3)
+
+    result = verify_chain(db)
+    assert result["ok"]
+    assert result["checkpoint_id"] == checkpoint.id
+    assert result["checked_rows"] == 3
+    assert result["chained_rows"] == 8
+
+    # Only a full check reads the rows behind the checkpoint
+    edited = row_ids(db)[1]
+    tamper(db, "UPDATE audit_logs SET details = '{}' WHERE id = :id", id=edited)
+    assert verify_chain(db)["ok"]
+    assert verify_chain(db, full=True)["failure"] == {"id": edited, "reason": "entry content does not match its hash"}
+
+
+def test_forged_checkpoint_is_not_trusted(db):
+    append(db, 5)
+    checkpoint = create_checkpoint(db, verify_chain(db))
+    db.commit()
+    tamper(db, "UPDATE audit_chain_checkpoints SET chained_rows = chained_rows + 1")
+
+    result = verify_chain(db)
+    assert result["ok"]
+    assert result["checkpoint_id"] is None
+    assert result["checked_rows"] == 5
+    assert verify_chain(db, full=True)["failure"] == {
+        "id": checkpoint.last_id, "reason": f"checkpoint {checkpoint.id} does not match the chain"}
+
+
+def test_checkpoints_signed_with_another_key_are_ignored(db, monkeypatch):
+    append(db, 5)
+    create_checkpoint(db, verify_chain(db))
+    db.commit()
+    monkeypatch.setenv("AUDIT_CHAIN_KEY", "another-key")
+
+    result = verify_chain(db)
+    assert result["ok"]
+    assert result["checkpoint_id"] is None
+    assert result["checked_rows"] == 5
+
+
+def test_without_a_key_verification_is_unsigned(db, monkeypatch):
+    append(db, 5)
+    create_checkpoint(db, verify_chain(db))
+    db.commit()
+    monkeypatch.delenv("AUDIT_CHAIN_KEY")
+
+    result = verify_chain(db)
+    assert result["ok"] and not result["signed"]
+    assert result["checkpoint_id"] is None
+    assert result["checked_rows"] == 5
+    with pytest.raises(ChainKeyNotConfigured):
+        create_checkpoint(db, result)
+
+
+def test_archived_and_hot_rows_verify_as_one_chain(db):
+    old = datetime.utcnow() - timedelta(days=400)
+    insert(db, 30, timestamp=old)
+    append(db, 5)
+    checkpoint = create_checkpoint(db, verify_chain(db))
+    db.commit()
+
+    archived = audit_archive.archive_audit_logs(db, datetime.utcnow() - timedelta(days=90), segment_rows=7)
+    assert archived["rows"] == 30
+    assert archived["segments"] == 5
+    assert db.execute(select(func.count(AuditLog.id))).scalar() == 5
+    append(db, 2)
+
+    full = verify_chain(db, full=True, chunk_size=3)
+    assert full["ok"]
+    assert full["checked_rows"] == 37
+    incremental = verify_chain(db)
+    assert incremental["checkpoint_id"] == checkpoint.id
+    assert incremental["checked_rows"] == 2
+
+    # An entry removed from the hot table right after the archived ones breaks the link
+    first_hot = row_ids(db)[0]
+    tamper(db, "DELETE FROM audit_logs WHERE id = :id", id=first_hot)
+    assert verify_chain(db, full=True)["failure"] == {"id": first_hot + 1, "reason": LINK_BROKEN}
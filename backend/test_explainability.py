@@ -0,0 +1,37 @@
+import numpy as np
+from sklearn.ensemble import GradientBoostingClassifier, GradientBoostingRegressor, RandomForestClassifier
+
+from explainability import explain_batch, prepare_explainer
+
+
+def training_data():
+    rng = np.random.default_rng(0)
+    X = rng.random((300, 6)).astype(np.float32)
+    y = (X[:, 0] + 0.3 * X[:, 1] > 0.7).astype(int)
+    return X, y
+
+
+def test_contributions_add_up_to_forest_and_boosted_outputs():
+    X, y = training_data()
+    forest = RandomForestClassifier(n_estimators=20, random_state=0).fit(X, y)
+    # The distilled "gbt" student regresses the probability of good
+    boosted = GradientBoostingRegressor(n_estimators=50, max_depth=3, subsample=0.8, random_state=0).fit(X, y)
+    prepare_explainer("test_mixed", {"forest": forest, "boosted": boosted}, X.shape[1])
+
+    expected = {
+        "forest": forest.predict_proba(X[:10])[:, 1],
+        "boosted": boosted.predict(X[:10]),
+    }
+    for names, output in [
+        (["forest"], expected["forest"]),
+        (["boosted"], expected["boosted"]),
+        (None, (expected["forest"] + expected["boosted"]) / 2),
+    ]:
+        base, contributions = explain_batch("test_mixed", X[:10], names)
+        np.testing.assert_allclose(base + contributions.sum(axis=1), output, atol=1e-5)
+
+
+def test_boosted_classifiers_are_not_explained():
+    X, y = training_data()
+    classifier = GradientBoostingClassifier(n_estimators=5, random_state=0).fit(X, y)
+    assert prepare_explainer("test_boosted_classifier", {"boosted": classifier}, X.shape[1]) is None
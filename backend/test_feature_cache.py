@@ -0,0 +1,32 @@
+import numpy as np
+
+from feature_cache import FeatureCache
+
+
+def test_digest_ending_in_nul_survives_reopen(tmp_path):
+    hashes = ["ab" * 31 + "00", "00" * 32, "cd" * 32]
+    X = np.arange(len(hashes) * 4, dtype=np.float32).reshape(-1, 4)
+    cache = FeatureCache(str(tmp_path), "v1", 4)
+    assert cache.add(hashes, X) == 3
+
+    reopened = FeatureCache(str(tmp_path), "v1", 4)
+    assert reopened.missing(hashes) == []
+    assert all(sha256 in reopened for sha256 in hashes)
+    matrix, found = reopened.matrix(hashes)
+    assert found.all()
+    np.testing.assert_array_equal(matrix, X)
+    assert reopened.add(hashes, X) == 0
+    assert reopened.parts == 1
+
+
+def test_reads_parts_with_bytes_keys(tmp_path):
+    # Parts written with the old "S32" keys, which lost trailing NULs
+    hashes = ["ab" * 31 + "00", "cd" * 32]
+    directory = tmp_path / "v1"
+    directory.mkdir()
+    np.save(directory / "part-old.features.npy", np.ones((2, 4), dtype=np.float32))
+    np.save(directory / "part-old.keys.npy", np.array([bytes.fromhex(h) for h in hashes], dtype="S32"))
+
+    cache = FeatureCache(str(tmp_path), "v1", 4)
+    assert cache.missing(hashes) == []
+    assert cache.matrix(hashes)[1].all()
@@ -0,0 +1,81 @@
+"""
+Helpers for reading labelled feature tables produced by the training notebook
+(processed_features_<FOCAL_PLANE>.csv) for offline evaluation tools
+"""
+
+from typing import Dict, List, Optional, Tuple
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+
+from main import FEATURE_NAMES
+
+# The notebook names the four temporal columns differently from the backend;
+# they occupy the same positions in the 20-feature vector.
+NOTEBOOK_TEMPORAL_COLUMNS = {
+    'mean_motion': 'frame_number',
+    'std_motion': 'time_elapsed',
+    'max_motion': 'frames_analyzed',
+    'development_speed': 'total_duration',
+}
+
+
+def read_feature_table(path: str) -> pd.DataFrame:
+    """Read a CSV or Parquet feature table"""
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    return pd.read_csv(path)
+
+
+def load_labelled_features(path: str, limit: Optional[int] = None,
+                           seed: int = 42) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+    """
+    Load (X, y, image_ids) with X columns in FEATURE_NAMES order.
+    `limit` draws a reproducible random sample of rows.
+    """
+    df = read_feature_table(path).rename(columns=NOTEBOOK_TEMPORAL_COLUMNS)
+    missing = [name for name in FEATURE_NAMES if name not in df.columns]
+    if missing:
+        raise ValueError(f"{path} is missing feature columns: {', '.join(missing)}")
+    if 'label' not in df.columns:
+        raise ValueError(f"{path} has no 'label' column")
+
+    if limit is not None and limit < len(df):
+        df = df.sample(n=limit, random_state=seed)
+
+    X = df[FEATURE_NAMES].to_numpy(dtype=np.float64)
+    y = df['label'].to_numpy(dtype=np.int64)
+    if 'image_id' in df.columns:
+        image_ids = df['image_id'].astype(str).tolist()
+    else:
+        image_ids = [str(i) for i in df.index]
+    return X, y, image_ids
+
+
+def phase_label(stages: List[str]) -> int:
+    """
+    Quality label from an embryo's reached developmental stages, as derived in
+    the training notebook: good (1) with >=12 stages including t8, or >=10
+    stages including t4 and t8; otherwise not good (0).
+    """
+    if len(stages) >= 12 and 't8' in stages:
+        return 1
+    if len(stages) >= 10 and 't4' in stages and 't8' in stages:
+        return 1
+    return 0
+
+
+def load_phase_labels(annotations_dir: str) -> Dict[str, int]:
+    """embryo_id -> label for every <embryo_id>_phases.csv in the annotations folder"""
+    labels = {}
+    for path in glob.glob(os.path.join(annotations_dir, '*_phases.csv')):
+        embryo_id = os.path.basename(path)[:-len('_phases.csv')]
+        try:
+            phases = pd.read_csv(path)
+        except Exception:
+            continue
+        stages = [str(stage) for stage in phases.iloc[:, 0].values] if len(phases.columns) else []
+        labels[embryo_id] = phase_label(stages)
+    return labels
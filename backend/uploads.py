@@ -0,0 +1,243 @@
+"""
+Bounded, streaming multipart upload handling for /predict
+
+FastAPI's UploadFile buffers the whole request before the endpoint runs and
+only then lets it validate anything. read_prediction_upload instead parses
+the request body as it arrives:
+
+- a declared Content-Length over the limit is rejected before reading
+- the prediction_data part is validated as soon as it is complete, so when
+  it is sent before the file (as the frontend does) bad metadata is rejected
+  before the image body is read
+- each file part is size-limited while streaming, its magic bytes are checked
+  once the first bytes arrive, and it is hashed incrementally
+"""
+
+from typing import Callable, Dict, Optional, Type
+import hashlib
+import json
+import os
+
+from fastapi import HTTPException, Request
+from pydantic import BaseModel, ValidationError
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+from schemas import PredictionRequestData
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "20")) * 1024 * 1024
+# Headers, boundaries and the prediction_data field on top of the file itself
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+MAX_FIELD_BYTES = 16 * 1024
+SNIFF_BYTES = 16
+
+# (format, media type, signature check) for the image types PIL decodes for us
+IMAGE_SIGNATURES = (
+    ("jpeg", "image/jpeg", lambda head: head.startswith(b"\xff\xd8\xff")),
+    ("png", "image/png", lambda head: head.startswith(b"\x89PNG\r\n\x1a\n")),
+    ("webp", "image/webp", lambda head: head[:4] == b"RIFF" and head[8:12] == b"WEBP"),
+    ("bmp", "image/bmp", lambda head: head.startswith(b"BM")),
+    ("tiff", "image/tiff", lambda head: head[:4] in (b"II*\x00", b"MM\x00*")),
+    ("gif", "image/gif", lambda head: head[:6] in (b"GIF87a", b"GIF89a")),
+)
+
+# Time-lapse exports accepted by resumable uploads and decoded with OpenCV
+VIDEO_SIGNATURES = (
+    ("mov", "video/quicktime", lambda head: head[4:8] == b"ftyp" and head[8:12] == b"qt  "),
+    ("mp4", "video/mp4", lambda head: head[4:8] == b"ftyp"),
+    ("avi", "video/x-msvideo", lambda head: head[:4] == b"RIFF" and head[8:12] == b"AVI "),
+    ("mkv", "video/x-matroska", lambda head: head.startswith(b"\x1a\x45\xdf\xa3")),
+)
+
+
+def sniff_video_format(head: bytes) -> Optional[tuple]:
+    """(format, media type) for supported video containers, or None"""
+    for video_format, media_type, matches in VIDEO_SIGNATURES:
+        if matches(head):
+            return video_format, media_type
+    return None
+
+
+def sniff_image_format(head: bytes) -> Optional[tuple]:
+    """(format, media type) from the leading bytes, or None if unsupported"""
+    for image_format, media_type, matches in IMAGE_SIGNATURES:
+        if matches(head):
+            return image_format, media_type
+    return None
+
+
+def parse_prediction_data(raw: bytes, schema: Type[BaseModel] = PredictionRequestData) -> BaseModel:
+    try:
+        return schema.model_validate(json.loads(raw))
+    except json.JSONDecodeError as e:
+        raise HTTPException(status_code=422, detail=f"prediction_data is not valid JSON: {e.msg}")
+    except ValidationError as e:
+        problems = "; ".join(f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in e.errors())
+        raise HTTPException(status_code=422, detail=f"Invalid prediction_data: {problems}")
+
+
+class UploadedFile:
+    """One file part: size-limited, sniffed and hashed while it streams"""
+
+    def __init__(self, field: str, max_bytes: int, filename: Optional[str] = None,
+                 declared_content_type: Optional[str] = None):
+        self.field = field
+        self.max_bytes = max_bytes
+        self.filename = filename
+        self.declared_content_type = declared_content_type
+        self.image_format: Optional[str] = None
+        self.content_type: Optional[str] = None
+        self.contents: Optional[bytes] = None
+        self.sha256: Optional[str] = None
+        self.size = 0
+        self._hasher = hashlib.sha256()
+        self._chunks = []
+        self._head = b""
+
+    def add_data(self, data: bytes):
+        if self.size + len(data) > self.max_bytes:
+            raise HTTPException(status_code=413, detail=f"Upload exceeds the {self.max_bytes // (1024 * 1024)} MB limit")
+        self.size += len(data)
+        self._chunks.append(data)
+        self._hasher.update(data)
+        if self.image_format is None and len(self._head) < SNIFF_BYTES:
+            self._head += data[:SNIFF_BYTES - len(self._head)]
+            if len(self._head) == SNIFF_BYTES:
+                self.check_format()
+
+    def check_format(self):
+        sniffed = sniff_image_format(self._head)
+        if sniffed is None:
+            raise HTTPException(status_code=415, detail=f"Unsupported file type for '{self.field}'; expected a JPEG, PNG, WebP, BMP, TIFF or GIF image")
+        self.image_format, self.content_type = sniffed
+
+    def finish(self):
+        if not self.size:
+            raise HTTPException(status_code=400, detail=f"Uploaded file '{self.field}' is empty")
+        if self.image_format is None:
+            self.check_format()
+        self.sha256 = self._hasher.hexdigest()
+        self.contents = b"".join(self._chunks)
+        self._chunks = []
+
+
+class PredictionUpload:
+    """
+    The parsed request: validated metadata plus the bounded, hashed files by
+    field name. The single-file attributes used by /predict refer to `file_field`.
+    """
+
+    def __init__(self, file_field: str = "file"):
+        self.file_field = file_field
+        self.metadata: Optional[BaseModel] = None
+        self.files: Dict[str, UploadedFile] = {}
+
+    def _file(self) -> UploadedFile:
+        return self.files[self.file_field]
+
+    filename = property(lambda self: self._file().filename)
+    declared_content_type = property(lambda self: self._file().declared_content_type)
+    image_format = property(lambda self: self._file().image_format)
+    content_type = property(lambda self: self._file().content_type)
+    contents = property(lambda self: self._file().contents)
+    sha256 = property(lambda self: self._file().sha256)
+    size = property(lambda self: self._file().size)
+
+
+async def read_prediction_upload(request: Request, max_bytes: int = MAX_UPLOAD_BYTES,
+                                 file_field: str = "file", metadata_field: str = "prediction_data",
+                                 accept_file: Optional[Callable[[str], bool]] = None,
+                                 max_files: int = 1,
+                                 metadata_schema: Type[BaseModel] = PredictionRequestData) -> PredictionUpload:
+    """
+    Stream-parse a multipart prediction request, raising HTTPException as soon
+    as it is invalid. By default exactly one file part named `file_field` is
+    expected; pass `accept_file` (a predicate on part names) and `max_files`
+    to accept several, each limited to `max_bytes`. The metadata field is
+    validated against `metadata_schema`.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data request")
+
+    declared_length = request.headers.get("content-length")
+    if declared_length and declared_length.isdigit() and int(declared_length) > max_bytes * max_files + MULTIPART_OVERHEAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds the {max_bytes * max_files // (1024 * 1024)} MB limit")
+
+    is_file_field = accept_file or (lambda name: name == file_field)
+    upload = PredictionUpload(file_field)
+    part: Dict = {}
+    header_field = bytearray()
+    header_value = bytearray()
+
+    def on_part_begin():
+        part.clear()
+        part.update(headers={}, name=None, file=None, data=bytearray())
+
+    def on_header_field(data: bytes, start: int, end: int):
+        header_field.extend(data[start:end])
+
+    def on_header_value(data: bytes, start: int, end: int):
+        header_value.extend(data[start:end])
+
+    def on_header_end():
+        part["headers"][bytes(header_field).lower()] = bytes(header_value)
+        header_field.clear()
+        header_value.clear()
+
+    def on_headers_finished():
+        _, disposition = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        name = disposition.get(b"name")
+        filename = disposition.get(b"filename")
+        part["name"] = name.decode("latin-1") if name is not None else None
+        if part["name"] is not None and part["name"] != metadata_field and is_file_field(part["name"]):
+            if part["name"] in upload.files:
+                raise HTTPException(status_code=400, detail=f"Only one '{part['name']}' part is allowed")
+            if len(upload.files) >= max_files:
+                raise HTTPException(status_code=400, detail=f"At most {max_files} files are allowed")
+            declared = part["headers"].get(b"content-type")
+            part["file"] = UploadedFile(
+                part["name"], max_bytes,
+                filename.decode("latin-1") if filename is not None else None,
+                declared.decode("latin-1") if declared else None
+            )
+            upload.files[part["name"]] = part["file"]
+
+    def on_part_data(data: bytes, start: int, end: int):
+        if part["file"] is not None:
+            part["file"].add_data(data[start:end])
+            return
+        if len(part["data"]) + (end - start) > MAX_FIELD_BYTES:
+            raise HTTPException(status_code=413, detail=f"Form field '{part['name']}' is too large")
+        part["data"].extend(data[start:end])
+
+    def on_part_end():
+        if part["file"] is not None:
+            part["file"].finish()
+        elif part["name"] == metadata_field:
+            upload.metadata = parse_prediction_data(bytes(part["data"]), metadata_schema)
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+    })
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+        parser.finalize()
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Malformed multipart body: {str(e)}")
+
+    if upload.metadata is None:
+        raise HTTPException(status_code=422, detail=f"Missing '{metadata_field}' form field")
+    if accept_file is None and file_field not in upload.files:
+        raise HTTPException(status_code=422, detail=f"Missing '{file_field}' upload")
+    if not upload.files:
+        raise HTTPException(status_code=422, detail="No files uploaded")
+    return upload
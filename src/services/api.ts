@@ -160,13 +160,15 @@ class ApiService {
     cycleId: string,
     embryoIdentifier: string
   ): Promise<any> {
+    // prediction_data goes first so the backend can reject bad metadata
+    // before it reads the image body
     const formData = new FormData();
-    formData.append('file', imageFile);
     formData.append('prediction_data', JSON.stringify({
       patient_audit_code: patientCode,
       cycle_id: cycleId,
       embryo_id: embryoIdentifier,
     }));
+    formData.append('file', imageFile);
 
     const headers: Record<string,string> = {};
     if (this.token) {